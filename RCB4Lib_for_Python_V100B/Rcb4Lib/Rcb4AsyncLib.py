@@ -0,0 +1,443 @@
+
+#coding: UTF-8
+
+##
+##	@file Rcb4AsyncLib.py
+##	@brief RCB4 asyncio library
+##
+##	Rcb4BaseLibのコマンド生成関数をそのまま使い、送受信だけをasyncioのイベントループで行います。
+##	Serialポートのファイルディスクリプタをイベントループのreader/writerに登録するので、
+##	送受信用のスレッドは必要ありません。
+##	@warning	add_reader()を使うため、POSIX(Linux,RaspberryPi,macOS)専用です
+##
+
+import asyncio
+import os
+
+import serial
+
+from Rcb4BaseLib import Rcb4BaseLib
+
+
+##	@class	AsyncRcb4
+#	@brief	RCB4をasyncioから動かすためのクラスです。
+#	@note	コマンドの作成はRcb4BaseLibの静的関数を使います
+class AsyncRcb4:
+
+    ##	@brief	バージョン番号
+    Version = Rcb4BaseLib.Version
+
+    ##	@brief	COMのデバイス名
+    com = 0
+
+    ##	@brief __init__ コンストラクタ
+    #	@param loop	使用するイベントループ(Noneのときはopen()時に実行中のループ)
+    def __init__(self, loop = None):
+        self.__loop = loop
+        self.__lock = None
+        self.__fd = -1
+        self.__timeout = 1.3
+        ##	@brief	返信の待ち時間で、通信時間に足す余裕(秒)
+        self.TimeoutSlack = Rcb4BaseLib.TimeoutSlack
+        ##	@brief	ROM=>COMの待ち時間で、通信時間に足す余裕(秒)
+        self.RomTimeoutSlack = Rcb4BaseLib.RomTimeoutSlack
+        self.__rxbuf = bytearray()
+        self.__rxLen = 0
+        self.__rxFuture = None
+        self.__configData = 0
+
+
+    #/////////////////////////////////////////////////////////////////////////////////////////
+    #//通信関係
+    #/////////////////////////////////////////////////////////////////////////////////////////
+
+    #////////////////////////////////////////////////////////////////////
+    #//	Serialポートを設定をして開く
+    #//
+	##	@brief	SerialポートをRCB-4用に設定をして開く
+    #	@param	comName	ポートの名前
+    #	@param	bundrate	通信速度
+    #	@param	timOut	受信タイムアウト(コマンドごとの待ち時間の上限) Noneのときは上限なし
+    #	@param	slack	返信の待ち時間で通信時間に足す余裕(秒) NoneのときはRcb4BaseLib.TimeoutSlack
+    #	@param	romSlack	ROM=>COMの待ち時間で通信時間に足す余裕(秒) NoneのときはRcb4BaseLib.RomTimeoutSlack
+    #	@retval	True：ポートを開いてコンフィグデータを取得できた
+    #	@retval	False:ポートを開けなかったか、コンフィグデータを取得できなかった
+    #	@note	Rcb4BaseLib.open()と同じ手順をノンブロッキングで行います
+    async def open(self, comName, bundrate, timOut, slack = None, romSlack = None):
+        if self.com != 0:
+            return False
+        if self.__loop is None:
+            self.__loop = asyncio.get_running_loop()
+        self.__lock = asyncio.Lock()
+        self.__timeout = timOut
+        if slack is not None:
+            self.TimeoutSlack = slack
+        if romSlack is not None:
+            self.RomTimeoutSlack = romSlack
+        try:
+            self.com = serial.Serial(comName, bundrate, parity='E', stopbits=1, timeout=0)
+            self.com.flushInput()
+            self.__fd = self.com.fileno()
+            self.__loop.add_reader(self.__fd, self.__onReadable)
+        except Exception:
+            self.close()
+            return False
+
+        if await self.checkAcknowledge() == False:
+            return False
+        #ACKが成功した場合Configデータを取得
+        confData = await self.getConfig()
+        if confData == 0xFFFF:
+            return False
+        self.__configData = confData
+        return True
+
+
+    #////////////////////////////////////////////////////////////////////
+    #//	Serialポートを閉じる
+    #//
+    ##	@brief	Serialポートを閉じる
+    #	@retval	Serialポートを閉じるのに失敗したらエラーを返す
+    def close(self):
+        try:
+            if self.__fd >= 0:
+                self.__loop.remove_reader(self.__fd)
+                self.__loop.remove_writer(self.__fd)
+                self.__fd = -1
+            if self.__rxFuture is not None and not self.__rxFuture.done():
+                self.__rxFuture.set_result(b'')
+            self.com.close()
+            self.com = 0
+            return 0
+        except Exception:
+            return -1
+
+
+    ##	@brief	受信可能になったときにイベントループから呼ばれる
+    #	@note	返信待ちでないときに届いたデータは捨てます(flushInputと同じ扱い)
+    def __onReadable(self):
+        try:
+            data = os.read(self.__fd, 256)
+        except (BlockingIOError, InterruptedError):
+            return
+        future = self.__rxFuture
+        if future is None or future.done():
+            return
+        self.__rxbuf += data
+        if len(self.__rxbuf) >= self.__rxLen:
+            future.set_result(bytes(self.__rxbuf[:self.__rxLen]))
+
+
+    ##	@brief	送信データを書き込む
+    #	@note	一度に書き込めなかった分は書き込み可能になるのを待って書き込みます
+    async def __write(self, data):
+        view = memoryview(data)
+        while len(view) > 0:
+            try:
+                written = os.write(self.__fd, view)
+            except (BlockingIOError, InterruptedError):
+                written = 0
+            view = view[written:]
+            if len(view) > 0:
+                ready = self.__loop.create_future()
+                self.__loop.add_writer(self.__fd, ready.set_result, None)
+                try:
+                    await ready
+                finally:
+                    self.__loop.remove_writer(self.__fd)
+
+
+    #////////////////////////////////////////////////////////////////////
+    #//	実際に送受信を行う
+    #//
+    ##	@brief	実際に送受信を行う
+    #	@param	txBuf	送信データの配列
+    #	@param	rxLen	受信データ数
+    #	@retval	rxbuf	受信データ
+    #					配列数0の場合は失敗になります
+    #	@note	Rcb4BaseLib.synchronize()のasyncio版です
+    #	@note	同時に呼ばれた場合は、前の送受信が終わるまで待ってから送受信します
+    async def synchronize(self, txBuf, rxLen):
+        #送られてきたデータのチェック
+        if self.com == 0 or len(txBuf) == 0 or rxLen <= 3:
+            return []
+        if not isinstance(txBuf, (bytes, bytearray)):
+            for data in txBuf:
+                if data < 0 or 255 < data:
+                    return []
+            txBuf = bytes(txBuf)
+
+        rxbuf = await self.__exchange(txBuf, rxLen)
+        if len(rxbuf) == rxLen and rxbuf[0] == rxLen and rxbuf[rxLen - 1] == Rcb4BaseLib.CheckSum(rxbuf):
+            return rxbuf
+        return []
+
+
+    ##	@brief	コマンドの返信を待つ時間を計算する
+    #	@note	Rcb4BaseLib.transactionTimeout()と同じく、通信時間に余裕を足した時間でopen()のtimOutが上限です(Noneのときは上限なし)
+    def __transactionTimeout(self, txBuf, rxLen):
+        if len(txBuf) > 2 and txBuf[1] == Rcb4BaseLib.CommandTypes.Move.value and txBuf[2] == Rcb4BaseLib.SubMoveCmd.RomToCom.value:
+            slack = self.RomTimeoutSlack
+        else:
+            slack = self.TimeoutSlack
+        timeout = (len(txBuf) + rxLen) * 11 / self.com.baudrate + slack
+        if self.__timeout is None:
+            return timeout
+        return min(timeout, self.__timeout)
+
+
+    ##	@brief	送信してから指定したbyte数を受信する
+    #	@retval	受信データ(失敗時はb'')
+    #	@note	返信の中身の確認はしません
+    async def __exchange(self, txBuf, rxLen):
+        async with self.__lock:
+            self.__rxbuf.clear()
+            self.__rxLen = rxLen
+            self.__rxFuture = self.__loop.create_future()
+            try:
+                await self.__write(txBuf)
+                return await asyncio.wait_for(self.__rxFuture, self.__transactionTimeout(txBuf, rxLen))
+            except (asyncio.TimeoutError, OSError):
+                return b''
+            finally:
+                self.__rxFuture = None
+
+
+    #////////////////////////////////////////////////////////////////////
+    #//	送受信後ＡＣＫ判定
+    #//
+    ##	@brief	送受信後ＡＣＫ判定
+    #	@param	txData	ACKコマンドが入ったデータ配列
+    #	@retval	ACKが正常に返ってきたかどうか判断
+    async def synchronizeAck(self, txData):
+        rxbuf = await self.synchronize(txData, 4)
+        return len(rxbuf) > 3 and Rcb4BaseLib.AckType.Ack.value == rxbuf[2]
+
+
+    ##	@brief	ACKが返ってくる複数のコマンドをまとめて送受信する
+    #	@param	txDatas	送信データの配列の配列
+    #	@retval	True	すべてのコマンドのACKが正常に返ってきた
+    #	@note	Rcb4BaseLib.synchronizeAckBatch()のasyncio版です(1回の書き込みで全部送ります)
+    async def synchronizeAckBatch(self, txDatas):
+        if self.com == 0 or len(txDatas) == 0:
+            return False
+        txBuf = bytearray()
+        for txData in txDatas:
+            for data in txData:
+                if data < 0 or 255 < data:
+                    return False
+            txBuf += bytes(txData)
+
+        rxbuf = await self.__exchange(txBuf, 4 * len(txDatas))
+        if len(rxbuf) != 4 * len(txDatas):
+            return False
+        for i in range(0, len(rxbuf), 4):
+            ack = rxbuf[i:i + 4]
+            if ack[0] != 4 or ack[2] != Rcb4BaseLib.AckType.Ack.value or ack[3] != Rcb4BaseLib.CheckSum(ack):
+                return False
+        return True
+
+
+    ##	@brief	ACKコマンドを送って通信ができているかどうか確認を行う
+    #	@retval	True	ACKコマンドが正常に返ってきた
+    #	@retval	False	ACKコマンドが正常でなかった
+    async def checkAcknowledge(self):
+        reSize, txbuf = Rcb4BaseLib.acknowledgeCmd()
+        rxbuf = await self.synchronize(txbuf, reSize)
+        return len(rxbuf) != 0
+
+
+    #/////////////////////////////////////////////////////////////////////////////////////////
+    #//	RAM・デバイス転送
+    #/////////////////////////////////////////////////////////////////////////////////////////
+
+    ##	@brief	COMからRAMにデータを転送します(COM ==> RAM)
+    #	@param	scrAddr	書き換えるRAMの転送アドレス
+    #	@param	destData	書き換えるデータ配列(1byteも可能)
+    #	@retval	True	データが正常に転送できた
+    #	@retval	False	データが正常に転送できなかった
+    async def moveComToRamCmdSynchronize(self, scrAddr, destData):
+        readSize, sendData = Rcb4BaseLib.moveComToRamCmd(scrAddr, destData)
+        if readSize <= 0:
+            return False
+        return await self.synchronizeAck(sendData)
+
+
+    ##	@brief	RAM上のデータをCOMに出力します(RAM ==> COM)
+    #	@param	scrAddr	取得するデータの先頭アドレス
+    #	@param	scrDataSize	取得するデータbyte数
+    #	@return	(retf,rxbuf)
+    #	@retval	retf	True:正常にデータが返ってきた	False:正常にデータが返ってこなかった
+    #	@retval	rxbuf	コマンドを除いた受信したデータ
+    async def moveRamToComCmdSynchronize(self, scrAddr, scrDataSize):
+        readSize, sendData = Rcb4BaseLib.moveRamToComCmd(scrAddr, scrDataSize)
+        if readSize <= 0:
+            return False, []
+        rxbuf = await self.synchronize(sendData, readSize)
+        if len(rxbuf) < readSize:
+            return False, []
+        return True, bytes(rxbuf[2:2 + scrDataSize])
+
+
+    ##	@brief	COMからDevice部分にデータを転送する(COM ==> Device)
+    #	@param	icsNum	書き込むICSデバイスの番号(IDとSIOから計算した値)
+    #	@param	offset	書き込むデータのオフセットアドレス
+    #	@param	destData	書き込むデータ
+    #	@retval	True:正常にデータが返ってきた
+    #	@retval	False:正常にデータが返ってこなかった
+    async def moveComToDeviceCmdSynchronize(self, icsNum, offset, destData):
+        readSize, sendData = Rcb4BaseLib.moveComToDeviceCmd(icsNum, offset, destData)
+        if readSize <= 0:
+            return False
+        return await self.synchronizeAck(sendData)
+
+
+    ##	@brief	Device部分からCOMにデータを転送する(Device ==> COM)
+    #	@param	icsNum	読み込むICSデバイスの番号(IDとSIOから計算した値)
+    #	@param	offset	読み込むデータのオフセットアドレス
+    #	@param	dataSize	読み込むデータ数
+    #	@return	(retf,rxbuf)
+    #	@retval	retf	True:正常にデータが返ってきた	False:正常にデータが返ってこなかった
+    #	@retval	rxbuf	コマンドを除いた受信したデータ
+    async def moveDeviceToComCmdSynchronize(self, icsNum, offset, dataSize):
+        readSize, sendData = Rcb4BaseLib.moveDeviceToComCmd(icsNum, offset, dataSize)
+        if readSize <= 0:
+            return False, []
+        rxbuf = await self.synchronize(sendData, readSize)
+        if len(rxbuf) < readSize:
+            return False, []
+        return True, bytes(rxbuf[2:2 + dataSize])
+
+
+    ##	@brief	コンフィグデータを取得する
+    #	@retval	config	Configに書かれているデータ
+    #	@retval	0xFFFF	データが正常に受信できなかった
+    async def getConfig(self):
+        retf, rxbuf = await self.moveRamToComCmdSynchronize(Rcb4BaseLib.RamAddr.ConfigRamAddress.value, 2)
+        if (retf == False) or (len(rxbuf) != 2):
+            return 0xFFFF
+        return rxbuf[1] * 256 + rxbuf[0]
+
+
+    #/////////////////////////////////////////////////////////////////////////////////////////
+    #//	サーボモータ
+    #/////////////////////////////////////////////////////////////////////////////////////////
+
+    ##	@brief	複数のサーボモータを同時に動かす
+    #	@param	servoDatas	サーボモータのデータが保存されている配列
+    #	@param	frame	サーボモータを動かすフレーム数
+    #	@retval	True	正常にデータを送信
+    #	@retval	False	データが正常に送信できなかった
+    async def setServoPos(self, servoDatas, frame):
+        rxSize, txbuf = Rcb4BaseLib.runConstFrameServoCmd(servoDatas, frame)
+        return await self.synchronizeAck(txbuf)
+
+
+    ##	@brief	ひな形を使って複数のサーボモータを同時に動かす
+    #	@param	template	Rcb4BaseLib.compileConstFrameTemplate()で作成したひな形
+    #	@param	positions	ポジションデータの配列
+    #	@param	frame	サーボモータを動かすフレーム数
+    #	@retval	True	正常にデータを送信
+    #	@retval	False	データが正常に送信できなかった
+    async def setServoPosTemplate(self, template, positions, frame):
+        txbuf = template.setPos(positions, frame)
+        if txbuf is None:
+            return False
+        return await self.synchronizeAck(txbuf)
+
+
+    ##	@brief	サーボモータの単体を動かす
+    #	@param	id	サーボモータのID番号
+    #	@param	sio	SIOのつながっている番号
+    #	@param	pos	サーボモータのポジションデータ(0x8000(FREE),0x7FFF(Hold),3500-11500)
+    #	@param	frame	フレーム周期
+    #	@retval	True	正常にデータを送信
+    #	@retval	False	データが正常に送信できなかった
+    async def setSingleServo(self, id, sio, pos, frame):
+        rxSize, txbuf = Rcb4BaseLib.runSingleServoCmd(id, sio, pos, frame)
+        return await self.synchronizeAck(txbuf)
+
+
+    #/////////////////////////////////////////////////////////////////////////////
+    #//	モーション関連
+    #/////////////////////////////////////////////////////////////////////////////
+
+    ##	@brief	現在再生されているモーションの番号を取得します。
+    #	@retval	モーション番号
+    #	@retval	0	どのモーションも再生されていない
+    #	@retval	-1	通信失敗
+    #	@retval	-2	再生されている場所が異常である
+    async def getMotionPlayNum(self):
+        retf, retbuf = await self.moveRamToComCmdSynchronize(Rcb4BaseLib.RamAddr.ProgramCounterRamAddress.value, 10)
+        if (retf == False) or (len(retbuf) != 10):
+            return -1
+        return Rcb4BaseLib.decodeMotionPlayNum(retbuf)
+
+
+    ##	@brief	モーションを一時停止させる
+    #	@retval	True	通信成功
+    #	@retval	False	失敗成功
+    #	@note	Rcb4BaseLib.suspend()と同じconfigデータを書き込みます
+    async def suspend(self):
+        self.__configData = Rcb4BaseLib.suspendedConfig(self.__configData)
+        txbuf = [self.__configData & 0xff, (self.__configData >> 8) & 0xff]
+        return await self.moveComToRamCmdSynchronize(Rcb4BaseLib.RamAddr.ConfigRamAddress.value, txbuf)
+
+
+    ##	@brief	モーションをリスタートさせます
+    #	@retval	True	通信成功
+    #	@retval	False	失敗成功
+    #	@note	Rcb4BaseLib.resume()と同じconfigデータを書き込みます
+    async def resume(self):
+        self.__configData = Rcb4BaseLib.resumedConfig(self.__configData)
+        buf = [self.__configData & 0xff, (self.__configData >> 8) & 0xff]
+        return await self.moveComToRamCmdSynchronize(Rcb4BaseLib.RamAddr.ConfigRamAddress.value, buf)
+
+
+    ##	@brief	プログラムカウンタをリセットします
+    #	@retval	True	通信成功
+    #	@retval	False	失敗成功
+    async def resetProgramCounter(self):
+        buf = [Rcb4BaseLib.RomAddr.MainLoopCmd.value & 0xff, (Rcb4BaseLib.RomAddr.MainLoopCmd.value >> 8) & 0xff, 0, 0, 0, 0, 0, 0, 0, 0]
+        return await self.moveComToRamCmdSynchronize(Rcb4BaseLib.RamAddr.ProgramCounterRamAddress.value, buf)
+
+
+    ##	@brief	モーションのアドレスにジャンプします
+    #	@param	motionNum	モーション番号
+    #	@retval	True	通信成功
+    #	@retval	False	失敗成功
+    async def setMotionNum(self, motionNum):
+        if not (0 < motionNum <= Rcb4BaseLib.MaxMotionCount):
+            return False
+        rxSize, buf = Rcb4BaseLib.callCmd((motionNum - 1) * Rcb4BaseLib.MotionSingleDataCount + Rcb4BaseLib.RomAddr.MotionRomAddress.value)
+        return await self.synchronizeAck(buf)
+
+
+    ##	@brief	指定したモーションを再生します
+    #	@param	motionNum	モーション番号
+    #	@retval	True	通信成功
+    #	@retval	False	失敗成功
+    #	@note	Rcb4BaseLib.motionPlay()と同じく、一時停止とプログラムカウンタのリセットを1回で書き込み、
+    #			ジャンプと復帰を続けて送ります(2往復)
+    async def motionPlay(self, motionNum):
+        if (motionNum <= 0) or (Rcb4BaseLib.MaxMotionCount < motionNum):
+            return False
+        config = Rcb4BaseLib.suspendedConfig(self.__configData)
+        mainLoop = Rcb4BaseLib.RomAddr.MainLoopCmd.value
+        buf = [config & 0xff, (config >> 8) & 0xff, mainLoop & 0xff, (mainLoop >> 8) & 0xff, 0, 0, 0, 0, 0, 0, 0, 0]
+        if await self.moveComToRamCmdSynchronize(Rcb4BaseLib.RamAddr.ConfigRamAddress.value, buf) == False:
+            return False
+        self.__configData = config
+
+        config = Rcb4BaseLib.resumedConfig(config)
+        rxSize, callBuf = Rcb4BaseLib.callCmd((motionNum - 1) * Rcb4BaseLib.MotionSingleDataCount + Rcb4BaseLib.RomAddr.MotionRomAddress.value)
+        rxSize, resumeBuf = Rcb4BaseLib.moveComToRamCmd(Rcb4BaseLib.RamAddr.ConfigRamAddress.value, [config & 0xff, (config >> 8) & 0xff])
+        if await self.synchronizeAckBatch([callBuf, resumeBuf]) == False:
+            return False
+        self.__configData = config
+        return True
+
+
+#/////////////////////////////////////////////////////////////////////////////
+#//	ここまで[EOF]
+#/////////////////////////////////////////////////////////////////////////////
@@ -27,6 +27,19 @@ from enum import Enum
 import serial
 from struct import *
 import struct     
+import json
+import os
+import threading
+import time
+from array import array
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+try:
+    import numpy as np
+except ImportError:	#numpyを使う関数以外はnumpyなしでも使えるようにしておく
+    np = None
 
 ##	@class	Rcb4BaseLib
 #	@brief	RCB4を動かすため初期設定やコマンドをまとめたクラスです。
@@ -57,6 +70,14 @@ class Rcb4BaseLib:
         AckCheck        = 0xFE
         _None            = 0xFF
 
+	##	@class	CommandPriority
+	#	@brief	スケジューラでのコマンドの優先度(数値が小さいほど先に送る)
+    class CommandPriority(Enum):
+        Safety    = 0	##!	フリー・ホールド等の安全に関わるコマンド
+        Servo     = 1	##!	サーボモータの角度指令
+        Motion    = 2	##!	モーションの制御や設定の書き込み
+        Telemetry = 3	##!	状態の読み出し
+
 	##	@class	SubMoveCmd
 	##	@brief	Moveのサブコマンドの列挙型
     class SubMoveCmd(Enum):
@@ -64,6 +85,7 @@ class Rcb4BaseLib:
         ComToRam     = 0x02	##!	COMからの数値をRAMへ
         DeviceToCom  = 0x21	##!	Device(ICS)の値をCOMへ
         ComToDevice  = 0x12	##!	COMからの数値をDevice(ICS)へ
+        RomToCom     = 0x23	##!	ROMの値をCOMへ
 
 	##	@class	RamAddr
 	#	@brief	RCB4のRAMのアドレス一覧
@@ -73,6 +95,7 @@ class Rcb4BaseLib:
         AdcRamAddress            = 0x0022		#//AD変換器0の値のアドレス(0x22固定)
         PioModeAddres	         = 0x0038		#//PIOの入出力設定(2017/07/26追記) 
         PioAddress               = 0x003A		#//PIOポート値
+        IcsDeviceRamAddress      = 0x0090		#//ICSデバイス0のデータ(この後IcsDeviceDataSize byteずつ続く)
         KrrButtonDataAddress     = 0x0350		#//KRRのボタンデータが記録されているアドレス
         KrrPa1Address            = 0x0352		#//PA1データ(この後2byteずつデータが続く)
         CounterRamAddress        = 0x0457		#//後2byteずつデータが続く)
@@ -184,6 +207,1160 @@ class Rcb4BaseLib:
          
         def __lt__(self,other):
              return (self.Id * 2 + (self.Sio- 1)) < (other.Id * 2 + (other.Sio -1))
+
+	##	@class	ServoFrame
+	##	@brief	複数のサーボモータのデータ(ポジション、スピード、ストレッチ)をICS番号ごとにまとめて持つクラス
+	#	@note	ServoDataの配列の代わりにsetServoPos()やrunConstFrameServoCmd()、setSpeedCmd()などに渡せます
+	#	@note	データはICS番号を添字としたarray('H')に、使うICS番号はbitマスクに持つので、
+	#			サーボごとのオブジェクトを作らず、ICS番号順へのソートも要りません
+    class ServoFrame:
+
+        ##	@brief __init__ コンストラクタ
+        #	@param servos	(id,sio,data)の配列(省略時は空)
+        def __init__(self,servos = ()):
+            ##	@brief	ICS番号を添字としたデータ(使っていないICS番号の値は意味を持たない)
+            self.Datas = array('H', bytes(2 * Rcb4BaseLib.IcsDeviceSize))
+            ##	@brief	使うICS番号のbitを立てたマスク(ConstFrameServo、ServoParamのサーボ指定と同じ並び)
+            self.Mask = 0
+            self.__icsNums = ()
+            for id, sio, data in servos:
+                self.set(id, sio, data)
+
+        ##	@brief set IDとSIOを指定してデータを設定する
+        #	@param id	サーボモータのID
+        #	@param sio	RCB4に接続されているSIOの番号(SIO1-4:0x01,SIO5-8:0x02)
+        #	@param data	ポジション、スピード、ストレッチなどのデータ
+        def set(self,id,sio,data):
+            self.setIcs(Rcb4BaseLib.icsNum2id(id, sio), data)
+
+        ##	@brief setIcs ICS番号を指定してデータを設定する
+        #	@note	ICS番号が範囲外の場合はIndexError、データがunsigned shortに収まらない場合はOverflowErrorになります
+        def setIcs(self,icsNum,data):
+            if not (0 <= icsNum < Rcb4BaseLib.IcsDeviceSize):
+                raise IndexError('icsNum %d' % icsNum)
+            self.Datas[icsNum] = data
+            bit = 1 << icsNum
+            if not (self.Mask & bit):
+                self.Mask |= bit
+                self.__icsNums = None
+
+        ##	@brief remove IDとSIOを指定してサーボモータを外す
+        def remove(self,id,sio):
+            bit = 1 << Rcb4BaseLib.icsNum2id(id, sio)
+            if self.Mask & bit:
+                self.Mask &= ~bit
+                self.__icsNums = None
+
+        ##	@brief clear すべてのサーボモータを外す
+        def clear(self):
+            self.Mask = 0
+            self.__icsNums = ()
+
+        ##	@brief icsNums 使うICS番号(小さい順のtuple)
+        #	@note	マスクが変わったときだけ作り直します
+        def icsNums(self):
+            if self.__icsNums is None:
+                self.__icsNums = tuple(i for i in range(Rcb4BaseLib.IcsDeviceSize) if (self.Mask >> i) & 1)
+            return self.__icsNums
+
+        ##	@brief datas 使うICS番号のデータ(ICS番号順)
+        def datas(self):
+            return [self.Datas[i] for i in self.icsNums()]
+
+        def __len__(self):
+            return len(self.icsNums())
+
+	##	@class	ConstFrameTemplate
+	##	@brief	サーボモータの組み合わせを固定したConstFrameServoコマンドのひな形
+	#	@note	ヘッダ、ICSのビットマスク、ポジションの並び順を一度だけ計算しておき、
+	#			毎フレームはポジションとフレーム数、チェックサムだけを書き換えます
+    class ConstFrameTemplate:
+
+        ##	@brief __init__ コンストラクタ
+        #	@param servoDatas	ServoDataの配列(Dataは使わない)
+        #	@note	servoDatasの並び順がsetPos()に渡すポジションの並び順になります
+        #	@warning	servoDatasはRcb4BaseLib.checkServoDatas()で確認済みのものを渡してください
+        def __init__(self,servoDatas):
+            count = len(servoDatas)
+            icsNums = [sData.icsNum2id() for sData in servoDatas]
+            wk = Rcb4BaseLib.setServoNo (servoDatas) >> 24
+
+            self.IcsNums = tuple(icsNums)
+            self.txbuf = bytearray(count * 2 + 9)
+            self.txbuf[0] = len(self.txbuf)
+            self.txbuf[1] = Rcb4BaseLib.CommandTypes.ConstFrameServo.value
+            for i in range(5):
+                self.txbuf[2 + i] = (wk >> (i * 8)) & 0xff
+
+            #フレーム数を除いたヘッダ部分の合計はここで計算しておく
+            self.__headerSum = sum(self.txbuf[0:7])
+            self.__posEnd = len(self.txbuf) - 1
+            self.__format = '<%dH' % count
+
+            #ICS番号順に並べるための入れ替え表(最初から並んでいればNone)
+            order = sorted(range(count), key=lambda i: icsNums[i])
+            if order == list(range(count)):
+                self.__order = None
+            else:
+                self.__order = order
+
+        ##	@brief setPos ポジションとフレーム数を書き換えて送信データを返す
+        #	@param positions	ポジションデータの配列(コンストラクタのservoDatasと同じ並び)
+        #	@param frame	サーボモータを動かすフレーム数
+        #	@retval	txbuf	コマンド全体のデータ配列(bytearray)
+        #	@retval	None	データ数が違うか、値がbyte/unsigned shortに収まらない
+        #	@warning	返されるbytearrayは使いまわされるので、次のsetPos()で書き換わります
+        def setPos(self,positions,frame):
+            if self.__order is not None:
+                positions = [positions[i] for i in self.__order]
+            try:
+                struct.pack_into(self.__format, self.txbuf, 8, *positions)
+                self.txbuf[7] = frame
+            except (struct.error, ValueError, TypeError):
+                return None
+            self.txbuf[self.__posEnd] = (self.__headerSum + frame + sum(self.txbuf[8:self.__posEnd])) & 0xff
+            return self.txbuf
+
+	##	@class	RxParser
+	##	@brief	受信データを少しずつ読み込んで返信コマンドを切り出すパーサ
+	#	@note	確保済みのbytearrayにreadinto()で読み込み、先頭のデータ数のbyteで区切ります
+	#	@note	データ数やチェックサムが合わないときは1byteずらして区切り直すので、
+	#			ノイズが入ってもタイムアウトを待たずに次の返信を拾えます
+    class RxParser:
+
+        ##	@brief __init__ コンストラクタ
+        #	@param size	受信バッファのbyte数(返信コマンドの最大長256より大きくしてください)
+        def __init__(self,size = 1024):
+            self.__buf = bytearray(size)
+            self.__view = memoryview(self.__buf)
+            self.__start = 0
+            self.__end = 0
+            ##	@brief	区切り直しで読み捨てたbyte数の累計
+            self.SkipCount = 0
+            ##	@brief	チェックサムが合わなかった回数の累計
+            self.ChecksumErrorCount = 0
+
+        ##	@brief clear 受信バッファを空にする
+        def clear(self):
+            self.__start = 0
+            self.__end = 0
+
+        ##	@brief pendingCount 受信済みでまだ区切っていないbyte数
+        def pendingCount(self):
+            return self.__end - self.__start
+
+        ##	@brief discard 受信済みのデータをすべて読み捨てる(flushInputの代わり)
+        #	@param com	Serialポート
+        #	@retval	読み捨てたbyte数
+        def discard(self,com):
+            count = self.__end - self.__start
+            self.clear()
+            waiting = com.in_waiting
+            while waiting > 0:
+                count += com.readinto(self.__view[:min(waiting, len(self.__buf))])
+                waiting = com.in_waiting
+            return count
+
+        ##	@brief readFrame 指定した長さの返信コマンドを1つ読み込む
+        #	@param com	Serialポート
+        #	@param rxLen	受信データ数
+        #	@param timeout	待ち時間(秒)
+        #	@retval	memoryview	返信コマンド全体(次にreadFrame()を呼ぶまで有効)
+        #	@retval	None	時間内に正しい返信コマンドが来なかった
+        #	@note	Serialポートのtimeoutは1回の読み込みの待ち時間なので、timeoutより短くしておくと期限どおりに返ります
+        def readFrame(self,com,rxLen,timeout):
+            deadline = time.monotonic() + timeout
+            while True:
+                frame = self.__parse(rxLen)
+                if frame is not None:
+                    return frame
+                if time.monotonic() >= deadline:
+                    return None
+
+                #足りない分(もう届いている分があればそれも)を読み込む
+                self.__compact()
+                want = max(rxLen - (self.__end - self.__start), com.in_waiting, 1)
+                want = min(want, len(self.__buf) - self.__end)
+                n = com.readinto(self.__view[self.__end:self.__end + want])
+                if n:
+                    self.__end += n
+
+        ##	@brief __parse バッファから返信コマンドを切り出す
+        def __parse(self,rxLen):
+            buf = self.__buf
+            while self.__end - self.__start >= rxLen:
+                #先頭がデータ数になっているところまで読み飛ばす
+                pos = buf.find(rxLen, self.__start, self.__end)
+                if pos < 0:
+                    self.SkipCount += self.__end - self.__start
+                    self.clear()
+                    return None
+                self.SkipCount += pos - self.__start
+                self.__start = pos
+                if self.__end - pos < rxLen:
+                    return None
+
+                last = pos + rxLen - 1
+                if sum(self.__view[pos:last]) & 0xff == buf[last]:
+                    self.__start = pos + rxLen
+                    return self.__view[pos:pos + rxLen]
+                #チェックサム異常は1byteずらして区切り直す
+                self.__start = pos + 1
+                self.SkipCount += 1
+                self.ChecksumErrorCount += 1
+            return None
+
+        ##	@brief __compact 読み終わった部分を詰めて後ろに空きを作る
+        def __compact(self):
+            if self.__start == self.__end:
+                self.clear()
+            elif self.__start > 0 and len(self.__buf) - self.__end < 256:
+                length = self.__end - self.__start
+                self.__buf[0:length] = self.__buf[self.__start:self.__end]
+                self.__start = 0
+                self.__end = length
+
+	##	@class	RamSnapshot
+	##	@brief	RAM上の複数のデータをまとめて読み込むためのクラス
+	#	@note	指定したデータをアドレス順に並べ、連続して読めるものを1回のRAM=>COMにまとめます
+	#	@note	読み込んだデータはbytearrayに保存し、取り出すときにstructで変換します(変換結果は次の読み込みまで保持)
+    class RamSnapshot:
+
+        ##	@brief	読み込めるデータの一覧 名前:(RAMアドレス,structのフォーマット)
+        Fields = {
+            'config'         : (0x0000, '<H'),		#コンフィグデータ
+            'programCounter' : (0x0002, '10s'),		#プログラムカウンタとフラグ
+            'adc'            : (0x0022, '<11H'),	#AD変換器0-10の値
+            'pioMode'        : (0x0038, '<H'),		#PIOの入出力設定
+            'pio'            : (0x003A, '<H'),		#PIOポート値
+            'krrButton'      : (0x0350, '>H'),		#KRRのボタンデータ(上位byteが先)
+            'krrPa'          : (0x0352, '4B'),		#KRRのPA1-4のデータ
+            'counter'        : (0x0457, '10B'),		#ユーザカウンタ1-10
+            'userParameter'  : (0x0462, '<20h'),	#ユーザ変数1-20
+        }
+
+        ##	@brief	1回のRAM=>COMで読み込む最大byte数
+        MaxBlockSize = 249
+
+        ##	@brief __init__ コンストラクタ
+        #	@param fields	読み込むデータの名前の配列(Fieldsのキー)
+        #	@param maxGap	このbyte数以下の隙間は、分けずに読み飛ばして1回で読み込む
+        #	@note	存在しない名前が入っていた場合はKeyErrorになります
+        def __init__(self,fields,maxGap = 64):
+            items = sorted((Rcb4BaseLib.RamSnapshot.Fields[name][0], struct.calcsize(Rcb4BaseLib.RamSnapshot.Fields[name][1]), name) for name in set(fields))
+
+            #連続して読めるものをまとめる [先頭アドレス,byte数,バッファ上の位置]
+            blocks = []
+            for addr, size, name in items:
+                if len(blocks) > 0:
+                    block = blocks[-1]
+                    end = max(block[0] + block[1], addr + size)
+                    if addr - (block[0] + block[1]) <= maxGap and end - block[0] <= Rcb4BaseLib.RamSnapshot.MaxBlockSize:
+                        block[1] = end - block[0]
+                        continue
+                blocks.append([addr, size, 0])
+
+            offset = 0
+            for block in blocks:
+                block[2] = offset
+                offset += block[1]
+
+            ##	@brief	読み込むブロックの一覧 (先頭アドレス,byte数,バッファ上の位置)
+            self.Blocks = [tuple(block) for block in blocks]
+            ##	@brief	最後に読み込みが成功した時刻(time.monotonic()) 0は未取得
+            self.Timestamp = 0
+            self.__offsets = {}
+            for addr, size, name in items:
+                for bAddr, bSize, bOffset in self.Blocks:
+                    if bAddr <= addr < bAddr + bSize:
+                        self.__offsets[name] = bOffset + (addr - bAddr)
+                        break
+            self.__buf = bytearray(offset)
+            self.__view = memoryview(self.__buf)
+            self.__cache = {}
+
+        ##	@brief setBlock 読み込んだブロックのデータを書き込む(readRamSnapshot()から呼ばれる)
+        def setBlock(self,index,data):
+            addr, size, offset = self.Blocks[index]
+            self.__view[offset:offset + size] = data
+
+        ##	@brief setUpdated 全ブロックの読み込みが終わったときに呼ぶ
+        def setUpdated(self):
+            self.__cache.clear()
+            self.Timestamp = time.monotonic()
+
+        ##	@brief raw 指定したデータの生のbyte列
+        #	@param name	データの名前
+        #	@retval	memoryview	(次の読み込みで書き換わります)
+        def raw(self,name):
+            offset = self.__offsets[name]
+            return self.__view[offset:offset + struct.calcsize(Rcb4BaseLib.RamSnapshot.Fields[name][1])]
+
+        ##	@brief get 指定したデータを変換して返す
+        #	@param name	データの名前
+        #	@retval	値が1つのものは数値、複数のものはtuple
+        def get(self,name):
+            value = self.__cache.get(name)
+            if value is None:
+                value = struct.unpack_from(Rcb4BaseLib.RamSnapshot.Fields[name][1], self.__buf, self.__offsets[name])
+                if len(value) == 1:
+                    value = value[0]
+                self.__cache[name] = value
+            return value
+
+        def __getitem__(self,name):
+            return self.get(name)
+
+        ##	@brief age 最後に読み込んでからの経過時間(秒)
+        def age(self):
+            return time.monotonic() - self.Timestamp
+
+        ##	@brief motionPlayNum programCounterから再生中のモーション番号を求める
+        #	@note	戻り値はRcb4BaseLib.getMotionPlayNum()と同じです
+        def motionPlayNum(self):
+            return Rcb4BaseLib.decodeMotionPlayNum(self.raw('programCounter'))
+
+        ##	@brief pioValue PIOの値(10bit以外はマスク)
+        def pioValue(self):
+            return self.get('pio') & 0x03ff
+
+        ##	@brief voltage AD0から求めたRCB4の電源電圧(V)
+        def voltage(self):
+            return self.get('adc')[0] * 5.0 / 1024 * 49 / 10
+
+	##	@class	IcsDeviceTable
+	##	@brief	ICSデバイスのデータ(IcsDeviceSize個 × IcsDeviceDataSize byte)をホスト側に写しておくクラス
+	#	@note	loadIcsDeviceTable()でまとめて読み込み、値を変えると変わったbyteだけに印を付けます
+	#	@note	applyIcsDeviceTable()で、印の付いたbyteをデバイスごとにまとめてCOM=>Deviceで書き込みます
+	#	@note	同じ値を書いた場合は印を付けないので、起動時にトリムやミキシングを設定し直しても変わった分しか送りません
+    class IcsDeviceTable:
+
+        ##	@brief	設定できるデータの一覧 名前:(デバイス内のオフセット,structのフォーマット)
+        Fields = {
+            'category'     : (0x00, 'B'),		#デバイスの種類
+            'id'           : (0x01, 'B'),		#ID
+            'trim'         : (0x02, '<h'),		#トリム
+            'motorPosition': (0x04, '<h'),		#実測値
+            'position'     : (0x06, '<H'),		#ポジション
+            'frame'        : (0x08, 'B'),		#フレーム数
+            'mixing1'      : (0x0E, '2s'),		#ミキシング1の参照先
+            'mixing1Ratio' : (0x10, 'B'),		#ミキシング1の倍率
+            'mixing2'      : (0x11, '2s'),		#ミキシング2の参照先
+            'mixing2Ratio' : (0x13, 'B'),		#ミキシング2の倍率
+        }
+
+        ##	@brief	RCB4が動作中に書き換えるbyte(実測値、ポジション、フレーム数とその後ろ)のオフセット
+        #	@note	この範囲は変更していなければ、書き込みをまとめるための隙間埋めに使いません
+        VolatileOffsets = range(0x04, 0x0E)
+
+        ##	@brief __init__ コンストラクタ
+        #	@param maxGap	同じデバイス内でこのbyte数以下の変わっていない隙間は、一緒に書き込んで1回にまとめる
+        def __init__(self,maxGap = 4):
+            self.maxGap = maxGap
+            ##	@brief	全デバイスのデータ(ICS番号 * IcsDeviceDataSize + オフセットの位置)
+            self.Data = bytearray(Rcb4BaseLib.IcsDeviceSize * Rcb4BaseLib.IcsDeviceDataSize)
+            ##	@brief	最後にボードから読み込んだ時刻(time.monotonic()) 0は未取得
+            self.Timestamp = 0
+            self.__dirty = bytearray(len(self.Data))
+
+        ##	@brief setLoaded ボードから読み込んだデータで置き換える(loadIcsDeviceTable()から呼ばれる)
+        #	@param data	読み込んだデータ
+        #	@param start	dataの先頭のData上の位置(0以外のときは一部だけを置き換え、Timestampは変えません)
+        #	@note	置き換えた範囲の変更の印は消えます
+        def setLoaded(self,data,start = 0):
+            self.Data[start:start + len(data)] = data
+            self.__dirty[start:start + len(data)] = bytes(len(data))
+            if start == 0 and len(data) == len(self.Data):
+                self.Timestamp = time.monotonic()
+
+        ##	@brief record 指定したデバイスのデータ
+        #	@retval	memoryview	IcsDeviceDataSize byte(読み込みや変更で書き換わります)
+        def record(self,icsNum):
+            start = icsNum * Rcb4BaseLib.IcsDeviceDataSize
+            return memoryview(self.Data)[start:start + Rcb4BaseLib.IcsDeviceDataSize]
+
+        ##	@brief get 指定したデバイスのデータを変換して返す
+        #	@param icsNum	ICS番号
+        #	@param name	データの名前(Fieldsのキー)
+        def get(self,icsNum,name):
+            offset, fmt = Rcb4BaseLib.IcsDeviceTable.Fields[name]
+            return struct.unpack_from(fmt, self.Data, icsNum * Rcb4BaseLib.IcsDeviceDataSize + offset)[0]
+
+        ##	@brief set 指定したデバイスのデータを変更する
+        #	@param icsNum	ICS番号
+        #	@param name	データの名前(Fieldsのキー)
+        #	@param value	値
+        def set(self,icsNum,name,value):
+            offset, fmt = Rcb4BaseLib.IcsDeviceTable.Fields[name]
+            self.write(icsNum, offset, struct.pack(fmt, value))
+
+        ##	@brief write 指定したデバイスのデータをbyte列で変更する
+        #	@param icsNum	ICS番号
+        #	@param offset	デバイス内のオフセット(Rcb4BaseLib.DeviceAddrOffset)
+        #	@param data	書き込むbyte列
+        #	@note	今の値と違うbyteだけに変更の印を付けます
+        #	@note	範囲外の場合はIndexErrorになります
+        def write(self,icsNum,offset,data):
+            if not (0 <= icsNum < Rcb4BaseLib.IcsDeviceSize) or offset < 0 or Rcb4BaseLib.IcsDeviceDataSize < offset + len(data):
+                raise IndexError('icsNum %d offset %d size %d' % (icsNum, offset, len(data)))
+            start = icsNum * Rcb4BaseLib.IcsDeviceDataSize + offset
+            for i, value in enumerate(data):
+                if self.Data[start + i] != value:
+                    self.Data[start + i] = value
+                    self.__dirty[start + i] = 1
+
+        ##	@brief setTrim トリムを変更する
+        def setTrim(self,icsNum,trim):
+            self.set(icsNum, 'trim', trim)
+
+        ##	@brief setRamAddrMixing ミキシングの参照先をRAMアドレスにする(setServoRamAddrMixing()と同じデータ)
+        #	@param mixNum	ミキシングの番号(1or2)
+        def setRamAddrMixing(self,icsNum,mixNum,ramAddr,gain):
+            self.write(icsNum, self.__mixingOffset(mixNum), [ramAddr & 0xff, (ramAddr >> 8) & 0x0f | 0x40, gain])
+
+        ##	@brief setDeviceMixing ミキシングの参照先を他のデバイスにする(setServoDeviceMixing()と同じデータ)
+        #	@param mixNum	ミキシングの番号(1or2)
+        #	@param mixIcsNum	参照するデバイスのICS番号
+        #	@param devOffset	参照するデバイスのオフセット(DeviceAddrOffset)
+        def setDeviceMixing(self,icsNum,mixNum,mixIcsNum,devOffset,gain):
+            self.write(icsNum, self.__mixingOffset(mixNum), [mixIcsNum | 0xc0, devOffset, gain])
+
+        ##	@brief setMixGain ミキシングの倍率を変更する(setServoMixGain()と同じデータ)
+        def setMixGain(self,icsNum,mixNum,gain):
+            self.write(icsNum, self.__mixingOffset(mixNum) + 2, [gain])
+
+        ##	@brief resetMixing ミキシングをOFFにする(resetServoMixing()と同じデータ)
+        def resetMixing(self,icsNum,mixNum):
+            self.write(icsNum, self.__mixingOffset(mixNum), [0xff, 0xff])
+
+        @staticmethod
+        def __mixingOffset(mixNum):
+            if mixNum == 2:
+                return Rcb4BaseLib.DeviceAddrOffset.Mixing2AddressOffset.value
+            return Rcb4BaseLib.DeviceAddrOffset.Mixing1AddressOffset.value
+
+        ##	@brief isDirty まだ書き込んでいない変更があるか
+        def isDirty(self):
+            return any(self.__dirty)
+
+        ##	@brief plan 書き込みが必要な範囲をデバイスごとにまとめる
+        #	@retval	[(icsNum,offset,data),...]	COM=>Device 1回分ずつの書き込み(ICS番号順)
+        #	@note	変わったbyteの間の隙間がmaxGap以下で、VolatileOffsetsを含まなければ1回にまとめます
+        def plan(self):
+            size = Rcb4BaseLib.IcsDeviceDataSize
+            spans = []
+            for icsNum in range(Rcb4BaseLib.IcsDeviceSize):
+                base = icsNum * size
+                dirty = self.__dirty[base:base + size]
+                if not any(dirty):
+                    continue
+                current = None
+                for offset in range(size):
+                    if not dirty[offset]:
+                        continue
+                    if current is not None:
+                        gap = range(current[1], offset)
+                        if len(gap) <= self.maxGap and not any(i in Rcb4BaseLib.IcsDeviceTable.VolatileOffsets for i in gap):
+                            current[1] = offset + 1
+                            continue
+                        spans.append((icsNum, current[0], bytes(self.Data[base + current[0]:base + current[1]])))
+                    current = [offset, offset + 1]
+                spans.append((icsNum, current[0], bytes(self.Data[base + current[0]:base + current[1]])))
+            return spans
+
+        ##	@brief markClean 書き込みが終わった範囲の変更の印を消す(applyIcsDeviceTable()から呼ばれる)
+        #	@note	書き込んだ後にさらに変えられたbyteは、印を残します
+        def markClean(self,icsNum,offset,data):
+            start = icsNum * Rcb4BaseLib.IcsDeviceDataSize + offset
+            for i, value in enumerate(data):
+                if self.Data[start + i] == value:
+                    self.__dirty[start + i] = 0
+
+	##	@class	MixingProfile
+	##	@brief	サーボモータごとのミキシングの設定をまとめて持っておくクラス
+	#	@note	applyMixingProfile()で、IcsDeviceTableを通して今の設定と違うbyteだけを書き込みます
+	#	@note	例: walk = Rcb4BaseLib.MixingProfile()
+	#	@note	    walk.ramAddr(4, 1, 1, gyroAddr, 20); walk.off(4, 1, 2)
+	#	@note	    rcb4.applyMixingProfile(walk, table)
+    class MixingProfile:
+
+        ##	@brief __init__ コンストラクタ(設定は空)
+        def __init__(self):
+            ##	@brief	{(ICS番号,ミキシングの番号):書き込むbyte列} ミキシングの参照先(2byte)と倍率(1byte)
+            self.Slots = {}
+
+        ##	@brief ramAddr ミキシングの参照先をRAMアドレスにする(setServoRamAddrMixing()と同じ設定)
+        #	@param mixNum	ミキシングの番号(1or2)
+        def ramAddr(self,id,sio,mixNum,ramAddr,gain):
+            self.Slots[(Rcb4BaseLib.icsNum2id(id, sio), mixNum)] = bytes([ramAddr & 0xff, (ramAddr >> 8) & 0x0f | 0x40, gain])
+
+        ##	@brief device ミキシングの参照先を他のサーボモータにする(setServoDeviceMixing()と同じ設定)
+        #	@param mixNum	ミキシングの番号(1or2)
+        #	@param devOffset	参照するデバイスのオフセット(DeviceAddrOffset)
+        def device(self,id,sio,mixNum,mixId,mixSio,devOffset,gain):
+            self.Slots[(Rcb4BaseLib.icsNum2id(id, sio), mixNum)] = bytes([Rcb4BaseLib.icsNum2id(mixId, mixSio) | 0xc0, devOffset, gain])
+
+        ##	@brief off ミキシングをOFFにする(resetServoMixing()と同じ設定で、倍率は変えません)
+        def off(self,id,sio,mixNum):
+            self.Slots[(Rcb4BaseLib.icsNum2id(id, sio), mixNum)] = bytes([0xff, 0xff])
+
+        ##	@brief icsNums 設定するICS番号の配列(小さい順)
+        def icsNums(self):
+            return sorted(set(icsNum for icsNum, mixNum in self.Slots))
+
+        ##	@brief applyTo IcsDeviceTableに設定を書き込む(変わったbyteに印が付きます)
+        def applyTo(self,table):
+            for (icsNum, mixNum), data in self.Slots.items():
+                table.write(icsNum, Rcb4BaseLib.MixingProfile.slotOffset(mixNum), data)
+
+        ##	@brief mismatches IcsDeviceTableの内容が設定と違うミキシングを探す
+        #	@retval	[(icsNum,mixNum),...]	設定と違うミキシング(同じときは空)
+        def mismatches(self,table):
+            result = []
+            for (icsNum, mixNum), data in self.Slots.items():
+                start = icsNum * Rcb4BaseLib.IcsDeviceDataSize + Rcb4BaseLib.MixingProfile.slotOffset(mixNum)
+                if table.Data[start:start + len(data)] != data:
+                    result.append((icsNum, mixNum))
+            return result
+
+        ##	@brief fromTable IcsDeviceTableの今の設定から、指定したミキシングの設定を作る(元に戻すときに使う)
+        #	@param slots	(ICS番号,ミキシングの番号)の配列
+        #	@note	静的関数で外部アクセスが可能
+        @staticmethod
+        def fromTable(table,slots):
+            profile = Rcb4BaseLib.MixingProfile()
+            for icsNum, mixNum in slots:
+                start = icsNum * Rcb4BaseLib.IcsDeviceDataSize + Rcb4BaseLib.MixingProfile.slotOffset(mixNum)
+                profile.Slots[(icsNum, mixNum)] = bytes(table.Data[start:start + 3])
+            return profile
+
+        ##	@brief slotOffset ミキシングの番号のデバイス内のオフセット
+        #	@note	静的関数で外部アクセスが可能
+        @staticmethod
+        def slotOffset(mixNum):
+            if mixNum == 2:
+                return Rcb4BaseLib.DeviceAddrOffset.Mixing2AddressOffset.value
+            return Rcb4BaseLib.DeviceAddrOffset.Mixing1AddressOffset.value
+
+	##	@class	PositionPoller
+	##	@brief	サーボモータの現在位置をバックグラウンドで読み込み続けるクラス
+	#	@note	読み込むサーボをRAM=>COM 1回分ずつのブロックに分け、1周期に1ブロックずつ順番に読み込みます
+	#	@note	読み込むたびに新しい配列を作って差し替えるので、Positionsはロックなしで読めます
+	#	@note	スケジューラ動作中は優先度Telemetryで送るので、サーボの角度指令の間に読み込みます
+	#	@note	読み込みに失敗してもスレッドは止めず、ErrorCountとLastErrorに記録して次の周期にまた読み込みます
+    class PositionPoller:
+
+        ##	@brief __init__ コンストラクタ(start()を呼ぶまで読み込みは始まりません)
+        #	@param rcb4	openしたRcb4BaseLib
+        #	@param icsNums	読み込むICS番号の配列
+        #	@param rate	1秒あたりの読み込み回数(ブロック数)
+        def __init__(self,rcb4,icsNums,rate = 50.0):
+            self.rcb4 = rcb4
+            self.rate = rate
+            self.__blocks = Rcb4BaseLib.planIcsBlocks(icsNums)
+            ##	@brief	ICS番号ごとの現在位置(未取得は-1) 読み込むたびに差し替わります
+            self.Positions = np.full(Rcb4BaseLib.IcsDeviceSize, -1, dtype=np.int32)
+            ##	@brief	ICS番号ごとの取得時刻(time.monotonic()) 未取得は0
+            self.Timestamps = np.zeros(Rcb4BaseLib.IcsDeviceSize)
+            ##	@brief	読み込みに失敗した回数
+            self.ErrorCount = 0
+            ##	@brief	読み込み中に起きた最後の例外(なければNone)
+            self.LastError = None
+            self.__stop = threading.Event()
+            self.__thread = None
+
+        ##	@brief start 読み込みスレッドを開始する
+        def start(self):
+            if self.__thread is None and len(self.__blocks) > 0:
+                self.__stop.clear()
+                self.__thread = threading.Thread(target=self.__pollLoop, name="Rcb4PositionPoller", daemon=True)
+                self.__thread.start()
+
+        ##	@brief stop 読み込みスレッドを止める
+        def stop(self):
+            if self.__thread is not None:
+                self.__stop.set()
+                self.__thread.join()
+                self.__thread = None
+
+        ##	@brief __pollLoop 一定周期でブロックを順番に読み込む
+        def __pollLoop(self):
+            index = 0
+            nextTime = time.monotonic()
+            while not self.__stop.is_set():
+                first, last, icsNums = self.__blocks[index]
+                index = (index + 1) % len(self.__blocks)
+
+                try:
+                    with self.rcb4.commandPriority(Rcb4BaseLib.CommandPriority.Telemetry):
+                        retf, positions = self.rcb4.readIcsPosBlock(first, last)
+                except Exception as e:
+                    #ポートが抜けたときなども止まらずに読み込み続ける(Timestampsが古いままになります)
+                    self.LastError = e
+                    retf = False
+                if retf:
+                    now = time.monotonic()
+                    newPositions = self.Positions.copy()
+                    newTimestamps = self.Timestamps.copy()
+                    newPositions[icsNums] = positions[icsNums - first]
+                    newTimestamps[icsNums] = now
+                    self.Timestamps = newTimestamps
+                    self.Positions = newPositions
+                else:
+                    self.ErrorCount += 1
+
+                nextTime += 1.0 / self.rate
+                delay = nextTime - time.monotonic()
+                if delay < 0:	#遅れた場合は取り戻そうとせず、今から数え直す
+                    nextTime = time.monotonic()
+                    delay = 0
+                self.__stop.wait(delay)
+
+	##	@class	MotionWatcher
+	##	@brief	モーションの再生が終わるのを見張り、終わったらFutureに結果を入れるクラス
+	#	@note	見張っているモーションがいくつあっても、プログラムカウンタの読み込みは1つのスレッドでまとめて行います
+	#	@note	ほかの読み込みでプログラムカウンタが読まれたときはその結果も使い、その分の読み込みを省きます
+	#	@note	読み込み間隔は、終わりそうな時刻(前回までの再生時間から推定)の近くでは短く、それ以外は長くします
+	#	@note	どのモーションも再生されていない(0)か、再生場所が異常(-2)になるまで終わったとみなしません
+	#	@note	(ボード側でほかのモーションを呼んでいる間も見張り続けます)
+	#	@note	読み込みで例外が起きたとき、またはMaxErrorCount回続けて失敗したときは、見張っているものをすべてFalseで終えます
+    class MotionWatcher:
+
+        ##	@brief	終わりそうな時刻から遠いときの読み込み間隔(秒)
+        SlowInterval = 0.1
+        ##	@brief	終わりそうな時刻の近くの読み込み間隔(秒)
+        FastInterval = 0.01
+        ##	@brief	終わりそうな時刻の何秒前から短い間隔にするか
+        FastWindow = 0.15
+        ##	@brief	続けて読み込みに失敗したら見張りをやめる回数
+        MaxErrorCount = 5
+
+        ##	@brief __init__ コンストラクタ
+        #	@param rcb4	openしたRcb4BaseLib
+        def __init__(self,rcb4):
+            self.rcb4 = rcb4
+            ##	@brief	モーション番号ごとの再生時間(秒)の推定値
+            self.Durations = {}
+            ##	@brief	プログラムカウンタを読み込んだ回数(ほかの読み込みの分は含まない)
+            self.PollCount = 0
+            self.__watches = {}		#モーション番号:[Future,再生開始時刻,ほかのモーションで終えるか]
+            self.__lastRead = 0.0
+            self.__errorCount = 0
+            self.__cond = threading.Condition()
+            self.__running = True
+            self.__thread = None
+
+        ##	@brief watch モーションの再生が終わるのを見張る
+        #	@param motionNum	再生を始めたモーション番号
+        #	@param duration	再生時間(秒)の目安 Noneのときは前回までの再生時間から推定
+        #	@param endOnOther	Trueのときはほかのモーションの再生が始まったときも終わったとみなす
+        #	@retval	Future	結果は正常に終わったかどうか(True/False)
+        #	@note	同じモーションを見張っている間は同じFutureを返します(endOnOtherは最後に指定したものを使います)
+        #	@note	endOnOtherで終えたときは、再生時間の推定に使いません
+        def watch(self,motionNum,duration = None,endOnOther = False):
+            with self.__cond:
+                if duration is not None:
+                    self.Durations[motionNum] = duration
+                entry = self.__watches.get(motionNum)
+                if entry is None:
+                    entry = [Future(), 0.0, endOnOther]
+                    if not self.__running:
+                        entry[0].set_result(False)
+                        return entry[0]
+                    self.__watches[motionNum] = entry
+                entry[1] = time.monotonic()
+                entry[2] = endOnOther
+                if self.__thread is None:
+                    self.__thread = threading.Thread(target=self.__pollLoop, name="Rcb4MotionWatcher", daemon=True)
+                    self.__thread.start()
+                self.__cond.notify()
+                return entry[0]
+
+        ##	@brief feed 読み込んだプログラムカウンタとフラグで見張っているモーションを判定する
+        #	@param retbuf	ProgramCounterRamAddressから読み込んだ8byte以上のデータ
+        #	@param readTime	読み込みを始めた時刻(time.monotonic()) これより後に見張り始めたものには使いません
+        def feed(self,retbuf,readTime):
+            playNum = Rcb4BaseLib.decodeMotionPlayNum(retbuf)
+            now = time.monotonic()
+            done = []
+            with self.__cond:
+                self.__errorCount = 0
+                self.__lastRead = max(self.__lastRead, readTime)
+                for motionNum, (future, start, endOnOther) in list(self.__watches.items()):
+                    if start > readTime or playNum == motionNum:
+                        continue
+                    if playNum > 0 and not endOnOther:
+                        continue
+                    del self.__watches[motionNum]
+                    if playNum == 0:
+                        previous = self.Durations.get(motionNum)
+                        elapsed = now - start
+                        self.Durations[motionNum] = elapsed if previous is None else (previous + elapsed) / 2
+                    done.append((future, playNum >= 0))
+                self.__cond.notify()
+            for future, result in done:
+                future.set_result(result)
+
+        ##	@brief close 見張りをやめる(見張っていたFutureはFalseになります)
+        def close(self):
+            with self.__cond:
+                self.__running = False
+                self.__cond.notify()
+            if self.__thread is not None and self.__thread is not threading.current_thread():
+                self.__thread.join()
+            self.__failAll()
+
+        ##	@brief __failAll 見張っているものをすべてFalseで終える
+        def __failAll(self):
+            with self.__cond:
+                futures = [entry[0] for entry in self.__watches.values()]
+                self.__watches.clear()
+            for future in futures:
+                future.set_result(False)
+
+        ##	@brief __nextDelay 次に読み込むまでの時間(秒)
+        #	@warning	__condをとってから呼んでください
+        def __nextDelay(self,now):
+            delay = self.SlowInterval
+            for motionNum, (future, start, endOnOther) in self.__watches.items():
+                last = max(self.__lastRead, start)
+                duration = self.Durations.get(motionNum)
+                if duration is None:
+                    #再生時間がわからないときは、始めは短く、だんだん長い間隔にする
+                    interval = min(max((now - start) * 0.1, self.FastInterval), self.SlowInterval)
+                else:
+                    fastStart = start + duration - self.FastWindow
+                    interval = self.FastInterval if last >= fastStart else min(fastStart - last, self.SlowInterval)
+                delay = min(delay, last + interval - now)
+            return delay
+
+        ##	@brief __pollLoop 見張っているものがある間プログラムカウンタを読み込む
+        def __pollLoop(self):
+            while True:
+                with self.__cond:
+                    while self.__running and len(self.__watches) == 0:
+                        self.__cond.wait()
+                    if not self.__running:
+                        return
+                    delay = self.__nextDelay(time.monotonic())
+                    if delay > 0:
+                        self.__cond.wait(delay)
+                        continue
+
+                #読み込んだ結果はmoveRamToComCmdSynchronize()からfeed()に渡される
+                try:
+                    with self.rcb4.commandPriority(Rcb4BaseLib.CommandPriority.Telemetry):
+                        playNum = self.rcb4.getMotionPlayNum()
+                except Exception:
+                    #ポートが抜けたときなどは終わったかわからないので、見張っているものをすべてFalseで終える
+                    #(スレッドは止めず、次に見張り始めたものはまた読み込みます)
+                    with self.__cond:
+                        self.__errorCount = 0
+                        self.__lastRead = time.monotonic()
+                    self.__failAll()
+                    continue
+                self.PollCount += 1
+                if playNum == -1:
+                    with self.__cond:
+                        self.__errorCount += 1
+                        failed = self.__errorCount >= self.MaxErrorCount
+                        self.__lastRead = time.monotonic()
+                    if failed:
+                        self.__failAll()
+
+	##	@class	AckPipeline
+	##	@brief	返信を待たずにコマンドを連続して送るための送受信パイプライン
+	#	@note	送信は呼び出し側のスレッドで行い、返信は受信スレッドが送信順に照合します
+	#	@note	同時に返信待ちにできるコマンド数(ウィンドウ)を超えると、空きが出るまで送信を待ちます
+    class AckPipeline:
+
+        ##	@brief __init__ コンストラクタ
+        #	@param com	openしたSerialポート
+        #	@param window	同時に返信待ちにできるコマンド数
+        #	@param timeout	コマンドごとの返信の待ち時間を返す関数(引数は送信データと受信データ数)
+        #	@param maxTimeout	送信できるまで待つ最大の時間(秒) Noneのときは上限なし
+        def __init__(self,com,window,timeout,maxTimeout):
+            self.com = com
+            self.window = window
+            self.timeout = timeout
+            self.maxTimeout = maxTimeout
+            self.__slots = threading.Semaphore(window)
+            self.__pending = deque()
+            self.__writeLock = threading.Lock()
+            self.__cond = threading.Condition()
+            self.__running = True
+            self.__resync = False
+            self.__parser = Rcb4BaseLib.RxParser()
+            ##	@brief	送受信を記録するTransactionStats(Noneは記録しない)
+            self.Stats = None
+            self.__reader = threading.Thread(target=self.__readLoop, name="Rcb4AckReader", daemon=True)
+            self.__reader.start()
+
+        ##	@brief submit コマンドを送信し、返信を受け取るFutureを返す
+        #	@param txBuf	送信データの配列(byte確認済みのもの)
+        #	@param rxLen	受信データ数
+        #	@retval	Future	結果は受信データ(失敗時は配列数0)
+        #	@note	送信はこの関数の中で終わるので、txBufは戻った後に書き換えてもかまいません
+        def submit(self,txBuf,rxLen):
+            future = Future()
+            if not self.__running or not self.__slots.acquire(timeout=self.maxTimeout):
+                future.set_result([])
+                return future
+            with self.__writeLock:
+                entry = (rxLen, future, txBuf, time.perf_counter() if self.Stats is not None else 0)
+                with self.__cond:
+                    self.__pending.append(entry)
+                    self.__cond.notify()
+                try:
+                    self.com.write(txBuf)
+                except Exception:
+                    #タイムアウトと同じく、返信の対応が取れなくなるので返信待ちのものはすべて失敗にする
+                    #(受信バッファは受信スレッドが次の返信を読む前に捨てます)
+                    with self.__cond:
+                        failed = list(self.__pending)
+                        self.__pending.clear()
+                        self.__resync = True
+                    self.__fail(failed)
+            return future
+
+        ##	@brief pendingCount 返信待ちのコマンド数
+        def pendingCount(self):
+            return len(self.__pending)
+
+        ##	@brief close 返信待ちがなくなるまで待ってから受信スレッドを止める
+        def close(self):
+            with self.__cond:
+                self.__running = False
+                self.__cond.notify()
+            self.__reader.join()
+
+        ##	@brief __fail 取り除いた返信待ちのものを失敗にする
+        #	@note	それぞれ1回だけ枠を返し、Futureは結果が入っていないときだけ失敗にします
+        def __fail(self,entries):
+            for rxLen, future, txBuf, start in entries:
+                self.__slots.release()
+                if not future.done():
+                    future.set_result([])
+
+        ##	@brief __readLoop 返信を送信順に照合する受信スレッド
+        #	@note	受信バッファ(RxParser)はこのスレッドだけが触ります
+        def __readLoop(self):
+            while True:
+                with self.__cond:
+                    while self.__running and len(self.__pending) == 0:
+                        self.__cond.wait()
+                    if len(self.__pending) == 0:
+                        return
+                    entry = self.__pending[0]
+                    resync = self.__resync
+                    self.__resync = False
+                rxLen, future, txBuf, start = entry
+
+                if resync:
+                    #送信の失敗で取り除いたコマンドの返信が残っているので捨てる
+                    with self.__writeLock:
+                        self.__parser.discard(self.com)
+
+                stats = self.Stats
+                if stats is not None:
+                    mark = stats.parserMark(self.__parser)
+                frame = self.__parser.readFrame(self.com, rxLen, self.timeout(txBuf, rxLen))
+                if stats is not None and start:
+                    outcome = stats.record(txBuf, rxLen, frame, start, self.__parser, mark)
+
+                with self.__cond:
+                    current = len(self.__pending) > 0 and self.__pending[0] is entry
+                    if frame is not None and current:
+                        self.__pending.popleft()
+                if frame is not None and current:
+                    rxbuf = bytes(frame)
+                    self.__slots.release()
+                    future.set_result(rxbuf)
+                    continue
+                if not current:
+                    #読んでいる間に送信の失敗で取り除かれたので、結果は入れずに受信バッファを捨てる
+                    with self.__writeLock:
+                        self.__parser.discard(self.com)
+                    continue
+
+                #タイムアウトの後は、返信の対応が取れなくなるので
+                #返信待ちのものはすべて失敗として受信バッファを捨てる
+                with self.__writeLock:
+                    with self.__cond:
+                        failed = list(self.__pending)
+                        self.__pending.clear()
+                        self.__resync = False
+                    self.__parser.discard(self.com)
+                for rxLen, future, txBuf, start in failed[1:]:
+                    if stats is not None and start and failed[0][3]:
+                        stats.record(txBuf, rxLen, None, start, self.__parser, mark, outcome)
+                self.__fail(failed)
+
+	##	@class	CommandScheduler
+	##	@brief	Serialポートの前に置く優先度付きのコマンドスケジューラ
+	#	@note	送信は専用のスレッドが優先度の高い順(同じ優先度は先着順)に行います
+	#	@note	期限を過ぎたコマンドは送らずに失敗(配列数0)として返します
+	#	@note	同じcoalesceKeyのコマンドが送信待ちのときは、新しいデータで上書きして1回だけ送ります
+    class CommandScheduler:
+
+        ##	@brief	優先度ごとの標準の期限(秒) Noneは期限なし
+        DefaultDeadlines = {
+            0: None,	#Safety
+            1: 0.1,		#Servo
+            2: None,	#Motion
+            3: 1.0,		#Telemetry
+        }
+
+        ##	@brief __init__ コンストラクタ
+        #	@param transfer	送受信を行う関数 transfer(txBuf, rxLen) -> Future
+        #	@param deadlines	優先度(CommandPriorityの値)ごとの期限(秒)の辞書
+        def __init__(self,transfer,deadlines = None):
+            self.__transfer = transfer
+            self.deadlines = dict(Rcb4BaseLib.CommandScheduler.DefaultDeadlines)
+            if deadlines is not None:
+                self.deadlines.update(deadlines)
+            self.__queues = [deque() for p in Rcb4BaseLib.CommandPriority]
+            self.__coalesce = {}
+            self.__cond = threading.Condition()
+            self.__running = True
+            self.__worker = threading.Thread(target=self.__workLoop, name="Rcb4Scheduler", daemon=True)
+            self.__worker.start()
+
+        ##	@brief submit コマンドを送信待ちに入れる
+        #	@param txBuf	送信データの配列(byte確認済みのもの)
+        #	@param rxLen	受信データ数
+        #	@param priority	CommandPriority
+        #	@param deadline	期限(秒) Noneのときは優先度ごとの標準の期限
+        #	@param coalesceKey	上書きの対象を判別するキー(Noneのときは上書きしない)
+        #	@retval	Future	結果は受信データ(失敗・期限切れ時は配列数0)
+        #	@note	Safetyのコマンドが来たときは、送信待ちのServoのコマンドを捨てます
+        def submit(self,txBuf,rxLen,priority,deadline = None,coalesceKey = None):
+            future = Future()
+            if deadline is None:
+                deadline = self.deadlines.get(priority.value)
+            expire = None if deadline is None else time.monotonic() + deadline
+            txBuf = bytes(txBuf)	#ひな形のbytearrayが送信前に書き換わらないようにコピー
+
+            with self.__cond:
+                if not self.__running:
+                    future.set_result([])
+                    return future
+                if priority == Rcb4BaseLib.CommandPriority.Safety:
+                    dropped = self.__queues[Rcb4BaseLib.CommandPriority.Servo.value]
+                    for entry in dropped:
+                        self.__coalesce.pop(entry[3], None)
+                        for f in entry[4]:
+                            f.set_result([])
+                    dropped.clear()
+
+                entry = self.__coalesce.get(coalesceKey) if coalesceKey is not None else None
+                if entry is not None:
+                    #送信待ちのものを新しいデータで上書き(順番はそのまま)
+                    entry[0] = txBuf
+                    entry[2] = expire
+                    entry[4].append(future)
+                else:
+                    entry = [txBuf, rxLen, expire, coalesceKey, [future]]
+                    self.__queues[priority.value].append(entry)
+                    if coalesceKey is not None:
+                        self.__coalesce[coalesceKey] = entry
+                    self.__cond.notify()
+            return future
+
+        ##	@brief isWorkerThread 呼び出し元がスケジューラのスレッドかどうか
+        def isWorkerThread(self):
+            return threading.current_thread() is self.__worker
+
+        ##	@brief pendingCount 送信待ちのコマンド数
+        def pendingCount(self):
+            with self.__cond:
+                return sum(len(q) for q in self.__queues)
+
+        ##	@brief close 送信待ちのコマンドを送り終えてからスレッドを止める
+        def close(self):
+            with self.__cond:
+                self.__running = False
+                self.__cond.notify()
+            if not self.isWorkerThread():
+                self.__worker.join()
+
+        ##	@brief __workLoop 優先度の高い順に送信するスレッド
+        def __workLoop(self):
+            while True:
+                with self.__cond:
+                    entry = None
+                    while entry is None:
+                        for queue in self.__queues:
+                            if len(queue) > 0:
+                                entry = queue.popleft()
+                                break
+                        else:
+                            if not self.__running:
+                                return
+                            self.__cond.wait()
+                    if entry[3] is not None:
+                        del self.__coalesce[entry[3]]
+
+                txBuf, rxLen, expire, key, futures = entry
+                if expire is not None and time.monotonic() > expire:
+                    for f in futures:
+                        f.set_result([])
+                    continue
+
+                def done(result, futures = futures):
+                    try:
+                        rxbuf = result.result()
+                    except Exception:
+                        rxbuf = []
+                    for f in futures:
+                        f.set_result(rxbuf)
+                try:
+                    self.__transfer(txBuf, rxLen).add_done_callback(done)
+                except Exception:
+                    #ポートが抜けたときなど送受信できないので、送信中のものと送信待ちのものをすべて失敗にする
+                    #(スレッドは止めず、次に来たコマンドはまた送ってみます)
+                    self.__failQueued(futures)
+
+        ##	@brief __failQueued 送信中のものと送信待ちのものをすべて失敗(配列数0)にする
+        #	@param futures	送信中のコマンドのFutureの配列
+        def __failQueued(self,futures):
+            with self.__cond:
+                for queue in self.__queues:
+                    for entry in queue:
+                        futures.extend(entry[4])
+                    queue.clear()
+                self.__coalesce.clear()
+            for f in futures:
+                if not f.done():
+                    f.set_result([])
+
+	##	@class	TransactionStats
+	##	@brief	送受信の回数、結果、時間、byte数をコマンドの種類ごとに数えるクラス
+	#	@note	startStats()で開始したときだけ記録するので、開始していなければ送受信の処理はほぼ変わりません
+	#	@note	結果は成功(ok)、返信なし(timeout)、返信が途中まで(shortRead)、チェックサム異常(badChecksum)、NACK(nack)に分けて数えます
+	#	@note	返信時間は1usから2倍ずつのヒストグラムに数えます(LatencyBoundsが各区間の上限)
+    class TransactionStats:
+
+        ##	@brief	結果の名前の一覧(snapshot()のキー)
+        Outcomes = ('ok', 'timeout', 'shortRead', 'badChecksum', 'nack')
+
+        ##	@brief	返信時間のヒストグラムの各区間の上限(秒) 最後の区間は上限なし
+        LatencyBounds = tuple((1 << i) * 1e-6 for i in range(24)) + (float('inf'),)
+
+        ##	@brief	返信がデータのコマンド(Moveのサブコマンド) これ以外は返信の3byte目をACK/NACKとして判定します
+        ReadSubCmds = (0x20, 0x21, 0x23)	#RamToCom,DeviceToCom,RomToCom
+
+        ##	@brief __init__ コンストラクタ
+        def __init__(self):
+            self.__lock = threading.Lock()
+            self.reset()
+
+        ##	@brief reset 数えた値をすべて0に戻す
+        def reset(self):
+            with self.__lock:
+                ##	@brief	数え始めた時刻(time.monotonic())
+                self.Started = time.monotonic()
+                self.__counters = {}
+
+        ##	@brief parserMark 受信前のRxParserの状態(record()に渡す)
+        @staticmethod
+        def parserMark(parser):
+            return (parser.SkipCount, parser.ChecksumErrorCount)
+
+        ##	@brief record 1回分の送受信を記録する
+        #	@param sendbuf	送信データ
+        #	@param rxLen	受信データ数
+        #	@param frame	RxParser.readFrame()の戻り値(Noneは失敗)
+        #	@param start	送信を始めた時刻(time.perf_counter())
+        #	@param parser	受信に使ったRxParser
+        #	@param mark	受信前のparserMark()
+        #	@param outcome	結果を判定せずに指定する(Outcomesの番号)
+        #	@retval	記録した結果(Outcomesの番号)
+        #	@note	前の返信の失敗で受信をあきらめたコマンドは、outcomeに前のコマンドの結果を指定して記録します
+        def record(self,sendbuf,rxLen,frame,start,parser,mark,outcome = None):
+            latency = time.perf_counter() - start
+            cmd = sendbuf[1]
+            key = (cmd, sendbuf[2]) if cmd == Rcb4BaseLib.CommandTypes.Move.value else (cmd, None)
+            rxBytes = 0
+            if outcome is not None:
+                pass
+            elif frame is not None:
+                if key[1] not in Rcb4BaseLib.TransactionStats.ReadSubCmds and frame[2] != Rcb4BaseLib.AckType.Ack.value:
+                    outcome = 4	#nack
+                else:
+                    outcome = 0	#ok
+                rxBytes = len(frame)
+            else:
+                skip, checksumError = mark
+                if parser.ChecksumErrorCount != checksumError:
+                    outcome = 3	#badChecksum
+                elif parser.SkipCount != skip or parser.pendingCount() > 0:
+                    outcome = 2	#shortRead
+                else:
+                    outcome = 1	#timeout
+            bucket = min(int(latency * 1e6).bit_length(), len(Rcb4BaseLib.TransactionStats.LatencyBounds) - 1)
+
+            with self.__lock:
+                counter = self.__counters.get(key)
+                if counter is None:
+                    #[結果ごとの回数...,送信byte数,受信byte数,返信時間の合計,ヒストグラム]
+                    counter = [0] * len(Rcb4BaseLib.TransactionStats.Outcomes) + [0, 0, 0.0, [0] * len(Rcb4BaseLib.TransactionStats.LatencyBounds)]
+                    self.__counters[key] = counter
+                counter[outcome] += 1
+                counter[-4] += len(sendbuf)
+                counter[-3] += rxBytes
+                counter[-2] += latency
+                counter[-1][bucket] += 1
+            return outcome
+
+        ##	@brief snapshot 今までに数えた値をコピーして返す
+        #	@retval	{'elapsed':経過時間(秒), 'commands':{コマンド名:{'count','ok','timeout','shortRead','badChecksum','nack','txBytes','rxBytes','latencyTotal','latency'}}}
+        #	@note	コマンド名はCommandTypesの名前(MoveはMove.RamToComのようにサブコマンド付き)
+        #	@note	'latency'はLatencyBoundsの区間ごとの回数のtupleです
+        def snapshot(self):
+            with self.__lock:
+                items = [(key, counter[:-1] + [tuple(counter[-1])]) for key, counter in self.__counters.items()]
+                elapsed = time.monotonic() - self.Started
+            commands = {}
+            for key, counter in items:
+                n = len(Rcb4BaseLib.TransactionStats.Outcomes)
+                stat = dict(zip(Rcb4BaseLib.TransactionStats.Outcomes, counter[:n]))
+                stat['count'] = sum(counter[:n])
+                stat['txBytes'], stat['rxBytes'], stat['latencyTotal'], stat['latency'] = counter[n:]
+                commands[Rcb4BaseLib.TransactionStats.commandName(key)] = stat
+            return {'elapsed': elapsed, 'commands': commands}
+
+        ##	@brief commandName コマンドの種類(record()のキー)の名前
+        @staticmethod
+        def commandName(key):
+            cmd, sub = key
+            try:
+                name = Rcb4BaseLib.CommandTypes(cmd).name
+            except ValueError:
+                name = '0x%02X' % cmd
+            if sub is not None:
+                try:
+                    name += '.' + Rcb4BaseLib.SubMoveCmd(sub).name
+                except ValueError:
+                    name += '.0x%02X' % sub
+            return name
+
+        ##	@brief percentile ヒストグラムから返信時間のパーセンタイルを求める
+        #	@param histogram	snapshot()の'latency'
+        #	@param q	0-100
+        #	@retval	その割合の回数が収まる区間の上限(秒) 回数が0のときはNone
+        @staticmethod
+        def percentile(histogram,q):
+            total = sum(histogram)
+            if total == 0:
+                return None
+            target = total * q / 100.0
+            count = 0
+            for bound, n in zip(Rcb4BaseLib.TransactionStats.LatencyBounds, histogram):
+                count += n
+                if count >= target:
+                    return bound
+            return Rcb4BaseLib.TransactionStats.LatencyBounds[-1]
 ########################################################################################
 
 	##	@brief	バージョン番号
@@ -232,12 +1409,53 @@ class Rcb4BaseLib:
     ##	@brief	ICSデバイスの１つのデータ数(byte)
     IcsDeviceDataSize = 20 #2018/12/27追記
     
+    ##	@brief	COMの通信速度とコンフィグデータのBaudrateビット(b6,b7)の対応(速い順)
+    ComBaudrates = ((1250000, 0x0080), (625000, 0x0040), (115200, 0x0000))
+    
+    ##	@brief	コンフィグデータの出力周期(Frameビット b4,b5)ごとの1フレームの時間(秒)
+    FramePeriods = (0.010, 0.015, 0.020, 0.025)
+
+    ##	@brief	通信速度を探すときのACKの待ち時間(秒)
+    ProbeAckTimeout = 0.05
+
+    ##	@brief	返信の待ち時間で、通信時間に足す余裕(秒)
+    #	@note	USBシリアル変換の受信遅延(WindowsのFTDIのLatency Timerは標準で16ms)より十分長くしておきます
+    #	@note	open()のslackでボードごとに変えられます
+    TimeoutSlack = 0.05
+
+    ##	@brief	ROMを読むコマンド(ROM=>COM)の待ち時間で、通信時間に足す余裕(秒)
+    #	@note	open()のromSlackでボードごとに変えられます
+    RomTimeoutSlack = 0.2
+
+    ##	@brief	Serialポートの1回の読み込みの待ち時間(秒)
+    #	@note	返信の待ち時間はコマンドごとに決めるので、ポートの待ち時間はそれより短くしておきます
+    PollTimeout = 0.005
+
+    ##	@brief	期限のないコマンドをスケジューラに預けたとき、送信の順番を待つ最大の時間(秒)
+    #	@note	synchronize()はこれに返信の待ち時間を足した時間だけ結果を待ち、過ぎたら失敗(配列数0)を返します
+    SchedulerWaitTimeout = 1.0
+
+    ##	@brief	読み込みコマンドの返信が来なかったときに送り直す回数
+    ReadRetryCount = 2
+    
+    ##	@brief	見つけた通信速度を記録するファイル({ポート名:通信速度}のJSON)
+    BaudrateCacheFile = os.path.join(os.path.expanduser('~'), '.rcb4_baudrate.json')
+    
     ##	@brief	COMのデバイス名
     com = 0
     
+    ##	@brief	最後のapplyMixingProfile()で元の設定に戻した結果
+    #	@note	None:元に戻す必要がなかった(成功したか、何も書き込む前に失敗した)
+    #	@note	True:元の設定に戻し、読み込み直して確かめた	False:元に戻せたことを確かめられなかった
+    LastRollbackOk = None
+    
     
-    __isSynchronize = False    
     __configData = 0          #2018/10/19
+    __maxTimeout = None
+    __pipeline = None
+    __scheduler = None
+    __motionWatcher = None
+    __stats = None
 
 
 	#///////////////////////////////
@@ -248,9 +1466,16 @@ class Rcb4BaseLib:
     #//		コンストラクタ
     #//
 	##	@brief	コンストラクタ
-    def _init_(self):
-        __isSynchronize = False
-        __configData = 0
+    #	@note	送受信は__lockで排他をとり、同時に呼ばれた場合は順番待ちになります
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__priority = threading.local()
+        self.__parser = Rcb4BaseLib.RxParser()
+        self.__configData = 0
+        self.__maxTimeout = None
+        self.__motionWatcher = None
+        self.__stats = None
+        self.LastRollbackOk = None
 
 
 	#//////////////////////////////////////////////////////////////////////////
@@ -312,47 +1537,161 @@ class Rcb4BaseLib:
     #	@retval	rxbuf	受信データ
     #					配列数0の場合は失敗になります
     #	@retval	rxs		データの受信数
+    #	@param	parse	受信データを変換する関数(引数は返信コマンド全体) 指定したときは変換した結果を返します
+    #	@retval	parseを指定したときはparse(返信コマンド)の結果(失敗時はNone)
     #	@note	実際に同期した送受信を行います。
     #			失敗した場合は配列0の何も入っていないデータを返します
     #			コマンドを受信し終わった後受信コマンドの合否及びチェックサムの判定もします。
+    #	@note	スケジューラ動作中は、期限(期限のない優先度はSchedulerWaitTimeout)と返信の待ち時間を足した時間だけ待ちます
+    #			待ちきれなかったときは失敗を返しますが、期限のないコマンドはその後に送られることがあります
+    #	@note	parseは次の送受信を始める前に呼ぶので、パイプラインとスケジューラが動いていなければ
+    #			受信バッファをコピーせずにmemoryviewで渡します(parseの中でだけ有効なので、残すデータはコピーしてください)
     #
-    def synchronize(self,txBuf,  rxLen):
-        sendbuf=[256]
-        if self.__isSynchronize == False:
-            sendbuf.clear()
-            
-            #送られてきたデータのチェック
-            if (len(txBuf) == 0 or rxLen <= 3):
-                rxbuf = [] #error
-                return	rxbuf
-            
-            #データのコピーとbyteかどうかの判定
-            for i in range(len(txBuf)):
-                if txBuf[i] < 0 or 255 < txBuf[i]:
-                    rxbuf = [] #error
-                    return	rxbuf         
-                sendbuf.append(txBuf[i])
-            
-            
-            self.__isSynchronize = True
-            
-            #print('sendData-->',sendbuf)
-            
-            self.com.flushInput()#buff clr
-            self.com.write(sendbuf)
-            rxbuf = self.com.read(rxLen)
-            self.com.flushInput()#buff clr
-            if len(rxbuf) == rxLen and rxbuf[0] == rxLen:
-                if self.__checkCheckSum(rxbuf) == False:
-                   rxbuf = [] #error
-            else:
-                rxbuf = [] #error
-            self.__isSynchronize = False
-            #print('readData-->',rxbuf)
-            return	rxbuf
+    def synchronize(self,txBuf,  rxLen, parse = None):
+        sendbuf = self.__makeSendBuf(txBuf, rxLen)
+        if sendbuf is None:
+            rxbuf = [] #error
         else:
+            #スケジューラ動作中は、スケジューラに預けて順番が来るのを待つ
+            scheduler = self.__scheduler
+            if scheduler is not None and not scheduler.isWorkerThread():
+                rxbuf = self.__waitScheduled(*self.__schedule(scheduler, sendbuf, rxLen))
+
+            #パイプライン動作中は、パイプラインに送って返信を待つ
+            elif self.__pipeline is not None:
+                rxbuf = self.__pipeline.submit(sendbuf, rxLen).result()
+
+            #ほかのスレッドが送受信中のときは終わるまで待つ
+            else:
+                with self.__lock:
+                    rxbuf = self.__transfer(sendbuf, rxLen, parse is None)
+                    if parse is not None:
+                        return parse(rxbuf) if len(rxbuf) > 0 else None
+
+        if parse is not None:
+            return parse(rxbuf) if len(rxbuf) > 0 else None
+        return	rxbuf
+
+
+    ##	@brief	スケジューラにコマンドを預ける
+    #	@return	(future,wait) waitは結果を待つ最大の時間(秒)
+    #	@note	waitは期限(期限のない優先度はSchedulerWaitTimeout)と返信の待ち時間を足した時間です
+    def __schedule(self,scheduler,sendbuf,rxLen):
+        priority, deadline = self.__commandPriority(sendbuf)
+        future = scheduler.submit(sendbuf, rxLen, priority, deadline, self.__coalesceKey(sendbuf, priority))
+        if deadline is None:
+            deadline = scheduler.deadlines.get(priority.value)
+        if deadline is None:
+            deadline = self.SchedulerWaitTimeout
+        return future, deadline + self.transactionTimeout(sendbuf, rxLen)
+
+
+    ##	@brief	スケジューラに預けたコマンドの結果を待つ
+    #	@retval	rxbuf	受信データ(失敗時・waitを過ぎたときは配列数0)
+    @staticmethod
+    def __waitScheduled(future,wait):
+        try:
+            return future.result(timeout=wait)
+        except FutureTimeoutError:
+            return []
+
+
+    ##	@brief	送信データの確認をして送信用の配列を作る
+    #	@param	txBuf	送信データの配列
+    #	@param	rxLen	受信データ数
+    #	@retval	sendbuf	送信用の配列
+    #	@retval	None	データが不正
+    def __makeSendBuf(self,txBuf,rxLen):
+        #送られてきたデータのチェック
+        if (len(txBuf) == 0 or rxLen <= 3):
+            return None
+
+        #bytes/bytearrayは中身が必ずbyteなので、判定もコピーもせずそのまま送る
+        if isinstance(txBuf, (bytes, bytearray)):
+            return txBuf
+
+        #データのコピーとbyteかどうかの判定
+        sendbuf = []
+        for i in range(len(txBuf)):
+            if txBuf[i] < 0 or 255 < txBuf[i]:
+                return None
+            sendbuf.append(txBuf[i])
+        return sendbuf
+
+
+    ##	@brief	Serialポートで1回分の送受信を行う
+    #	@param	sendbuf	送信データの配列(確認済みのもの)
+    #	@param	rxLen	受信データ数
+    #	@param	copy	Falseのときは受信バッファのmemoryviewをそのまま返す(次の__transfer()まで有効)
+    #	@retval	rxbuf	受信データ(失敗時は配列数0)
+    #	@warning	__lockをとってから呼んでください
+    #	@note	送信前に届いていたデータは前のコマンドの残りなので読み捨てます
+    #	@note	返信はRxParserで区切るので、ノイズが混ざっても区切り直して受信を続けます
+    def __transfer(self,sendbuf,rxLen,copy = True):
+        #print('sendData-->',sendbuf)
+
+        self.__parser.discard(self.com)#buff clr
+        stats = self.__stats
+        if stats is not None:
+            mark = stats.parserMark(self.__parser)
+            start = time.perf_counter()
+        self.com.write(sendbuf)
+        frame = self.__parser.readFrame(self.com, rxLen, self.transactionTimeout(sendbuf, rxLen))
+        if stats is not None:
+            stats.record(sendbuf, rxLen, frame, start, self.__parser, mark)
+        if frame is None:
             rxbuf = [] #error
-            return	rxbuf
+        elif copy:
+            rxbuf = bytes(frame)
+        else:
+            rxbuf = frame
+        #print('readData-->',rxbuf)
+        return	rxbuf
+
+
+    ##	@brief	指定したbyte数の通信にかかる時間を計算する
+    #	@param	byteCount	byte数
+    #	@retval	時間(秒) 通信速度がわからないときは0
+    #	@note	1byteはスタート、データ8bit、パリティ、ストップの11bitで計算します
+    def wireTime(self,byteCount):
+        baudrate = getattr(self.com, 'baudrate', 0)
+        if not baudrate:
+            return 0
+        return byteCount * 11 / baudrate
+
+
+    ##	@brief	コマンドの返信を待つ時間を計算する
+    #	@param	txBuf	送信データの配列
+    #	@param	rxLen	受信データ数
+    #	@retval	待ち時間(秒)
+    #	@note	送信と受信の通信時間にTimeoutSlack(ROM=>COMはRomTimeoutSlack)を足した時間で、
+    #			open()のtimOutより長くはしません(timOutがNoneのときは上限なし)
+    #	@note	通信速度がわからないときはtimOut(NoneのときはSerialポートの待ち時間)を返します
+    def transactionTimeout(self,txBuf,rxLen):
+        maxTimeout = self.__maxTimeout
+        if not getattr(self.com, 'baudrate', 0):
+            return maxTimeout if maxTimeout is not None else self.com.timeout
+        if len(txBuf) > 2 and txBuf[1] == Rcb4BaseLib.CommandTypes.Move.value and txBuf[2] == Rcb4BaseLib.SubMoveCmd.RomToCom.value:
+            slack = self.RomTimeoutSlack
+        else:
+            slack = self.TimeoutSlack
+        timeout = self.wireTime(len(txBuf) + rxLen) + slack
+        if maxTimeout is None:
+            return timeout
+        return min(timeout, maxTimeout)
+
+
+    ##	@brief	送受信を行い結果をFutureで返す
+    #	@note	パイプライン動作中は返信を待たずに返ります
+    def __transferFuture(self,sendbuf,rxLen):
+        pipeline = self.__pipeline
+        if pipeline is not None:
+            return pipeline.submit(sendbuf, rxLen)
+        future = Future()
+        with self.__lock:
+            future.set_result(self.__transfer(sendbuf, rxLen))
+        return future
+
 
     #////////////////////////////////////////////////////////////////////
     #//	Serialポートを設定をして開く
@@ -360,19 +1699,37 @@ class Rcb4BaseLib:
 	##	@brief	SerialポートをRCB-4用に設定をして開く
     #	@param	comName	ポートの名前
     #	@param	bundrate	通信速度
-    #	@param	timOut	受信タイムアウト
+    #	@param	timOut	受信タイムアウト(コマンドごとの待ち時間の上限) Noneのときは上限なし
     #	@retval	True：ポートを開いてコンフィグデータを取得できた
     #	@retval	False:ポートを開けなかったか、コンフィグデータを取得できなかった
+    #	@param	probe	Trueのとき通信速度を探して、使える一番速い速度に切り替える
+    #	@param	cacheFile	見つけた通信速度を記録するファイル(Noneで記録しない)
+    #	@param	slack	返信の待ち時間で通信時間に足す余裕(秒) NoneのときはTimeoutSlack
+    #	@param	romSlack	ROM=>COMの待ち時間で通信時間に足す余裕(秒) NoneのときはRomTimeoutSlack
     #	@note	Serialポートを開く
     #			通信ができるかどうかACKコマンドを送る
     #			コンフィグデータを取得する
     #			上のどれかが失敗したらエラーを返す
-    def open(self,comName,bundrate,timOut):
+    #	@note	probe=Trueのときは前回記録した速度、bundrate、速い順の対応速度の順にACKを送って今の速度を探し、
+    #			もっと速い速度があればsetBaudrate()で切り替えます
+    #	@note	返信の待ち時間はtransactionTimeout()でコマンドごとに決めます。Serialポートの待ち時間はPollTimeoutになります
+    #	@note	USBシリアル変換の受信遅延が大きい環境では、slackを大きくしてください
+    def open(self,comName,bundrate,timOut,probe = False,cacheFile = BaudrateCacheFile,slack = None,romSlack = None):
         if self.com == 0:
             try:
-                self.com = serial.Serial(comName,bundrate,parity='E',stopbits =1,timeout=timOut)
+                self.__maxTimeout = timOut
+                if slack is not None:
+                    self.TimeoutSlack = slack
+                if romSlack is not None:
+                    self.RomTimeoutSlack = romSlack
+                pollTimeout = Rcb4BaseLib.PollTimeout if timOut is None else min(timOut, Rcb4BaseLib.PollTimeout)
+                self.com = serial.Serial(comName,bundrate,parity='E',stopbits =1,timeout=pollTimeout)
                 self.com.flushInput()#
-                if self.checkAcknowledge() == True:
+                if probe:
+                    ackOk = self.__probeBaudrate(comName, bundrate, timOut, cacheFile)
+                else:
+                    ackOk = self.checkAcknowledge()
+                if ackOk == True:
                     #ACKが成功した場合Configデータを取得
                     confData = self.getConfig()
                     #confDataは0xFFFFの場合はエラー
@@ -389,12 +1746,120 @@ class Rcb4BaseLib:
         else:
             return False
 
+    #////////////////////////////////////////////////////////////////////
+    #//	通信速度を切り替える
+    #//
+    ##	@brief	RCB4とSerialポートの通信速度を切り替える
+    #	@param	baudrate	新しい通信速度(ComBaudratesにあるもの)
+    #	@retval	True	切り替えて新しい速度でACKが返ってきた
+    #	@retval	False	切り替えられなかった(元の速度に戻しています)
+    #	@note	コンフィグデータのBaudrateビットを書き換えてから、Serialポートの速度を変えます
+    #	@note	先にSerialポートがその速度に設定できるか確かめるので、RCB4だけが切り替わることはありません
+    #	@warning	パイプラインとスケジューラを止めた状態で呼んでください
+    def setBaudrate(self,baudrate):
+        bits = dict(Rcb4BaseLib.ComBaudrates).get(baudrate)
+        if bits is None:
+            return False
+        oldBaudrate = self.com.baudrate
+        if baudrate == oldBaudrate:
+            return self.checkAcknowledge()
+        if not self.__setHostBaudrate(baudrate) or not self.__setHostBaudrate(oldBaudrate):
+            return False
+
+        config = self.getConfig()
+        if config == 0xFFFF:
+            return False
+        config = (config & ~Rcb4BaseLib.ConfigData.Baudrate.value) | bits
+
+        #ACKは切り替え前の速度で返ってくるが、取りこぼしても新しい速度で確認する
+        self.moveComToRamCmdSynchronize(Rcb4BaseLib.RamAddr.ConfigRamAddress.value, [config & 0xff, (config >> 8) & 0xff])
+        self.__setHostBaudrate(baudrate)
+        if self.checkAcknowledge():
+            self.__configData = config
+            return True
+
+        #RCB4が切り替わらなかったので元に戻す
+        self.__setHostBaudrate(oldBaudrate)
+        return False
+
+
+    ##	@brief	Serialポートの通信速度だけを変える
+    #	@retval	False	その速度に設定できなかった
+    def __setHostBaudrate(self,baudrate):
+        try:
+            self.com.baudrate = baudrate
+        except (ValueError, serial.SerialException, OSError):
+            return False
+        self.__parser.discard(self.com)
+        return True
+
+
+    ##	@brief	今の通信速度を探して、一番速い速度に切り替える
+    #	@retval	True	RCB4と通信できた
+    #	@note	ACKの待ち時間の上限はProbeAckTimeoutにし、終わったらtimOutに戻します
+    def __probeBaudrate(self,comName,bundrate,timOut,cacheFile):
+        cached = Rcb4BaseLib.__loadBaudrateCache(cacheFile).get(comName)
+        candidates = [cached, bundrate] + [rate for rate, bits in Rcb4BaseLib.ComBaudrates]
+        self.__maxTimeout = Rcb4BaseLib.ProbeAckTimeout if timOut is None else min(timOut, Rcb4BaseLib.ProbeAckTimeout)
+        try:
+            current = None
+            for rate in dict.fromkeys(candidates):
+                if rate is not None and self.__setHostBaudrate(rate) and self.checkAcknowledge():
+                    current = rate
+                    break
+            if current is None:
+                return False
+
+            #速い順に試して、最初に切り替えられた速度を使う
+            for rate, bits in Rcb4BaseLib.ComBaudrates:
+                if rate <= current or self.setBaudrate(rate):
+                    break
+            if cacheFile is not None and cached != self.com.baudrate:
+                Rcb4BaseLib.__saveBaudrateCache(cacheFile, comName, self.com.baudrate)
+            return True
+        finally:
+            self.__maxTimeout = timOut
+
+
+    ##	@brief	記録した通信速度を読み込む
+    #	@retval	{ポート名:通信速度} (ファイルがないときは空)
+    @staticmethod
+    def __loadBaudrateCache(cacheFile):
+        if cacheFile is None:
+            return {}
+        try:
+            with open(cacheFile, encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return cache if isinstance(cache, dict) else {}
+
+
+    ##	@brief	見つけた通信速度を記録する
+    #	@note	書き込めなかったときは何もしません
+    @staticmethod
+    def __saveBaudrateCache(cacheFile, comName, baudrate):
+        cache = Rcb4BaseLib.__loadBaudrateCache(cacheFile)
+        cache[comName] = baudrate
+        try:
+            with open(cacheFile, 'w', encoding='utf-8') as f:
+                json.dump(cache, f)
+        except OSError:
+            pass
+
+
     #////////////////////////////////////////////////////////////////////
     #//	Serialポートを閉じる
     #//
     ##	@brief	Serialポートを閉じる
     #	@retval	Serialポートを閉じるのに失敗したらエラーを返す
     def close(self):
+        watcher = self.__motionWatcher
+        if watcher is not None:
+            self.__motionWatcher = None
+            watcher.close()
+        self.stopScheduler()
+        self.stopPipeline()
         try:
             self.com.close()
             self.com = 0
@@ -419,6 +1884,282 @@ class Rcb4BaseLib:
 
 
 
+    #////////////////////////////////////////////////////////////////////
+    #//	パイプライン送受信を開始する
+    #//
+    ##	@brief	返信を待たずにコマンドを連続して送るパイプライン送受信を開始する
+    #	@param	window	同時に返信待ちにできるコマンド数
+    #	@retval	True	開始できた
+    #	@retval	False	ポートが開いていないか、すでに開始している
+    #	@note	開始後はsynchronize()もパイプラインを通して送受信します
+    #	@note	返信はsynchronizePipelined()で受け取ったFutureに送信順に返ってきます
+    def startPipeline(self,window = 4):
+        if self.com == 0 or self.__pipeline is not None or window < 1:
+            return False
+        with self.__lock:
+            self.__parser.discard(self.com)
+        self.__pipeline = Rcb4BaseLib.AckPipeline(self.com, window, self.transactionTimeout, self.__maxTimeout)
+        self.__pipeline.Stats = self.__stats
+        return True
+
+
+    #////////////////////////////////////////////////////////////////////
+    #//	パイプライン送受信を終了する
+    #//
+    ##	@brief	パイプライン送受信を終了する
+    #	@note	返信待ちのコマンドがすべて返ってくる(もしくは失敗する)まで待ちます
+    def stopPipeline(self):
+        pipeline = self.__pipeline
+        if pipeline is not None:
+            self.__pipeline = None
+            pipeline.close()
+
+
+    #////////////////////////////////////////////////////////////////////
+    #//	返信を待たずに送信する
+    #//
+    ##	@brief	返信を待たずにコマンドを送信する
+    #	@param	txBuf	送信データの配列
+    #	@param	rxLen	受信データ数
+    #	@param	callback	返信が来た(もしくは失敗した)ときに呼ばれる関数(引数はFuture)
+    #	@retval	Future	結果は受信データ(失敗時は配列数0)
+    #	@note	パイプラインが開始されていないときはsynchronize()で送受信してから返します
+    #	@note	callbackは受信スレッドから呼ばれるので、時間のかかる処理はしないでください
+    def synchronizePipelined(self,txBuf,rxLen,callback = None):
+        sendbuf = self.__makeSendBuf(txBuf, rxLen)
+        scheduler = self.__scheduler
+        if sendbuf is None:
+            future = Future()
+            future.set_result([])
+        elif scheduler is not None and not scheduler.isWorkerThread():
+            future, wait = self.__schedule(scheduler, sendbuf, rxLen)
+        else:
+            future = self.__transferFuture(sendbuf, rxLen)
+        if callback is not None:
+            future.add_done_callback(callback)
+        return future
+
+
+    #////////////////////////////////////////////////////////////////////
+    #//	返信を待たずに送信してACKを判定する
+    #//
+    ##	@brief	返信を待たずにACKが返ってくるコマンドを送信する
+    #	@param	txData	送信データの配列
+    #	@param	callback	ACKの判定が終わったときに呼ばれる関数(引数はFuture)
+    #	@retval	Future	結果はACKが正常に返ってきたかどうか(True/False)
+    def synchronizeAckPipelined(self,txData,callback = None):
+        ackFuture = Future()
+        def setAck(future):
+            rxbuf = future.result()
+            ackFuture.set_result(len(rxbuf) > 3 and self.AckType.Ack.value == rxbuf[2])
+        self.synchronizePipelined(txData, 4, setAck)
+        if callback is not None:
+            ackFuture.add_done_callback(callback)
+        return ackFuture
+
+
+
+    #////////////////////////////////////////////////////////////////////
+    #//	複数のコマンドをまとめて送受信する
+    #//
+    ##	@brief	複数のコマンドを続けて送信してから、返信をまとめて受信する
+    #	@param	cmds	(送信データの配列,受信データ数)の配列
+    #	@retval	rxbufs	コマンドごとの受信データの配列(失敗したものは配列数0)
+    #	@note	1回の書き込みで全部送るので、返信待ちは1往復分になります
+    #	@note	途中で受信に失敗した場合は、それ以降のコマンドも失敗として返します
+    #	@note	パイプラインやスケジューラの動作中は、それぞれに続けて預けます
+    def synchronizeBatch(self,cmds):
+        sendbufs = [self.__makeSendBuf(txBuf, rxLen) for txBuf, rxLen in cmds]
+        if len(sendbufs) == 0 or any(sendbuf is None for sendbuf in sendbufs):
+            return [[] for cmd in cmds]
+        rxLens = [rxLen for txBuf, rxLen in cmds]
+
+        scheduler = self.__scheduler
+        if scheduler is not None and not scheduler.isWorkerThread():
+            scheduled = [self.__schedule(scheduler, sendbuf, rxLen) for sendbuf, rxLen in zip(sendbufs, rxLens)]
+            return [self.__waitScheduled(future, wait) for future, wait in scheduled]
+        if self.__pipeline is not None:
+            futures = [self.__transferFuture(sendbuf, rxLen) for sendbuf, rxLen in zip(sendbufs, rxLens)]
+            return [future.result() for future in futures]
+
+        rxbufs = []
+        with self.__lock:
+            self.__parser.discard(self.com)#buff clr
+            stats = self.__stats
+            if stats is not None:
+                start = time.perf_counter()
+            txData = b''.join(bytes(sendbuf) for sendbuf in sendbufs)
+            self.com.write(txData)
+            #最初の返信は、全部送り終わるまで遅れることがあるので送信時間の分も待つ
+            extra = self.wireTime(len(txData))
+            for sendbuf, rxLen in zip(sendbufs, rxLens):
+                if stats is not None:
+                    mark = stats.parserMark(self.__parser)
+                frame = self.__parser.readFrame(self.com, rxLen, self.transactionTimeout(sendbuf, rxLen) + extra)
+                extra = 0
+                if stats is not None:
+                    outcome = stats.record(sendbuf, rxLen, frame, start, self.__parser, mark)
+                if frame is None:
+                    break
+                rxbufs.append(bytes(frame))
+            if stats is not None:
+                for sendbuf, rxLen in list(zip(sendbufs, rxLens))[len(rxbufs) + 1:]:
+                    stats.record(sendbuf, rxLen, None, start, self.__parser, mark, outcome)
+        return rxbufs + [[] for i in range(len(rxLens) - len(rxbufs))]
+
+
+    ##	@brief	読み込みコマンドを送受信し、返信が来なかったときは送り直す
+    #	@param	txBuf	送信データの配列
+    #	@param	rxLen	受信データ数
+    #	@param	parse	受信データを変換する関数(synchronize()と同じ)
+    #	@retval	rxbuf	受信データ(ReadRetryCount回送り直しても失敗したときは配列数0)
+    #	@retval	parseを指定したときはparse(返信コマンド)の結果(失敗時はNone)
+    #	@warning	何度送っても結果が変わらないコマンド(RAM=>COMなど)だけに使ってください
+    def synchronizeRead(self,txBuf,rxLen,parse = None):
+        for i in range(Rcb4BaseLib.ReadRetryCount + 1):
+            rxbuf = self.synchronize(txBuf, rxLen, parse)
+            if rxbuf is not None and (parse is not None or len(rxbuf) >= rxLen):
+                break
+        return rxbuf
+
+
+    ##	@brief	複数の読み込みコマンドをまとめて送受信し、返信が来なかったものだけ送り直す
+    #	@param	cmds	(送信データの配列,受信データ数)の配列
+    #	@retval	rxbufs	受信データの配列(ReadRetryCount回送り直しても失敗したものは配列数0)
+    #	@warning	何度送っても結果が変わらないコマンド(RAM=>COMなど)だけに使ってください
+    def synchronizeReadBatch(self,cmds):
+        rxbufs = self.synchronizeBatch(cmds)
+        for i in range(Rcb4BaseLib.ReadRetryCount):
+            failed = [n for n, ((txBuf, rxLen), rxbuf) in enumerate(zip(cmds, rxbufs)) if len(rxbuf) < rxLen]
+            if not failed:
+                break
+            for n, rxbuf in zip(failed, self.synchronizeBatch([cmds[n] for n in failed])):
+                rxbufs[n] = rxbuf
+        return rxbufs
+
+
+    ##	@brief	ACKが返ってくる複数のコマンドをまとめて送受信する
+    #	@param	txDatas	送信データの配列の配列
+    #	@retval	True	すべてのコマンドのACKが正常に返ってきた
+    #	@retval	False	どれかのコマンドのACKが正常でなかった
+    def synchronizeAckBatch(self,txDatas):
+        rxbufs = self.synchronizeBatch([(txData, 4) for txData in txDatas])
+        return all(len(rxbuf) > 3 and self.AckType.Ack.value == rxbuf[2] for rxbuf in rxbufs)
+
+
+
+    #////////////////////////////////////////////////////////////////////
+    #//	送受信の記録を開始する
+    #//
+    ##	@brief	送受信の回数、結果、時間、byte数の記録を開始する
+    #	@retval	TransactionStats	記録先(すでに開始しているときはそれまでの記録先)
+    #	@note	記録はgetStats()で取り出せます。開始していないときは記録の処理を行いません
+    def startStats(self):
+        if self.__stats is None:
+            self.__stats = Rcb4BaseLib.TransactionStats()
+            if self.__pipeline is not None:
+                self.__pipeline.Stats = self.__stats
+        return self.__stats
+
+
+    ##	@brief	送受信の記録を終了する
+    def stopStats(self):
+        self.__stats = None
+        if self.__pipeline is not None:
+            self.__pipeline.Stats = None
+
+
+    ##	@brief	送受信の記録を取り出す
+    #	@param	reset	Trueのとき取り出した後に0に戻す
+    #	@retval	TransactionStats.snapshot()の値
+    #	@retval	None	記録を開始していない
+    def getStats(self,reset = False):
+        stats = self.__stats
+        if stats is None:
+            return None
+        snapshot = stats.snapshot()
+        if reset:
+            stats.reset()
+        return snapshot
+
+
+    #////////////////////////////////////////////////////////////////////
+    #//	コマンドスケジューラを開始する
+    #//
+    ##	@brief	優先度付きのコマンドスケジューラを開始する
+    #	@param	deadlines	優先度(CommandPriorityの値)ごとの期限(秒)の辞書(省略時は標準の期限)
+    #	@retval	True	開始できた
+    #	@retval	False	ポートが開いていないか、すでに開始している
+    #	@note	開始後はすべての送受信がスケジューラのスレッドから優先度順に行われます
+    #	@note	優先度はcommandPriority()で指定できます。指定がない場合はコマンドの種類から決めます
+    #	@note	(サーボの角度指令:Servo 読み出し:Telemetry それ以外:Motion)
+    def startScheduler(self,deadlines = None):
+        if self.com == 0 or self.__scheduler is not None:
+            return False
+        self.__scheduler = Rcb4BaseLib.CommandScheduler(self.__transferFuture, deadlines)
+        return True
+
+
+    #////////////////////////////////////////////////////////////////////
+    #//	コマンドスケジューラを終了する
+    #//
+    ##	@brief	コマンドスケジューラを終了する
+    #	@note	送信待ちのコマンドを送り終えるまで待ちます
+    def stopScheduler(self):
+        scheduler = self.__scheduler
+        if scheduler is not None:
+            self.__scheduler = None
+            scheduler.close()
+
+
+    #////////////////////////////////////////////////////////////////////
+    #//	送受信の優先度を指定する
+    #//
+    ##	@brief	withの中で送るコマンドの優先度と期限を指定する
+    #	@param	priority	CommandPriority
+    #	@param	deadline	期限(秒) Noneのときは優先度ごとの標準の期限
+    #	@note	with rcb4.commandPriority(Rcb4BaseLib.CommandPriority.Telemetry):
+    #	@note	    rcb4.getAllAdData()
+    #	@note	指定はスレッドごとに保持されます
+    @contextmanager
+    def commandPriority(self,priority,deadline = None):
+        previous = getattr(self.__priority, 'value', None)
+        self.__priority.value = (priority, deadline)
+        try:
+            yield
+        finally:
+            self.__priority.value = previous
+
+
+    ##	@brief	送信データから優先度と期限を決める
+    #	@return	(priority,deadline)
+    def __commandPriority(self,sendbuf):
+        value = getattr(self.__priority, 'value', None)
+        if value is not None:
+            return value
+        cmd = sendbuf[1]
+        if cmd == Rcb4BaseLib.CommandTypes.ConstFrameServo.value or cmd == Rcb4BaseLib.CommandTypes.SingleServo.value:
+            return Rcb4BaseLib.CommandPriority.Servo, None
+        if cmd == Rcb4BaseLib.CommandTypes.Move.value and (sendbuf[2] == Rcb4BaseLib.SubMoveCmd.RamToCom.value or sendbuf[2] == Rcb4BaseLib.SubMoveCmd.DeviceToCom.value):
+            return Rcb4BaseLib.CommandPriority.Telemetry, None
+        return Rcb4BaseLib.CommandPriority.Motion, None
+
+
+    ##	@brief	上書きしてよいサーボの角度指令を判別するキーを作る
+    #	@retval	キー(同じサーボの組み合わせへの角度指令は同じキー)
+    #	@retval	None	上書きしないコマンド
+    def __coalesceKey(self,sendbuf,priority):
+        if priority != Rcb4BaseLib.CommandPriority.Servo:
+            return None
+        cmd = sendbuf[1]
+        if cmd == Rcb4BaseLib.CommandTypes.ConstFrameServo.value:
+            return bytes(sendbuf[1:7])	#コマンドとICSのビットマスク
+        if cmd == Rcb4BaseLib.CommandTypes.SingleServo.value:
+            return bytes(sendbuf[1:3])	#コマンドとICS番号
+        return None
+
+
+
     #/////////////////////////////////////////////////////////////////////////////////////////
     #//	コマンド関係
     #/////////////////////////////////////////////////////////////////////////////////////////
@@ -557,22 +2298,20 @@ class Rcb4BaseLib:
         
         #送信データがうまく作れた 
         if readSize > 0:
-            rxbuf = self.synchronize(sendData, readSize)
+            readTime = time.monotonic()
+            #成功の場合は受信データのみを入れる(受信バッファから直接コピー)
+            rxbuf = self.synchronizeRead(sendData, readSize, lambda frame: bytes(frame[2:2 + scrDataSize]))
             #正常にデータが返っていないときはエラーを返す
-            if len(rxbuf)< readSize:
+            if rxbuf is None:
                 rxbuf = []
                 return False,rxbuf
             
-                        #成功の場合は受信データのみを入れる
-            destData = []
-            if scrDataSize == 1: #1byte のみのとき                
-                destData.append (rxbuf[2])
-            
-            else:    #複数byteのとき                
-                for i in range(scrDataSize):
-                    destData.append (rxbuf[i+2])                    
-                                       
-            return True, bytes(destData) 
+            #プログラムカウンタとフラグが含まれていれば、モーションの見張りにも使う
+            watcher = self.__motionWatcher
+            pcOffset = Rcb4BaseLib.RamAddr.ProgramCounterRamAddress.value - scrAddr
+            if watcher is not None and 0 <= pcOffset and pcOffset + 8 <= scrDataSize:
+                watcher.feed(rxbuf[pcOffset:pcOffset + 8], readTime)
+            return True, rxbuf
             
         #送信データがうまく作れなかった
         else:
@@ -580,6 +2319,69 @@ class Rcb4BaseLib:
             return False,rxbuf
 
 
+    #///////////////////////////////////////////////////////////////////////////////////
+    #//ROMの内容をCOMに転送するコマンド
+    #//
+    ##	@brief	ROMからCOMにデータを出力するコマンドを作成します(ROM ==> COM)
+    #	@param	romAddr	取得するデータの先頭アドレス(3byte)
+    #	@param	scrDataSize	取得するデータbyte数(1-RamSnapshot.MaxBlockSize)
+    #	@retval	returnDataSize	受信データ数(引数が不正なときは0)
+    #	@retval	txbuf	送信データコマンドデータ配列
+    #	@note	RAM=>COMと同じ形で、転送元のアドレスだけ3byteになります
+    #	@note	静的関数で外部アクセスが可能
+    @staticmethod
+    def moveRomToComCmd(romAddr, scrDataSize):
+        if not (0 < scrDataSize <= Rcb4BaseLib.RamSnapshot.MaxBlockSize) or not (0 <= romAddr <= 0xffffff):
+            return 0,[]
+        txbuf =[]
+        txbuf.append (0x0b)
+        txbuf.append ( Rcb4BaseLib.CommandTypes.Move.value)
+        txbuf.append ( Rcb4BaseLib.SubMoveCmd.RomToCom.value)
+        txbuf.append ( 0x00)
+        txbuf.append ( 0x00)
+        txbuf.append ( 0x00)
+        txbuf.append ( romAddr & 0xff)
+        txbuf.append ( (romAddr >> 8 ) & 0xff)
+        txbuf.append ( (romAddr >> 16) & 0xff)
+        txbuf.append (scrDataSize)
+        txbuf.append (Rcb4BaseLib.CheckSum(txbuf))
+        
+        returnDataSize = scrDataSize + 3
+        
+        return returnDataSize,txbuf
+
+
+    #///////////////////////////////////////////////////////////////////////////////////
+    #//	ROMの内容をまとめて読み込む
+    #//
+    ##	@brief	ROM上のデータを読み込みます(ROM ==> COM)
+    #	@param	romAddr	取得するデータの先頭アドレス
+    #	@param	size	取得するデータbyte数(何byteでも可)
+    #	@param	batchSize	返信を待たずに続けて送るコマンド数
+    #	@retval	True:正常にデータが返ってきた	False:正常にデータが返ってこなかった
+    #	@retval	受信したデータ(bytearray) 失敗時は空のデータ配列
+    #	@note	RamSnapshot.MaxBlockSize byteずつに分け、batchSize個ずつsynchronizeReadBatch()で読み込みます
+    def readRom(self,romAddr,size,batchSize = 4):
+        blockSize = Rcb4BaseLib.RamSnapshot.MaxBlockSize
+        cmds = []
+        for addr in range(romAddr, romAddr + size, blockSize):
+            blockLen = min(blockSize, romAddr + size - addr)
+            readSize, sendData = self.moveRomToComCmd(addr, blockLen)
+            if readSize == 0:
+                return False,[]
+            cmds.append((sendData, readSize))
+
+        data = bytearray()
+        for i in range(0, len(cmds), max(batchSize, 1)):
+            batch = cmds[i:i + max(batchSize, 1)]
+            rxbufs = self.synchronizeReadBatch(batch)
+            for (sendData, readSize), rxbuf in zip(batch, rxbufs):
+                if len(rxbuf) < readSize:
+                    return False,[]
+                data += rxbuf[2:readSize - 1]
+        return True,data
+
+
     #///////////////////////////////////////////////////////////////////////////////////
     #//	COMからDeviceにデータを転送するコマンドを生成する　ﾊﾞｯﾌｧｰにセット
     #//
@@ -702,22 +2504,13 @@ class Rcb4BaseLib:
         
         #送信データがうまく作れた 
         if readSize > 0:
-            rxbuf = self.synchronize(sendData, readSize)
+            #成功の場合は受信データのみを入れる(受信バッファから直接コピー)
+            rxbuf = self.synchronizeRead(sendData, readSize, lambda frame: bytes(frame[2:2 + dataSize]))
             #正常にデータが返っていないときはエラーを返す
-            if len(rxbuf)< readSize:
+            if rxbuf is None:
                 rxbuf = []
                 return False,rxbuf
-            
-                        #成功の場合は受信データのみを入れる
-            destData = []
-            if dataSize == 1: #1byte のみのとき                
-                destData.append (rxbuf[2])
-            
-            else:    #複数byteのとき                
-                for i in range(dataSize):
-                    destData.append (rxbuf[i+2])                    
-                                       
-            return True, bytes(destData) 
+            return True, rxbuf
             
         #送信データがうまく作れなかった
         else:
@@ -783,8 +2576,12 @@ class Rcb4BaseLib:
     #	@param	servoDatas	サーボモータ型のデータが入力されている配列
     #	@retval	ret	サーボモータを複数アクセスするときに必要なデータ5byte分
     #	@note	必要なデータは、サーボモータを変更する部分にbitを立てる
+    #	@note	servoDatasにはServoFrameも渡せます
     @staticmethod   #add 2018/10/19
     def setServoNo (servoDatas):
+      if type(servoDatas) is Rcb4BaseLib.ServoFrame:
+        return servoDatas.Mask << 24
+
       ret = 0;
       
       for idat in servoDatas:
@@ -840,18 +2637,32 @@ class Rcb4BaseLib:
     #//	複数のサーボを動かす　ﾊﾞｯﾌｧｰにセット
     #//
     ##	@brief	複数のサーボモータを同時に動かすコマンドの作成
-    #	@param	servoDatas	サーボモータのデータが保存されている配列
+    #	@param	servoDatas	サーボモータのデータが保存されている配列(ServoFrameも可)
     #	@param	frame	サーボモータを動かすフレーム数
    	#	@return	(returnDataSize,txbuf)
     #	@retval	returnDataSize	返ってくるデータサイズ
     #	@retval	txbuf	コマンド全体のデータ配列
     #	@note	複数のサーボモータを動かすためのコマンドを作成します
     #	@note	静的関数で外部アクセスが可能
+    #	@note	ServoFrameの場合はtxbufがbytearrayになります
     #	@warning	引数のデータは中身が書き換えられるので注意	
     @staticmethod   #add 2018/10/19
     def runConstFrameServoCmd (servoDatas,frame):
         buf =[]
         
+        if type(servoDatas) is Rcb4BaseLib.ServoFrame:	#ICS番号順に並んでいるので、そのまま詰める
+            datas = servoDatas.datas()
+            if len(datas) == 0 or not (0 <= frame <= 0xff):
+                return -1,buf
+            buf = bytearray(len(datas) * 2 + 9)
+            buf[0] = len(buf)
+            buf[1] = Rcb4BaseLib.CommandTypes.ConstFrameServo.value
+            buf[2:7] = servoDatas.Mask.to_bytes(5, 'little')
+            buf[7] = frame
+            struct.pack_into('<%dH' % len(datas), buf, 8, *datas)
+            buf[-1] = Rcb4BaseLib.CheckSum(buf)
+            return 4,buf
+
         sDatas = []	
         if type(servoDatas) == Rcb4BaseLib.ServoData:	#サーボモータが単体だった時の処理
             sDatas.append(servoDatas)
@@ -883,7 +2694,7 @@ class Rcb4BaseLib:
     #//	サーボモータのパラメータを変更するコマンドを生成する
     #//
     ##	@brief	サーボモータのパラメータを変更するコマンドを生成する
-    #	@param	servoDatas	サーボモータのデータが保存されている配列
+    #	@param	servoDatas	サーボモータのデータが保存されている配列(ServoFrameも可)
     #	@param	servoParameter	サーボモータのどのパラメータを変更するか指定
    	#	@return	(returnDataSize,txbuf)
     #	@retval	returnDataSize	返ってくるデータサイズ
@@ -891,11 +2702,27 @@ class Rcb4BaseLib:
     #	@note	サーボモータのパラメータを変更するコマンドを生成します
     #	@note	静的関数で外部アクセスが可能
     #	@note	servoParameter	0x01:ストレッチ	0x02:スピード
+    #	@note	ServoFrameの場合はtxbufがbytearrayになります
     #	@warning	引数のデータは中身が書き換えられるので注意
     @staticmethod   #add 2018/10/19
     def setParametersBaseCmd (servoDatas,servoParameter):
         buf =[]
     
+        if type(servoDatas) is Rcb4BaseLib.ServoFrame:	#ICS番号順に並んでいるので、そのまま詰める
+            datas = servoDatas.datas()
+            if len(datas) == 0:
+                return -1,buf
+            if not all(0 < data < 128 for data in datas):
+                return 0,buf
+            buf = bytearray(len(datas) + 9)
+            buf[0] = len(buf)
+            buf[1] = Rcb4BaseLib.CommandTypes.ServoParam.value
+            buf[2:7] = servoDatas.Mask.to_bytes(5, 'little')
+            buf[7] = servoParameter
+            buf[8:-1] = bytes(datas)
+            buf[-1] = Rcb4BaseLib.CheckSum(buf)
+            return 4,buf
+
         sDatas = []
         if type(servoDatas) == Rcb4BaseLib.ServoData:
             sDatas.append(servoDatas)
@@ -915,7 +2742,7 @@ class Rcb4BaseLib:
         buf.append ((wk >> 32) & 0xff)
         buf.append (servoParameter)
         servoDatas = sorted(sDatas)
-        for idat in sDatas:
+        for idat in servoDatas:
             if 0<idat.Data<128:
                 buf.append(idat.Data & 0xff)
             else:
@@ -980,7 +2807,7 @@ class Rcb4BaseLib:
     #//	指定した複数のサーボモータを動かす
     #//	
     ##	@brief	複数のサーボモータを同時に動かす
-    #	@param	servoDatas	サーボモータのデータが保存されている配列
+    #	@param	servoDatas	サーボモータのデータが保存されている配列(ServoFrameも可)
     #	@param	frame	サーボモータを動かすフレーム数
 	#	@retval	True	正常にデータを送信
 	#	@retval	False	データが正常に送信できなかった
@@ -992,6 +2819,67 @@ class Rcb4BaseLib:
       return  self.synchronizeAck(txbuf)
 
 
+    #///////////////////////////////////////////////////////////////////////////////////
+    #//	複数サーボを動かすコマンドのひな形を作成する
+    #//
+    ##	@brief	サーボモータの組み合わせを固定したConstFrameServoコマンドのひな形を作成します
+    #	@param	servoDatas	サーボモータのデータが保存されている配列(使うのはSIO,IDのみ)
+    #	@retval	ConstFrameTemplate	作成したひな形
+    #	@retval	None	servoDatasに重複や異常値があった
+    #	@note	IDとSIOの確認はここで一度だけ行います
+    #	@note	静的関数で外部アクセスが可能
+    @staticmethod
+    def compileConstFrameTemplate (servoDatas):
+        sDatas = []
+        if type(servoDatas) == Rcb4BaseLib.ServoData:	#サーボモータが単体だった時の処理
+            sDatas.append(servoDatas)
+        else:
+            sDatas = list(servoDatas)
+
+        if len(sDatas) == 0 or Rcb4BaseLib.checkServoDatas(sDatas) == False:
+            return None
+
+        return Rcb4BaseLib.ConstFrameTemplate(sDatas)
+
+
+    #///////////////////////////////////////////////////////////////////////////////////
+    #//	ひな形を使って複数のサーボモータを動かす
+    #//
+    ##	@brief	ひな形を使って複数のサーボモータを同時に動かす
+    #	@param	template	compileConstFrameTemplate()で作成したひな形
+    #	@param	positions	ポジションデータの配列(ひな形を作った時のservoDatasと同じ並び)
+    #	@param	frame	サーボモータを動かすフレーム数
+	#	@retval	True	正常にデータを送信
+	#	@retval	False	データが正常に送信できなかった
+    #	@note	setServoPos()と同じコマンドを送りますが、毎回のデータ確認とソートを省略します
+    def setServoPosTemplate (self,template,positions,frame):
+      txbuf = template.setPos(positions,frame)
+      if txbuf is None:
+          return False
+      return  self.synchronizeAck(txbuf)
+
+
+    #///////////////////////////////////////////////////////////////////////////////////
+    #//	ひな形を使って複数のサーボモータを返信を待たずに動かす
+    #//
+    ##	@brief	ひな形を使って複数のサーボモータを返信を待たずに動かす
+    #	@param	template	compileConstFrameTemplate()で作成したひな形
+    #	@param	positions	ポジションデータの配列(ひな形を作った時のservoDatasと同じ並び)
+    #	@param	frame	サーボモータを動かすフレーム数
+    #	@param	callback	ACKの判定が終わったときに呼ばれる関数(引数はFuture)
+    #	@retval	Future	結果はACKが正常に返ってきたかどうか(True/False)
+    #	@note	startPipeline()で開始していないときはsetServoPosTemplate()と同じく返信を待ちます
+    def setServoPosTemplatePipelined (self,template,positions,frame,callback = None):
+      txbuf = template.setPos(positions,frame)
+      if txbuf is None:
+          future = Future()
+          future.set_result(False)
+          if callback is not None:
+              future.add_done_callback(callback)
+          return future
+      return  self.synchronizeAckPipelined(txbuf,callback)
+
+
     #///////////////////////////////////////////////////////////////////////////////////
     #//	指定した複数のサーボモータをフリーにする
     #//
@@ -1015,6 +2903,8 @@ class Rcb4BaseLib:
         if len(buf) <= 0: #データがなかった場合
           return False
         else:
+          #スケジューラ動作中は送信待ちの角度指令より先に送る
+          with self.commandPriority(Rcb4BaseLib.CommandPriority.Safety):
             return  self.setServoPos(buf,1)
 
 
@@ -1041,6 +2931,8 @@ class Rcb4BaseLib:
         if len(buf) <= 0: #データがなかった場合
           return False
         else:
+          #スケジューラ動作中は送信待ちの角度指令より先に送る
+          with self.commandPriority(Rcb4BaseLib.CommandPriority.Safety):
             return  self.setServoPos(buf,1)
 
 
@@ -1054,7 +2946,8 @@ class Rcb4BaseLib:
 	#	@retval	False	データが正常に送信できなかった
     #	@note	ポジション部分を0x8000にしてsetSingleServo()に送る
     def setFreeSingleServo (self,id, sio):
-      return  self.setSingleServo (id,sio,0x8000,1)
+      with self.commandPriority(Rcb4BaseLib.CommandPriority.Safety):
+        return  self.setSingleServo (id,sio,0x8000,1)
         
     #///////////////////////////////////////////////////////////////////////////////////
     #//	指定した単体のサーボモータをホールドにする
@@ -1066,7 +2959,8 @@ class Rcb4BaseLib:
 	#	@retval	False	データが正常に送信できなかった
     #	@note	ポジション部分を0x7FFFにしてsetSingleServo()に送る
     def setHoldSingleServo (self,id, sio):
-      return  self.setSingleServo (id,sio,0x7fff,1)
+      with self.commandPriority(Rcb4BaseLib.CommandPriority.Safety):
+        return  self.setSingleServo (id,sio,0x7fff,1)
 
 
 
@@ -1098,11 +2992,101 @@ class Rcb4BaseLib:
 
 
 
+    #///////////////////////////////////////////////////////////////////////////////////
+    #//	ICSデバイスのRAMアドレスを取得する
+    #//
+    ##	@brief	ICSデバイスのデータが保存されているRAMアドレスを取得する
+    #	@param	icsNum	ICS番号
+    #	@retval	ICSデバイスの先頭のRAMアドレス
+    #	@retval	-1	ICS番号が範囲外
+    #	@note	静的関数で外部アクセスが可能
+    @staticmethod
+    def icsDeviceAddr(icsNum):
+        if 0 <= icsNum < Rcb4BaseLib.IcsDeviceSize:
+            return Rcb4BaseLib.RamAddr.IcsDeviceRamAddress.value + icsNum * Rcb4BaseLib.IcsDeviceDataSize
+        else:
+            return -1
+
+
+    #///////////////////////////////////////////////////////////////////////////////////
+    #//	ICS番号をRAM=>COM 1回で読めるブロックに分ける
+    #//
+    ##	@brief	ICS番号を、RAM=>COM 1回で現在位置を読めるブロックに分ける
+    #	@param	icsNums	ICS番号の配列
+    #	@retval	[(first,last,icsNums),...]	ブロックの先頭と最後のICS番号、ブロック内のICS番号(numpy配列)
+    #	@note	1ブロックは最大13デバイス分(20byte * 12 + 2byte = 242byte)になります
+    #	@note	静的関数で外部アクセスが可能
+    @staticmethod
+    def planIcsBlocks(icsNums):
+        maxSpan = (Rcb4BaseLib.RamSnapshot.MaxBlockSize - 2) // Rcb4BaseLib.IcsDeviceDataSize
+        blocks = []
+        current = []
+        for icsNum in sorted(set(icsNums)):
+            if not (0 <= icsNum < Rcb4BaseLib.IcsDeviceSize):
+                continue
+            if len(current) > 0 and icsNum - current[0] > maxSpan:
+                blocks.append((current[0], current[-1], np.array(current)))
+                current = []
+            current.append(icsNum)
+        if len(current) > 0:
+            blocks.append((current[0], current[-1], np.array(current)))
+        return blocks
+
+
+    #///////////////////////////////////////////////////////////////////////////////////
+    #//	連続したICSデバイスの現在位置をまとめて取得する
+    #//
+    ##	@brief	連続したICSデバイスの現在位置をRAM=>COM 1回で取得する
+    #	@param	first	先頭のICS番号
+    #	@param	last	最後のICS番号(first + 12以下)
+    #	@return	(retf,positions)
+    #	@retval	retf	True:取得成功	False:取得失敗
+    #	@retval	positions	first～lastの現在位置(numpyのint32配列) 失敗時は配列数0
+    #	@note	ICSデバイスのデータはRAM上に20byteずつ並んでいるので、
+    #	@note	firstのMotorPositionからlastのMotorPositionまでを1回で読み込み、20byteおきに取り出します
+    def readIcsPosBlock(self,first,last):
+        offset = Rcb4BaseLib.DeviceAddrOffset.MotorPositionAddressOffset.value
+        count = last - first + 1
+        size = (count - 1) * Rcb4BaseLib.IcsDeviceDataSize + 2
+        if first < 0 or count < 1 or Rcb4BaseLib.IcsDeviceSize <= last or Rcb4BaseLib.RamSnapshot.MaxBlockSize < size:
+            return False, np.zeros(0, dtype=np.int32)
+
+        #受信バッファから直接20byteおきに取り出す(コピーはint32への変換の1回だけ)
+        readSize, sendData = self.moveRamToComCmd(self.icsDeviceAddr(first) + offset, size)
+        positions = self.synchronizeRead(sendData, readSize, lambda frame: np.ndarray((count,), dtype='<i2', buffer=frame, offset=2, strides=(Rcb4BaseLib.IcsDeviceDataSize,)).astype(np.int32))
+        if positions is None:
+            return False, np.zeros(0, dtype=np.int32)
+        return True, positions
+
+
+    #///////////////////////////////////////////////////////////////////////////////////
+    #//	複数のサーボモータの現在位置をまとめて取得する
+    #//
+    ##	@brief	複数のサーボモータの現在位置をまとめて取得する
+    #	@param	icsNums	ICS番号の配列(icsNum2id()で計算した値)
+    #	@return	(retf,positions)
+    #	@retval	retf	True:すべて取得成功	False:どこかで取得失敗
+    #	@retval	positions	ICS番号を添字とした現在位置の配列(numpyのint32,数はIcsDeviceSize)
+    #	@retval	positions	取得していない・失敗したICS番号は-1
+    #	@note	近いICS番号はまとめて読み込むので、ServoJsonの16個なら2回の送受信で済みます
+    #	@note	numpyが必要です
+    def getMultiPos(self,icsNums):
+        positions = np.full(Rcb4BaseLib.IcsDeviceSize, -1, dtype=np.int32)
+        result = True
+        for first, last, nums in Rcb4BaseLib.planIcsBlocks(icsNums):
+            retf, blockPos = self.readIcsPosBlock(first, last)
+            if retf:
+                positions[nums] = blockPos[nums - first]
+            else:
+                result = False
+        return result, positions
+
+
     #///////////////////////////////////////////////////////////////////////////////////
     #//	一度にサーボモータのスピードを指定する
     #//
     ##	@brief	一度にサーボモータのスピードを指定する
-    #	@param	servoDatas	サーボモータのデータが保存されている配列
+    #	@param	servoDatas	サーボモータのデータが保存されている配列(ServoFrameも可)
 	#	@retval	True	正常にデータを送信
 	#	@retval	False	データが正常に送信できなかった
     #	@note	setParametersBaseCmdのパラメータを２に設定してコマンドを作成し、送受信をする
@@ -1115,7 +3099,7 @@ class Rcb4BaseLib:
     #//	一度にサーボモータのストレッチを指定する
     #//
     ##	@brief	一度にサーボモータのストレッチを指定する
-    #	@param	servoDatas	サーボモータのデータが保存されている配列
+    #	@param	servoDatas	サーボモータのデータが保存されている配列(ServoFrameも可)
 	#	@retval	True	正常にデータを送信
 	#	@retval	False	データが正常に送信できなかった
     #	@note	setParametersBaseCmdのパラメータを1に設定してコマンドを作成し、送受信をする
@@ -1158,6 +3142,157 @@ class Rcb4BaseLib:
             return (rxbuf[1] * 256 + rxbuf[0])
 
 
+    #///////////////////////////////////////////////////////////////////////////////////
+    #// 1フレームの時間を取得する
+    #///////////////////////////////////////////////////////////////////////////////////
+    ##	@brief	1フレーム(サーボの出力周期)の時間を取得する
+    #	@retval	時間(秒)
+    #	@note	open()で取得したコンフィグデータの出力周期から求めるので、通信はしません
+    #	@note	サーボを動かすコマンドのフレーム数 × この時間が補間にかかる時間になります
+    def getFramePeriod(self):
+        return Rcb4BaseLib.FramePeriods[(self.__configData & Rcb4BaseLib.ConfigData.Frame.value) >> 4]
+
+
+    #///////////////////////////////////////////////////////////////////////////////////
+    #//	RAMのデータをまとめて読み込む
+    #///////////////////////////////////////////////////////////////////////////////////
+    ##	@brief	RamSnapshotで指定したデータをまとめて読み込む
+    #	@param	snapshot	Rcb4BaseLib.RamSnapshot
+    #	@retval	True	すべてのブロックの読み込みに成功
+    #	@retval	False	読み込みに失敗(snapshotの中身は前回のまま)
+    #	@note	snapshot.Blocksの数だけRAM=>COMを行います
+    #	@note	例: snap = Rcb4BaseLib.RamSnapshot(['config','programCounter','adc','pio'])
+    #	@note	    if rcb4.readRamSnapshot(snap): print(snap.motionPlayNum(), snap.voltage())
+    def readRamSnapshot(self,snapshot):
+        datas = []
+        for addr, size, offset in snapshot.Blocks:
+            retf,rxbuf = self.moveRamToComCmdSynchronize(addr, size)
+            if (retf == False) or (len(rxbuf) != size):
+                return False
+            datas.append(rxbuf)
+
+        for i in range(len(datas)):
+            snapshot.setBlock(i, datas[i])
+        snapshot.setUpdated()
+        return True
+
+
+    #///////////////////////////////////////////////////////////////////////////////////
+    #//	ICSデバイスのデータをまとめて読み書きする
+    #///////////////////////////////////////////////////////////////////////////////////
+    ##	@brief	全ICSデバイスのデータをIcsDeviceTableに読み込む
+    #	@param	table	Rcb4BaseLib.IcsDeviceTable
+    #	@param	batchSize	返信を待たずに続けて送るコマンド数
+    #	@retval	True	読み込みに成功(tableの変更の印は消えます)
+    #	@retval	False	読み込みに失敗(tableの中身は前回のまま)
+    #	@note	IcsDeviceRamAddressからRamSnapshot.MaxBlockSize byteずつのRAM=>COM(700byteで3回)で読み込みます
+    def loadIcsDeviceTable(self,table,batchSize = 4):
+        start = Rcb4BaseLib.RamAddr.IcsDeviceRamAddress.value
+        size = len(table.Data)
+        cmds = []
+        for addr in range(start, start + size, Rcb4BaseLib.RamSnapshot.MaxBlockSize):
+            readSize, sendData = self.moveRamToComCmd(addr, min(Rcb4BaseLib.RamSnapshot.MaxBlockSize, start + size - addr))
+            cmds.append((sendData, readSize))
+
+        data = bytearray()
+        for i in range(0, len(cmds), max(batchSize, 1)):
+            batch = cmds[i:i + max(batchSize, 1)]
+            rxbufs = self.synchronizeReadBatch(batch)
+            for (sendData, readSize), rxbuf in zip(batch, rxbufs):
+                if len(rxbuf) < readSize:
+                    return False
+                data += rxbuf[2:readSize - 1]
+        table.setLoaded(data)
+        return True
+
+
+    ##	@brief	IcsDeviceTableで変更したデータだけをICSデバイスに書き込む
+    #	@param	table	Rcb4BaseLib.IcsDeviceTable
+    #	@param	batchSize	返信を待たずに続けて送るコマンド数
+    #	@retval	True	すべての変更を書き込めた(変更がないときもTrue)
+    #	@retval	False	ACKが返ってこなかった書き込みがある(その範囲は変更の印が残るので、もう一度呼べば書き直します)
+    #	@note	table.plan()の範囲ごとにCOM=>Deviceを作り、batchSize個ずつsynchronizeBatch()で送ります
+    def applyIcsDeviceTable(self,table,batchSize = 4):
+        spans = table.plan()
+        result = True
+        for i in range(0, len(spans), max(batchSize, 1)):
+            batch = spans[i:i + max(batchSize, 1)]
+            cmds = []
+            for icsNum, offset, data in batch:
+                readSize, sendData = self.moveComToDeviceCmd(icsNum, offset, data)
+                cmds.append((sendData, readSize))
+            rxbufs = self.synchronizeBatch(cmds)
+            for (icsNum, offset, data), rxbuf in zip(batch, rxbufs):
+                if len(rxbuf) > 3 and Rcb4BaseLib.AckType.Ack.value == rxbuf[2]:
+                    table.markClean(icsNum, offset, data)
+                else:
+                    result = False
+        return result
+
+
+    ##	@brief	指定した範囲のICSデバイスのデータをIcsDeviceTableに読み込み直す
+    #	@param	table	Rcb4BaseLib.IcsDeviceTable
+    #	@param	first	先頭のICS番号
+    #	@param	last	最後のICS番号
+    #	@retval	True	読み込みに成功(その範囲の変更の印は消えます)
+    #	@retval	False	読み込みに失敗(tableの中身は前回のまま)
+    #	@note	RamSnapshot.MaxBlockSize byteずつのRAM=>COMを1回のsynchronizeReadBatch()で読み込みます
+    def reloadIcsDevices(self,table,first,last):
+        size = Rcb4BaseLib.IcsDeviceDataSize
+        start = self.icsDeviceAddr(first)
+        end = self.icsDeviceAddr(last) + size
+        cmds = []
+        for addr in range(start, end, Rcb4BaseLib.RamSnapshot.MaxBlockSize):
+            readSize, sendData = self.moveRamToComCmd(addr, min(Rcb4BaseLib.RamSnapshot.MaxBlockSize, end - addr))
+            cmds.append((sendData, readSize))
+        data = bytearray()
+        for (sendData, readSize), rxbuf in zip(cmds, self.synchronizeReadBatch(cmds)):
+            if len(rxbuf) < readSize:
+                return False
+            data += rxbuf[2:readSize - 1]
+        table.setLoaded(data, first * size)
+        return True
+
+
+    #///////////////////////////////////////////////////////////////////////////////////
+    #//	ミキシングの設定をまとめて切り替える
+    #//
+    ##	@brief	MixingProfileの設定をまとめて書き込み、読み込み直して確かめる
+    #	@param	profile	Rcb4BaseLib.MixingProfile
+    #	@param	table	使いまわすIcsDeviceTable(Noneのときは新しく作ります)
+    #	@param	batchSize	返信を待たずに続けて送るコマンド数
+    #	@retval	True	すべて書き込んで、読み込み直した値も設定どおりだった
+    #	@retval	False	失敗(元の設定に戻せたかはLastRollbackOkに入ります)
+    #	@note	最初に設定するデバイスの範囲をreloadIcsDevices()で読み込み直し、ボードの今の値と違うbyteだけを書き込みます
+    #	@note	確認も同じ範囲をまとめて読み込み直して行うので、書き込みのほかに2回(失敗して戻すときはさらに2回)の読み込みになります
+    #	@warning	tableに書き込んでいない変更があると、それも一緒に書き込まれます
+    def applyMixingProfile(self,profile,table = None,batchSize = 4):
+        self.LastRollbackOk = None
+        if len(profile.Slots) == 0:
+            return True
+        if table is None:
+            table = Rcb4BaseLib.IcsDeviceTable()
+        icsNums = profile.icsNums()
+        first, last = icsNums[0], icsNums[-1]
+
+        #別のところで書き換えられていることがあるので、比べる前にボードから読み込み直す
+        if not self.reloadIcsDevices(table, first, last):
+            return False
+        previous = Rcb4BaseLib.MixingProfile.fromTable(table, profile.Slots)
+
+        profile.applyTo(table)
+        if self.applyIcsDeviceTable(table, batchSize) and self.reloadIcsDevices(table, first, last):
+            if len(profile.mismatches(table)) == 0:
+                return True
+
+        #途中で失敗したので元の設定に戻す(読み込み直せたときは、ボードの今の値との違いだけを書き込む)
+        reloaded = self.reloadIcsDevices(table, first, last)
+        previous.applyTo(table)
+        written = self.applyIcsDeviceTable(table, batchSize)
+        self.LastRollbackOk = reloaded and written and self.reloadIcsDevices(table, first, last) and len(previous.mismatches(table)) == 0
+        return False
+
+
     #///////////////////////////////////////////////////////
     #//PIO関係
     #///////////////////////////////////////////////////////
@@ -1608,6 +3743,129 @@ class Rcb4BaseLib:
                 return False,-1
         else:
             return False,-1
+
+
+    #///////////////////////////////////////////////////////////////////////////////////
+    #//	カウンタの値をまとめて読み込む
+    #//
+    ##	@brief	複数のカウンタの値をRAM=>COM 1回で読み込みます
+    #	@param	counterNums	カウンタの番号の配列(Noneのときはすべて)
+    #	@return	(retf,countDatas)
+    #	@retval	retf	True:通信成功	False:失敗
+    #	@retval	countDatas	counterNumsの順のカウンタの値(numpyのint32配列) 失敗時は配列数0
+    #	@note	カウンタはCounterRamAddressから並んでいるので、一番小さい番号から一番大きい番号までを1回で読み込みます
+    #	@note	numpyが必要です
+    def getUserCounters(self,counterNums = None):
+        if counterNums is None:
+            counterNums = range(1, Rcb4BaseLib.CounterCount + 1)
+        return self.__readRamValues(Rcb4BaseLib.RamAddr.CounterRamAddress.value, 'u1', Rcb4BaseLib.CounterCount, counterNums)
+
+
+    #///////////////////////////////////////////////////////////////////////////////////
+    #//	カウンタの値をまとめて書き込む
+    #//
+    ##	@brief	複数のカウンタに値をまとめて書き込みます
+    #	@param	datas	書き込む値の配列(0-255)
+    #	@param	counterNums	datasを書き込むカウンタの番号の配列(Noneのときはすべて)
+    #	@retval	True	通信成功
+    #	@retval	False	失敗(値が範囲外のときは何も送りません)
+    #	@note	番号の連続した部分ごとにCOM=>RAMを1つ作り、まとめて1回の書き込みで送ります(間のカウンタは書き換えません)
+    #	@note	numpyが必要です
+    def setUserCounters(self,datas,counterNums = None):
+        if counterNums is None:
+            counterNums = range(1, Rcb4BaseLib.CounterCount + 1)
+        return self.__writeRamValues(Rcb4BaseLib.RamAddr.CounterRamAddress.value, 'u1', Rcb4BaseLib.CounterCount, counterNums, datas)
+
+
+    #///////////////////////////////////////////////////////////////////////////////////
+    #//	ユーザ変数の値をまとめて読み込む
+    #//
+    ##	@brief	複数のユーザ変数の値をRAM=>COM 1回で読み込みます
+    #	@param	parmeterNums	ユーザ変数の番号の配列(Noneのときはすべて)
+    #	@return	(retf,paraDatas)
+    #	@retval	retf	True:通信成功	False:失敗
+    #	@retval	paraDatas	parmeterNumsの順のユーザ変数の値(numpyのint32配列) 失敗時は配列数0
+    #	@note	ユーザ変数はUserParmeterRamAddressから2byte(signed short)ずつ並んでいるので、
+    #	@note	一番小さい番号から一番大きい番号までを1回で読み込みます
+    #	@note	numpyが必要です
+    def getUserParmeters(self,parmeterNums = None):
+        if parmeterNums is None:
+            parmeterNums = range(1, Rcb4BaseLib.UserParmeterCount + 1)
+        return self.__readRamValues(Rcb4BaseLib.RamAddr.UserParmeterRamAddress.value, '<i2', Rcb4BaseLib.UserParmeterCount, parmeterNums)
+
+
+    #///////////////////////////////////////////////////////////////////////////////////
+    #//	ユーザ変数に値をまとめて書き込む
+    #//
+    ##	@brief	複数のユーザ変数に値をまとめて書き込みます
+    #	@param	datas	書き込む値の配列(signed short)
+    #	@param	parmeterNums	datasを書き込むユーザ変数の番号の配列(Noneのときはすべて)
+    #	@retval	True	通信成功
+    #	@retval	False	失敗(値が範囲外のときは何も送りません)
+    #	@note	番号の連続した部分ごとにCOM=>RAMを1つ作り、まとめて1回の書き込みで送ります(間のユーザ変数は書き換えません)
+    #	@note	numpyが必要です
+    def setUserParmeters(self,datas,parmeterNums = None):
+        if parmeterNums is None:
+            parmeterNums = range(1, Rcb4BaseLib.UserParmeterCount + 1)
+        return self.__writeRamValues(Rcb4BaseLib.RamAddr.UserParmeterRamAddress.value, '<i2', Rcb4BaseLib.UserParmeterCount, parmeterNums, datas)
+
+
+    ##	@brief	RAMに並んでいる値の中から、指定した番号の値をまとめて読み込む
+    #	@param	baseAddr	1番の値のアドレス
+    #	@param	dtype	値の型(numpyのdtype)
+    #	@param	count	値の数
+    #	@param	nums	読み込む番号の配列(1から)
+    #	@return	(retf,datas)
+    #	@exception	ImportError	numpyがない
+    def __readRamValues(self,baseAddr,dtype,count,nums):
+        if np is None:
+            raise ImportError('numpy is required to read user counters/parameters')
+        nums = np.asarray(nums, dtype=np.intp).reshape(-1)
+        if nums.size == 0 or nums.min() < 1 or count < nums.max():
+            return False, np.zeros(0, dtype=np.int32)
+        first = int(nums.min())
+        itemSize = np.dtype(dtype).itemsize
+        size = (int(nums.max()) - first + 1) * itemSize
+        retf, rxbuf = self.moveRamToComCmdSynchronize(baseAddr + (first - 1) * itemSize, size)
+        if (retf == False) or (len(rxbuf) != size):
+            return False, np.zeros(0, dtype=np.int32)
+        values = np.frombuffer(bytes(rxbuf), dtype=dtype)
+        return True, values[nums - first].astype(np.int32)
+
+
+    ##	@brief	RAMに並んでいる値の中の、指定した番号に値をまとめて書き込む
+    #	@param	baseAddr	1番の値のアドレス
+    #	@param	dtype	値の型(numpyのdtype)
+    #	@param	count	値の数
+    #	@param	nums	書き込む番号の配列(1から)
+    #	@param	datas	書き込む値の配列
+    #	@retval	True	通信成功
+    #	@retval	False	失敗
+    #	@exception	ImportError	numpyがない
+    #	@note	同じ番号が複数あるときは後の値を書き込みます
+    def __writeRamValues(self,baseAddr,dtype,count,nums,datas):
+        if np is None:
+            raise ImportError('numpy is required to write user counters/parameters')
+        nums = np.asarray(nums, dtype=np.intp).reshape(-1)
+        datas = np.asarray(datas).reshape(-1)
+        info = np.iinfo(dtype)
+        if nums.size == 0 or nums.size != datas.size or nums.min() < 1 or count < nums.max():
+            return False
+        if datas.min() < info.min or info.max < datas.max():
+            return False
+        order = np.argsort(nums, kind='stable')
+        nums = nums[order]
+        values = datas[order].astype(dtype)
+        last = np.append(nums[1:] != nums[:-1], True)	#同じ番号は後の値だけ残す
+        nums = nums[last]
+        values = values[last]
+        #番号の連続した部分ごとに書き込む(間の値は読まずにそのまま残す)
+        starts = np.flatnonzero(np.diff(nums, prepend=-1) != 1)
+        ends = np.append(starts[1:], nums.size)
+        itemSize = np.dtype(dtype).itemsize
+        txDatas = [Rcb4BaseLib.moveComToRamCmd(baseAddr + (int(nums[start]) - 1) * itemSize, values[start:end].tobytes())[1]
+                   for start, end in zip(starts, ends)]
+        return self.synchronizeAckBatch(txDatas)
  
  
     #/////////////////////////////////////////////////////////////////////////////
@@ -1632,7 +3890,21 @@ class Rcb4BaseLib:
         #通信失敗時はエラーを返す
         if (retf == False) or (len(retbuf) != 10):
             return -1
-        
+
+        return Rcb4BaseLib.decodeMotionPlayNum(retbuf)
+
+
+    #///////////////////////////////////////////////////////////////////////////////////
+    #//	プログラムカウンタからモーション番号を算出します
+    #//
+    ##	@brief	プログラムカウンタとフラグの10byteから再生されているモーションの番号を算出します。
+    #	@param	retbuf	ProgramCounterRamAddressから読み込んだ10byte
+    #	@retval	モーション番号
+    #	@retval	0	どのモーションも再生されていない
+    #	@retval	-2	再生されている場所が異常である
+    #	@note	静的関数で外部アクセスが可能
+    @staticmethod
+    def decodeMotionPlayNum(retbuf):
         #フラグ部分の計算
         eflfg = retbuf[3] + retbuf[4] + retbuf[5] + retbuf[6] + retbuf[7]
         
@@ -1640,7 +3912,7 @@ class Rcb4BaseLib:
         pcunt = retbuf[0] + (retbuf[1] << 8) + (retbuf[2] << 16)
         
         #アドレスからモーションを逆算
-        mno = int(((pcunt -  Rcb4BaseLib.RomAddr.MotionRomAddress.value) / self.MotionSingleDataCount) + 1  )         
+        mno = int(((pcunt -  Rcb4BaseLib.RomAddr.MotionRomAddress.value) / Rcb4BaseLib.MotionSingleDataCount) + 1  )         
 
         if eflfg == 0:
             return 0
@@ -1653,6 +3925,35 @@ class Rcb4BaseLib:
     
 
 
+    #///////////////////////////////////////////////////////////////////////////////////
+    #//	一時停止・復帰のコンフィグデータを求めます
+    #//
+    ##	@brief	一時停止させるときのコンフィグデータを求めます
+    #	@param	config	今のコンフィグデータ
+    #	@retval	EEPROM =>0 ,ベクタージャンプ => 0,サーボの動作レスポンス => 0,ICSスイッチ => 0 にしたコンフィグデータ
+    #	@note	静的関数で外部アクセスが可能
+    @staticmethod
+    def suspendedConfig(config):
+        config &= ~Rcb4BaseLib.ConfigData.EnableRunEeprom.value
+        config &= ~Rcb4BaseLib.ConfigData.EnableServoResponse.value
+        config &= ~Rcb4BaseLib.ConfigData.EnableReferenceTable.value
+        config &= ~Rcb4BaseLib.ConfigData.EnableSio.value
+        return config
+
+
+    ##	@brief	復帰させるときのコンフィグデータを求めます
+    #	@param	config	今のコンフィグデータ
+    #	@retval	EEPROM =>1 ,ベクタージャンプ => 1,サーボの動作レスポンス => 0,ICSスイッチ => 1 にしたコンフィグデータ
+    #	@note	静的関数で外部アクセスが可能
+    @staticmethod
+    def resumedConfig(config):
+        config |= Rcb4BaseLib.ConfigData.EnableRunEeprom.value
+        config &= ~Rcb4BaseLib.ConfigData.EnableServoResponse.value
+        config |= Rcb4BaseLib.ConfigData.EnableReferenceTable.value 	#2019/02/04	ベクタジャンプは有効にしておく
+        config |= Rcb4BaseLib.ConfigData.EnableSio.value
+        return config
+
+
     #///////////////////////////////////////////////////////////////////////////////////
     #//	モーションを一時停止させます
     #//
@@ -1665,11 +3966,7 @@ class Rcb4BaseLib:
     def suspend(self):
         
         #self.__configData = 0 #del 2018/10/25
-        self.__configData &= ~Rcb4BaseLib.ConfigData.EnableRunEeprom.value #2018/10/25修正
-        self.__configData &= ~Rcb4BaseLib.ConfigData.EnableServoResponse.value
-        self.__configData &= ~Rcb4BaseLib.ConfigData.EnableReferenceTable.value	
-        self.__configData &= ~Rcb4BaseLib.ConfigData.EnableSio.value
-        
+        self.__configData = Rcb4BaseLib.suspendedConfig(self.__configData) #2018/10/25修正
         
         txbuf = [self.__configData & 0xff, (self.__configData >> 8) & 0xff]
         return self.moveComToRamCmdSynchronize(Rcb4BaseLib.RamAddr.ConfigRamAddress.value, txbuf)
@@ -1735,10 +4032,7 @@ class Rcb4BaseLib:
     #	@warning	内部のconfigの情報(self.__config)を直接変更するので、初期設定時に読み取る必要があります	   
     def resume (self):
         #self.__configData = 0  #del 2018/10/19
-        self.__configData |= Rcb4BaseLib.ConfigData.EnableRunEeprom.value
-        self.__configData &= ~Rcb4BaseLib.ConfigData.EnableServoResponse.value
-        self.__configData |= Rcb4BaseLib.ConfigData.EnableReferenceTable.value 	#2019/02/04	ベクタジャンプは有効にしておく
-        self.__configData |= Rcb4BaseLib.ConfigData.EnableSio.value
+        self.__configData = Rcb4BaseLib.resumedConfig(self.__configData)
         buf = [ self.__configData & 0xff,(self.__configData >> 8) & 0xff]
         return self.moveComToRamCmdSynchronize(Rcb4BaseLib.RamAddr.ConfigRamAddress.value, buf)
 
@@ -1758,26 +4052,79 @@ class Rcb4BaseLib:
     #	@note	3.モーションのアドレスにジャンプ
     #	@note	4.モーションを復帰させる
     #	@note	以上の手順が必要です
+    #	@note	1と2はRAMで続いているので1回のCOM=>RAMで書き込み、3と4は返信を待たずに続けて送ります(2往復)
     def motionPlay(self,motionNum):
         
         #モーションが存在さいない
         if (motionNum <= 0)or( self.MaxMotionCount < motionNum ):
             return False
         
-        #モーションを一時停止
-        if self.suspend() == False:
-            return False
-        
-        #プログラムカウンタをリセット
-        if self.resetProgramCounter() == False:
+        #モーションを一時停止して、プログラムカウンタをリセット
+        config = Rcb4BaseLib.suspendedConfig(self.__configData)
+        mainLoop = Rcb4BaseLib.RomAddr.MainLoopCmd.value
+        buf = [config & 0xff, (config >> 8) & 0xff, mainLoop & 0xff, (mainLoop >> 8) & 0xff,0,0,0,0,0,0,0,0]
+        if self.moveComToRamCmdSynchronize(Rcb4BaseLib.RamAddr.ConfigRamAddress.value, buf) == False:
             return False
+        self.__configData = config
         
-        #モーションアドレスにジャンプ
-        if self.setMotionNum(motionNum) == False:
+        #モーションアドレスにジャンプして、モーション再開させる
+        config = Rcb4BaseLib.resumedConfig(config)
+        rxSize,callBuf = self.callCmd(self.motionAddr2motionNum(motionNum))
+        rxSize,resumeBuf = self.moveComToRamCmd(Rcb4BaseLib.RamAddr.ConfigRamAddress.value, [config & 0xff, (config >> 8) & 0xff])
+        if self.synchronizeAckBatch([callBuf, resumeBuf]) == False:
             return False
-        
-        #モーション再開させる
-        return self.resume ()
+        self.__configData = config
+        return True
+
+
+    #///////////////////////////////////////////////////////////////////////////////////
+    #//	モーションの再生が終わるのを待つ
+    #//
+    ##	@brief	モーションの再生が終わるのを見張る
+    #	@param	motionNum	再生を始めたモーション番号
+    #	@param	duration	再生時間(秒)の目安 Noneのときは前回までの再生時間から推定します
+    #	@param	endOnOther	Trueのときはほかのモーションの再生が始まったときも終わったとみなします
+    #	@retval	Future	結果は正常に終わったかどうか(True/False)
+    #	@note	見張りはMotionWatcherの1つのスレッドでまとめて行い、同じモーションには同じFutureを返します
+    #	@note	getMotionPlayNum()やreadRamSnapshot()でプログラムカウンタを読んだ結果も見張りに使われます
+    #	@note	endOnOtherがFalseのときは、どのモーションも再生されていない状態になるまで待ちます
+    def watchMotion(self,motionNum,duration = None,endOnOther = False):
+        with self.__lock:
+            if self.__motionWatcher is None:
+                self.__motionWatcher = Rcb4BaseLib.MotionWatcher(self)
+            watcher = self.__motionWatcher
+        return watcher.watch(motionNum, duration, endOnOther)
+
+
+    #///////////////////////////////////////////////////////////////////////////////////
+    #//	モーションの再生時間の推定値を取得する
+    #//
+    ##	@brief	見張ったときに求めたモーションの再生時間を返します
+    #	@param	motionNum	モーション番号
+    #	@retval	再生時間(秒) watchMotion()のdurationで指定した値か、前回までの再生時間から推定した値
+    #	@retval	None	まだ見張ったことがない
+    def motionDuration(self,motionNum):
+        watcher = self.__motionWatcher
+        if watcher is None:
+            return None
+        return watcher.Durations.get(motionNum)
+
+
+    #///////////////////////////////////////////////////////////////////////////////////
+    #//	モーションを再生して、終わるのをFutureで受け取る
+    #//
+    ##	@brief	指定したモーションを再生し、終わったら結果が入るFutureを返します
+    #	@param	motionNum	モーション番号
+    #	@param	duration	再生時間(秒)の目安(省略可)
+    #	@param	endOnOther	Trueのときはほかのモーションの再生が始まったときも終わったとみなします(省略可)
+    #	@retval	Future	結果は再生が正常に終わったかどうか(True/False) 再生できなかったときはすぐにFalse
+    #	@note	例: rcb4.motionPlayAsync(1).result()	#再生が終わるまで待つ
+    def motionPlayAsync(self,motionNum,duration = None,endOnOther = False):
+        if self.motionPlay(motionNum) == False:
+            future = Future()
+            future.set_result(False)
+            return future
+        return self.watchMotion(motionNum, duration, endOnOther)
 
 
 #/////////////////////////////////////////////////////////////////////////////
@@ -0,0 +1,412 @@
+
+#coding: UTF-8
+
+##
+##	@file Rcb4Emulator.py
+##	@brief RCB4 emulator on a pseudo terminal
+##
+##	Linuxの疑似端末(pty)上でRCB4の代わりに返信をするエミュレータです。
+##	Rcb4BaseLibが使うコマンド(ACK,Move(ROM=>COMを含む),Call,SingleServo,ConstFrameServo,ServoParam)に
+##	RAM・ICSデバイスのモデルを使って応答するので、実機なしで動作確認や速度の測定ができます。
+##
+##	使い方:
+##		python Rcb4Emulator.py		#表示されたポート名をRcb4BaseLib.open()に渡す
+##
+##	@warning	ptyを使うため、POSIX(Linux,macOS)専用です
+##
+
+import array
+import fcntl
+import os
+import pty
+import struct
+import termios
+import threading
+import time
+import tty
+
+from Rcb4BaseLib import Rcb4BaseLib
+
+
+##	@class	Rcb4Emulator
+#	@brief	疑似端末上でRCB4の動作をまねるクラスです。
+#	@note	ICSデバイスのデータはRAMのIcsDeviceRamAddressから20byteずつ並べています
+#	@note	サーボモータは指令を受けると、フレーム数 * framePeriod 秒かけて直線的に指令値まで動きます
+#	@note	通信時間は1byte = 11bit(スタート+8bit+パリティ+ストップ)として、ptyに設定されたボーレートから計算します
+#	@note	ptyのボーレートとコンフィグデータのBaudrateビットが合わないときは受信したデータを捨てます
+class Rcb4Emulator:
+
+    ##	@brief	RAMのbyte数
+    RamSize = 0x0600
+
+    ##	@brief	起動時のコンフィグデータ(ICSスイッチ,EEPROM実行,ベクタジャンプ,115200bps)
+    DefaultConfig = 0x000B
+
+    ##	@brief	termios2を読み込むioctl番号(Linux)
+    TCGETS2 = 0x802C542A
+
+    ##	@brief	再生中を示すフラグのアドレス(getMotionPlayNum()で読まれる10byteの4-8byte目)
+    FlagRamAddress = 0x0005
+
+    ##	@brief __init__ コンストラクタ
+    #	@param baudrate	起動時のRCB4の通信速度(ptyのボーレートが読み取れないときにも使います)
+    #	@param framePeriod	サーボ出力周期(1フレームの秒数)
+    #	@param motionDuration	モーション1つの再生時間(秒) {モーション番号:秒}の辞書も可
+    #	@param latency	コマンドを受け取ってから返信を始めるまでの処理時間(秒)
+    def __init__(self, baudrate = 115200, framePeriod = 0.01, motionDuration = 1.0, latency = 0.0002):
+        self.baudrate = baudrate
+        self.framePeriod = framePeriod
+        self.motionDuration = motionDuration
+        self.latency = latency
+
+        ##	@brief	RAMの中身
+        self.Ram = bytearray(Rcb4Emulator.RamSize)
+        ##	@brief	ROMの中身(モーションデータ領域まで)
+        self.Rom = bytearray(Rcb4BaseLib.RomAddr.MotionRomAddress.value + Rcb4BaseLib.MotionDataCount)
+        ##	@brief	ServoParamで設定された値 {ICS番号:{1:ストレッチ,2:スピード}}
+        self.ServoParams = {}
+        ##	@brief	受信したコマンド数(コマンドの種類ごと)
+        self.CommandCounts = {}
+        ##	@brief	チェックサム異常などで読み捨てたbyte数
+        self.DroppedBytes = 0
+
+        self.__servos = {}
+        self.__motionEnd = None
+        self.__motionNum = 0
+        self.__lock = threading.Lock()
+        self.__master = -1
+        self.__slave = -1
+        self.__thread = None
+        self.__running = False
+        self.reset()
+
+
+    ##	@brief	RAMを起動時の状態にする
+    def reset(self):
+        with self.__lock:
+            self.Ram[:] = bytes(len(self.Ram))
+            config = Rcb4Emulator.DefaultConfig | dict(Rcb4BaseLib.ComBaudrates).get(self.baudrate, 0)
+            struct.pack_into('<H', self.Ram, Rcb4BaseLib.RamAddr.ConfigRamAddress.value, config)
+            self.__setProgramCounter(Rcb4BaseLib.RomAddr.MainLoopCmd.value, False)
+            #電源電圧(AD0)は約7.4V
+            struct.pack_into('<H', self.Ram, Rcb4BaseLib.RamAddr.AdcRamAddress.value, int(7.4 * 10 / 49 * 1024 / 5.0))
+            for ics in range(Rcb4BaseLib.IcsDeviceSize):
+                addr = Rcb4BaseLib.icsDeviceAddr(ics)
+                self.Ram[addr + Rcb4BaseLib.DeviceAddrOffset.IDAddressOffset.value] = ics // 2
+                struct.pack_into('<h', self.Ram, addr + Rcb4BaseLib.DeviceAddrOffset.MotorPositionAddressOffset.value, 7500)
+                struct.pack_into('<h', self.Ram, addr + Rcb4BaseLib.DeviceAddrOffset.PositionAddressOffset.value, 7500)
+            self.__servos.clear()
+            self.__motionEnd = None
+            self.__motionNum = 0
+
+
+    #/////////////////////////////////////////////////////////////////////////////////////////
+    #//	疑似端末
+    #/////////////////////////////////////////////////////////////////////////////////////////
+
+    ##	@brief	疑似端末を開いて応答スレッドを開始する
+    #	@retval	ポート名(Rcb4BaseLib.open()に渡す名前)
+    def start(self):
+        self.__master, self.__slave = pty.openpty()
+        tty.setraw(self.__slave)
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__serveLoop, name="Rcb4Emulator", daemon=True)
+        self.__thread.start()
+        return os.ttyname(self.__slave)
+
+
+    ##	@brief	応答スレッドを止めて疑似端末を閉じる
+    def stop(self):
+        self.__running = False
+        if self.__master >= 0:
+            os.close(self.__slave)
+            os.close(self.__master)
+            self.__master = -1
+            self.__slave = -1
+        if self.__thread is not None:
+            self.__thread.join(timeout=1.0)
+            self.__thread = None
+
+
+    ##	@brief	ptyに設定されているボーレートを取得する
+    #	@note	標準以外の速度(625000など)はTCGETS2で読み取ります
+    def currentBaudrate(self):
+        try:
+            speed = termios.tcgetattr(self.__slave)[5]
+        except (termios.error, OSError):
+            return self.baudrate
+        if speed == getattr(termios, 'BOTHER', 0o010000):
+            buf = array.array('i', [0] * 64)
+            try:
+                fcntl.ioctl(self.__slave, Rcb4Emulator.TCGETS2, buf)
+                return buf[10]
+            except OSError:
+                return self.baudrate
+        for name in dir(termios):
+            if name.startswith('B') and name[1:].isdigit() and getattr(termios, name) == speed:
+                return int(name[1:])
+        return self.baudrate
+
+
+    ##	@brief	コンフィグデータのBaudrateビットから、RCB4側の通信速度を取得する
+    def boardBaudrate(self):
+        bits = self.Ram[Rcb4BaseLib.RamAddr.ConfigRamAddress.value] & Rcb4BaseLib.ConfigData.Baudrate.value
+        for rate, rateBits in Rcb4BaseLib.ComBaudrates:
+            if rateBits == bits:
+                return rate
+        return self.baudrate
+
+
+    ##	@brief	コマンドを受信して返信するスレッド
+    #	@note	受信と送信は全二重として、それぞれの通信時間を別々に積み上げます
+    def __serveLoop(self):
+        buf = bytearray()
+        rxFree = 0.0
+        txFree = 0.0
+        while self.__running:
+            try:
+                data = os.read(self.__master, 512)
+            except OSError:
+                return
+            now = time.monotonic()
+            buf += data
+            while len(buf) > 0:
+                length = buf[0]
+                if length < 4:
+                    del buf[0]
+                    self.DroppedBytes += 1
+                    continue
+                if len(buf) < length:
+                    break
+                #通信速度が合っていないときは化けたデータになるので読み捨てる
+                hostBaudrate = self.currentBaudrate()
+                if hostBaudrate != self.boardBaudrate():
+                    self.DroppedBytes += len(buf)
+                    buf.clear()
+                    break
+
+                cmd = bytes(buf[:length])
+                del buf[:length]
+
+                byteTime = 11.0 / hostBaudrate
+                rxFree = max(now, rxFree) + length * byteTime
+                reply = self.handleCommand(cmd)
+                if reply is None:
+                    continue
+                txFree = max(rxFree + self.latency, txFree) + len(reply) * byteTime
+                delay = txFree - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                try:
+                    os.write(self.__master, reply)
+                except OSError:
+                    return
+
+
+    #/////////////////////////////////////////////////////////////////////////////////////////
+    #//	コマンド処理
+    #/////////////////////////////////////////////////////////////////////////////////////////
+
+    ##	@brief	コマンドを1つ処理して返信を作る
+    #	@param	cmd	受信したコマンド全体(先頭はデータ数、最後はチェックサム)
+    #	@retval	返信データ(bytes)
+    #	@retval	None	返信しない(チェックサム異常)
+    #	@note	疑似端末を使わずに直接呼ぶこともできます
+    def handleCommand(self, cmd):
+        if cmd[-1] != Rcb4BaseLib.CheckSum(cmd):
+            self.DroppedBytes += len(cmd)
+            return None
+
+        cmdType = cmd[1]
+        self.CommandCounts[cmdType] = self.CommandCounts.get(cmdType, 0) + 1
+        with self.__lock:
+            self.__update(time.monotonic())
+            if cmdType == Rcb4BaseLib.CommandTypes.AckCheck.value:
+                return self.__ack(cmdType, True)
+            if cmdType == Rcb4BaseLib.CommandTypes.Move.value:
+                return self.__move(cmd)
+            if cmdType == Rcb4BaseLib.CommandTypes.Call.value:
+                return self.__call(cmd)
+            if cmdType == Rcb4BaseLib.CommandTypes.SingleServo.value:
+                self.__moveServo(cmd[2], cmd[4] | (cmd[5] << 8), cmd[3])
+                return self.__ack(cmdType, True)
+            if cmdType == Rcb4BaseLib.CommandTypes.ConstFrameServo.value:
+                return self.__constFrameServo(cmd)
+            if cmdType == Rcb4BaseLib.CommandTypes.ServoParam.value:
+                return self.__servoParam(cmd)
+            return self.__ack(cmdType, False)
+
+
+    ##	@brief	ACK/NACKの返信を作る
+    def __ack(self, cmdType, ok):
+        reply = bytearray([4, cmdType, Rcb4BaseLib.AckType.Ack.value if ok else Rcb4BaseLib.AckType.Nack.value, 0])
+        reply[3] = Rcb4BaseLib.CheckSum(reply)
+        return bytes(reply)
+
+
+    ##	@brief	データ付きの返信を作る
+    def __dataReply(self, cmdType, data):
+        reply = bytearray(len(data) + 3)
+        reply[0] = len(reply)
+        reply[1] = cmdType
+        reply[2:2 + len(data)] = data
+        reply[-1] = Rcb4BaseLib.CheckSum(reply)
+        return bytes(reply)
+
+
+    ##	@brief	Moveコマンドの処理
+    def __move(self, cmd):
+        sub = cmd[2]
+        cmdType = cmd[1]
+        if sub == Rcb4BaseLib.SubMoveCmd.RamToCom.value:
+            addr = cmd[6] | (cmd[7] << 8)
+            size = cmd[8]
+            if addr + size > len(self.Ram):
+                return self.__ack(cmdType, False)
+            return self.__dataReply(cmdType, self.Ram[addr:addr + size])
+
+        if sub == Rcb4BaseLib.SubMoveCmd.RomToCom.value:
+            addr = cmd[6] | (cmd[7] << 8) | (cmd[8] << 16)
+            size = cmd[9]
+            if addr + size > len(self.Rom):
+                return self.__ack(cmdType, False)
+            return self.__dataReply(cmdType, self.Rom[addr:addr + size])
+
+        if sub == Rcb4BaseLib.SubMoveCmd.ComToRam.value:
+            addr = cmd[3] | (cmd[4] << 8)
+            data = cmd[6:-1]
+            if addr + len(data) > len(self.Ram):
+                return self.__ack(cmdType, False)
+            self.Ram[addr:addr + len(data)] = data
+            self.__ramWritten(addr, len(data))
+            return self.__ack(cmdType, True)
+
+        if sub == Rcb4BaseLib.SubMoveCmd.DeviceToCom.value:
+            offset, ics, size = cmd[6], cmd[7], cmd[8]
+            if ics >= Rcb4BaseLib.IcsDeviceSize or offset + size > Rcb4BaseLib.IcsDeviceDataSize:
+                return self.__ack(cmdType, False)
+            addr = Rcb4BaseLib.icsDeviceAddr(ics) + offset
+            return self.__dataReply(cmdType, self.Ram[addr:addr + size])
+
+        if sub == Rcb4BaseLib.SubMoveCmd.ComToDevice.value:
+            offset, ics = cmd[3], cmd[4]
+            data = cmd[6:-1]
+            if ics >= Rcb4BaseLib.IcsDeviceSize or offset + len(data) > Rcb4BaseLib.IcsDeviceDataSize:
+                return self.__ack(cmdType, False)
+            addr = Rcb4BaseLib.icsDeviceAddr(ics) + offset
+            self.Ram[addr:addr + len(data)] = data
+            return self.__ack(cmdType, True)
+
+        return self.__ack(cmdType, False)
+
+
+    ##	@brief	RAMに書き込まれたときの処理(プログラムカウンタのリセット)
+    def __ramWritten(self, addr, size):
+        pcAddr = Rcb4BaseLib.RamAddr.ProgramCounterRamAddress.value
+        if addr <= pcAddr < addr + size:
+            pc = self.Ram[pcAddr] | (self.Ram[pcAddr + 1] << 8) | (self.Ram[pcAddr + 2] << 16)
+            if pc < Rcb4BaseLib.RomAddr.MotionRomAddress.value:
+                self.__motionEnd = None
+                self.__motionNum = 0
+
+
+    ##	@brief	Callコマンドの処理(モーションの先頭にジャンプして再生を始める)
+    def __call(self, cmd):
+        addr = cmd[2] | (cmd[3] << 8) | (cmd[4] << 16)
+        motionAddr = Rcb4BaseLib.RomAddr.MotionRomAddress.value
+        if motionAddr <= addr < motionAddr + Rcb4BaseLib.MotionDataCount:
+            self.__motionNum = (addr - motionAddr) // Rcb4BaseLib.MotionSingleDataCount + 1
+            duration = self.motionDuration
+            if isinstance(duration, dict):
+                duration = duration.get(self.__motionNum, 1.0)
+            self.__motionEnd = time.monotonic() + duration
+        self.__setProgramCounter(addr, True)
+        return self.__ack(cmd[1], True)
+
+
+    ##	@brief	プログラムカウンタとフラグを設定する
+    def __setProgramCounter(self, addr, playing):
+        pcAddr = Rcb4BaseLib.RamAddr.ProgramCounterRamAddress.value
+        self.Ram[pcAddr] = addr & 0xff
+        self.Ram[pcAddr + 1] = (addr >> 8) & 0xff
+        self.Ram[pcAddr + 2] = (addr >> 16) & 0xff
+        self.Ram[Rcb4Emulator.FlagRamAddress] = 1 if playing else 0
+
+
+    ##	@brief	ConstFrameServoコマンドの処理
+    def __constFrameServo(self, cmd):
+        mask = int.from_bytes(cmd[2:7], 'little')
+        frame = cmd[7]
+        icsNums = [ics for ics in range(40) if mask & (1 << ics)]
+        if len(cmd) != len(icsNums) * 2 + 9:
+            return self.__ack(cmd[1], False)
+        for i, ics in enumerate(icsNums):
+            self.__moveServo(ics, cmd[8 + i * 2] | (cmd[9 + i * 2] << 8), frame)
+        return self.__ack(cmd[1], True)
+
+
+    ##	@brief	ServoParamコマンドの処理
+    def __servoParam(self, cmd):
+        mask = int.from_bytes(cmd[2:7], 'little')
+        param = cmd[7]
+        icsNums = [ics for ics in range(40) if mask & (1 << ics)]
+        if len(cmd) != len(icsNums) + 9:
+            return self.__ack(cmd[1], False)
+        for i, ics in enumerate(icsNums):
+            self.ServoParams.setdefault(ics, {})[param] = cmd[8 + i]
+        return self.__ack(cmd[1], True)
+
+
+    ##	@brief	サーボモータに指令値を設定する
+    #	@note	0x8000(フリー)は現在位置のまま、0x7FFF(ホールド)は現在位置で止めます
+    def __moveServo(self, ics, pos, frame):
+        if ics >= Rcb4BaseLib.IcsDeviceSize:
+            return
+        addr = Rcb4BaseLib.icsDeviceAddr(ics)
+        current = struct.unpack_from('<h', self.Ram, addr + Rcb4BaseLib.DeviceAddrOffset.MotorPositionAddressOffset.value)[0]
+        if pos == 0x8000 or pos == 0x7FFF:
+            self.__servos.pop(ics, None)
+            return
+        struct.pack_into('<H', self.Ram, addr + Rcb4BaseLib.DeviceAddrOffset.PositionAddressOffset.value, pos)
+        self.Ram[addr + Rcb4BaseLib.DeviceAddrOffset.FrameAddressOffset.value] = frame
+        self.__servos[ics] = (current, pos, time.monotonic(), max(frame, 1) * self.framePeriod)
+
+
+    ##	@brief	時間経過によるサーボモータの位置とモーションの再生状態を更新する
+    def __update(self, now):
+        offset = Rcb4BaseLib.DeviceAddrOffset.MotorPositionAddressOffset.value
+        for ics, (start, target, t0, duration) in list(self.__servos.items()):
+            ratio = (now - t0) / duration
+            if ratio >= 1.0:
+                pos = target
+                del self.__servos[ics]
+            else:
+                pos = int(start + (target - start) * ratio)
+            struct.pack_into('<h', self.Ram, Rcb4BaseLib.icsDeviceAddr(ics) + offset, pos)
+
+        if self.__motionEnd is not None:
+            config = struct.unpack_from('<H', self.Ram, Rcb4BaseLib.RamAddr.ConfigRamAddress.value)[0]
+            if not (config & Rcb4BaseLib.ConfigData.EnableRunEeprom.value):
+                #一時停止中は終了時刻を延ばす
+                self.__motionEnd = max(self.__motionEnd, now)
+            elif now >= self.__motionEnd:
+                self.__motionEnd = None
+                self.__motionNum = 0
+                self.__setProgramCounter(Rcb4BaseLib.RomAddr.MainLoopCmd.value, False)
+
+
+if __name__ == '__main__':
+    emulator = Rcb4Emulator()
+    print('RCB4 emulator:', emulator.start())
+    print('Ctrl+Cで停止')
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.stop()
+
+#/////////////////////////////////////////////////////////////////////////////
+#//	ここまで[EOF]
+#/////////////////////////////////////////////////////////////////////////////
@@ -0,0 +1,294 @@
+
+#coding: UTF-8
+
+##
+##	@file Rcb4MotionRom.py
+##	@brief RCB4 motion ROM reader with a local cache
+##
+##	RCB4のROMに保存されているモーションデータ(MaxMotionCount個 × MotionSingleDataCount byte)を読み込み、
+##	ボードごとのキャッシュファイルに保存します。キャッシュはmmapで開くので、読み込んだデータはそのまま参照できます。
+##	2回目以降は各スロットからProbeStride byteおきに1ブロックずつ読んでキャッシュと比べ、変わったスロットだけを読み直します。
+##	この比較はスロット全体を比べない簡易的な判定(ヒューリスティック)なので、再生中のスロットは比べずに必ず読み直します。
+##
+##	使い方:
+##		rom = Rcb4MotionRom(rcb4)
+##		if rom.open():
+##			changed = rom.refresh()		#変わったモーション番号の配列
+##			data = rom.slot(1)			#モーション1の2048byte(memoryview)
+##			rom.close()
+##
+
+import hashlib
+import mmap
+import os
+import struct
+import time
+import zlib
+
+from Rcb4BaseLib import Rcb4BaseLib
+
+
+##	@class	Rcb4MotionRom
+#	@brief	モーションデータを読み込んでキャッシュファイルに保存するクラスです。
+#	@note	キャッシュファイルはヘッダ、スロットごとの情報(CRC32など)、モーションデータの順に並んでいます
+#	@note	ボードの識別にはモーション領域より前のROM(設定データ)のハッシュを使うので、設定を書き換えると別のキャッシュになります
+class Rcb4MotionRom:
+
+    ##	@brief	キャッシュファイルの先頭の識別子
+    Magic = b'RCB4MROM'
+
+    ##	@brief	キャッシュファイルの形式の番号
+    FormatVersion = 2
+
+    ##	@brief	ヘッダのstructフォーマット(識別子,形式の番号,スロット数,1スロットのbyte数)
+    HeaderFormat = '<8sHHH'
+
+    ##	@brief	スロットごとの情報のstructフォーマット(読み込み済み,調べるブロックのCRC32,スロット全体のCRC32,読み込んだ時刻)
+    SlotFormat = '<BxxxIId'
+
+    ##	@brief	モーションデータが始まるファイル上の位置
+    DataOffset = 4096
+
+    ##	@brief	変わったかどうかを比べるために読む1ブロックのbyte数(1回のROM=>COMで読める大きさ)
+    ProbeSize = Rcb4BaseLib.RamSnapshot.MaxBlockSize
+
+    ##	@brief	変わったかどうかを比べるために読むブロックの間隔(byte) スロットの先頭からこの間隔で1ブロックずつ読みます
+    ProbeStride = 512
+
+    ##	@brief __init__ コンストラクタ
+    #	@param rcb4	openしたRcb4BaseLib
+    #	@param cacheDir	キャッシュファイルを置くフォルダ(Noneのときはホームフォルダの.rcb4_cache)
+    #	@param boardId	ボードの識別名(Noneのときはopen()でROMの設定データから作ります)
+    #	@param batchSize	返信を待たずに続けて送るROM=>COMの数
+    def __init__(self, rcb4, cacheDir = None, boardId = None, batchSize = 4):
+        self.rcb4 = rcb4
+        self.cacheDir = cacheDir if cacheDir is not None else os.path.join(os.path.expanduser('~'), '.rcb4_cache')
+        self.batchSize = batchSize
+        ##	@brief	ボードの識別名
+        self.BoardId = boardId
+        ##	@brief	キャッシュファイルのパス(open()の後に決まります)
+        self.Path = None
+        self.__file = None
+        self.__map = None
+        self.__slotCount = Rcb4BaseLib.MaxMotionCount
+        self.__slotSize = Rcb4BaseLib.MotionSingleDataCount
+
+
+    #/////////////////////////////////////////////////////////////////////////////////////////
+    #//	キャッシュファイル
+    #/////////////////////////////////////////////////////////////////////////////////////////
+
+    ##	@brief	ボードを識別してキャッシュファイルを開く
+    #	@retval	True	開けた
+    #	@retval	False	ボードの識別に失敗したか、ファイルを開けなかった
+    #	@note	ファイルがない、もしくは形式が違うときは空のキャッシュを作ります
+    def open(self):
+        if self.__map is not None:
+            return True
+        if self.BoardId is None:
+            self.BoardId = self.boardIdentity()
+            if self.BoardId is None:
+                return False
+
+        size = Rcb4MotionRom.DataOffset + self.__slotCount * self.__slotSize
+        header = struct.pack(Rcb4MotionRom.HeaderFormat, Rcb4MotionRom.Magic, Rcb4MotionRom.FormatVersion, self.__slotCount, self.__slotSize)
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            self.Path = os.path.join(self.cacheDir, 'rcb4_motion_%s.bin' % self.BoardId)
+            self.__file = open(self.Path, 'a+b')
+            self.__file.seek(0)
+            if self.__file.read(len(header)) != header or os.path.getsize(self.Path) != size:
+                self.__file.truncate(0)
+                self.__file.write(header)
+                self.__file.truncate(size)
+                self.__file.flush()
+            self.__map = mmap.mmap(self.__file.fileno(), size)
+        except OSError:
+            self.close()
+            return False
+        return True
+
+
+    ##	@brief	キャッシュファイルを閉じる
+    def close(self):
+        if self.__map is not None:
+            self.__map.flush()
+            try:
+                self.__map.close()
+            except BufferError:
+                pass	#slot()の参照が残っているときは、参照がなくなったときに閉じられる
+            self.__map = None
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+
+    ##	@brief	ROMの設定データ(モーション領域より前)からボードの識別名を作る
+    #	@retval	識別名(16文字の16進数)
+    #	@retval	None	読み込みに失敗した
+    def boardIdentity(self):
+        retf, data = self.rcb4.readRom(0, Rcb4BaseLib.RomAddr.MotionRomAddress.value, self.batchSize)
+        if retf == False:
+            return None
+        return hashlib.sha1(data).hexdigest()[:16]
+
+
+    #/////////////////////////////////////////////////////////////////////////////////////////
+    #//	読み込み
+    #/////////////////////////////////////////////////////////////////////////////////////////
+
+    ##	@brief	ボードからモーションデータを読み込んでキャッシュを更新する
+    #	@param	motionNums	読み込むモーション番号の配列(Noneのときはすべて)
+    #	@param	full	Trueのときは比べずにすべて読み直す
+    #	@retval	読み直したモーション番号の配列
+    #	@retval	None	開いていないか、通信に失敗した(それまでに読んだスロットは保存されています)
+    #	@note	まず各スロットからProbeStride byteおきにProbeSize byteずつ読み、キャッシュと同じスロットは読み直しません
+    #	@note	キャッシュのデータがスロット全体のCRC32と合わないときも読み直します
+    #	@note	今再生しているスロットは、比べずに必ず読み直します
+    #	@warning	ブロックを比べるのは簡易的な判定(ヒューリスティック)です。調べるブロックの間だけが変わったスロットは
+    #			検出できないので、HeartToHeart4でモーションを書き換えた後などはfull=Trueで読んでください
+    def refresh(self, motionNums = None, full = False):
+        if self.__map is None:
+            return None
+        if motionNums is None:
+            motionNums = range(1, self.__slotCount + 1)
+        motionNums = [num for num in motionNums if 0 < num <= self.__slotCount]
+
+        changed = []
+        if full:
+            for num in motionNums:
+                if not self.__reload(num):
+                    return None
+                changed.append(num)
+            self.__map.flush()
+            return changed
+
+        #再生中のスロットは簡易的な判定に任せず、必ず読み直す
+        playing = self.rcb4.getMotionPlayNum()
+        if playing == -1:
+            return None
+        if playing in motionNums:
+            if not self.__reload(playing):
+                return None
+            changed.append(playing)
+            motionNums.remove(playing)
+
+        #スロットごとに調べるブロックをまとめて読み、変わっていそうなスロットだけ全体を読む
+        offsets = self.__probeOffsets()
+        for i in range(0, len(motionNums), max(self.batchSize, 1)):
+            batch = motionNums[i:i + max(self.batchSize, 1)]
+            cmds = [self.rcb4.moveRomToComCmd(self.rcb4.motionAddr2motionNum(num) + offset, min(Rcb4MotionRom.ProbeSize, self.__slotSize - offset))
+                    for num in batch for offset in offsets]
+            rxbufs = self.rcb4.synchronizeReadBatch([(sendData, readSize) for readSize, sendData in cmds])
+            for n, num in enumerate(batch):
+                probe = bytearray()
+                for (readSize, sendData), rxbuf in zip(cmds[n * len(offsets):(n + 1) * len(offsets)], rxbufs[n * len(offsets):(n + 1) * len(offsets)]):
+                    if len(rxbuf) < readSize:
+                        return None
+                    probe += rxbuf[2:readSize - 1]
+                if self.__probeMatches(num, probe):
+                    continue
+                if not self.__reload(num):
+                    return None
+                changed.append(num)
+        self.__map.flush()
+        return changed
+
+
+    ##	@brief	調べるブロックとキャッシュが一致しているか(スロットが変わっていなさそうか)
+    #	@param	motionNum	モーション番号
+    #	@param	probe	ボードから読んだ調べるブロックをつなげたデータ
+    #	@retval	True	読み込み済みで、調べるブロックのCRC32とキャッシュ全体のCRC32が合っている
+    #	@note	調べるブロックの間は比べないので、一致してもスロット全体が同じとは限りません
+    def __probeMatches(self, motionNum, probe):
+        valid, probeCrc, crc, readTime = self.__slotInfo(motionNum)
+        return bool(valid) and probeCrc == zlib.crc32(probe) and crc == zlib.crc32(self.__slotData(motionNum))
+
+
+    ##	@brief	1スロット全体をボードから読み直してキャッシュに書き込む
+    #	@retval	True	読み込めた
+    def __reload(self, motionNum):
+        retf, data = self.rcb4.readRom(self.rcb4.motionAddr2motionNum(motionNum), self.__slotSize, self.batchSize)
+        if retf == False:
+            return False
+        self.__store(motionNum, data)
+        return True
+
+
+    ##	@brief	変わったかどうかを比べるために読むブロックのスロット内の位置の配列
+    def __probeOffsets(self):
+        return range(0, self.__slotSize, Rcb4MotionRom.ProbeStride)
+
+
+    ##	@brief	調べるブロックをつなげたデータ
+    def __probeData(self, data):
+        probe = bytearray()
+        for offset in self.__probeOffsets():
+            probe += data[offset:offset + Rcb4MotionRom.ProbeSize]
+        return probe
+
+
+    ##	@brief	1スロット分のデータをキャッシュに書き込む
+    def __store(self, motionNum, data):
+        index = motionNum - 1
+        offset = Rcb4MotionRom.DataOffset + index * self.__slotSize
+        self.__map[offset:offset + self.__slotSize] = data
+        struct.pack_into(Rcb4MotionRom.SlotFormat, self.__map, self.__slotInfoOffset(index),
+                         1, zlib.crc32(self.__probeData(data)), zlib.crc32(data), time.time())
+
+
+    ##	@brief	キャッシュに書かれている1スロット分のデータ
+    def __slotData(self, motionNum):
+        offset = Rcb4MotionRom.DataOffset + (motionNum - 1) * self.__slotSize
+        return self.__map[offset:offset + self.__slotSize]
+
+
+    ##	@brief	スロットの情報が書かれているファイル上の位置
+    def __slotInfoOffset(self, index):
+        return struct.calcsize(Rcb4MotionRom.HeaderFormat) + index * struct.calcsize(Rcb4MotionRom.SlotFormat)
+
+
+    ##	@brief	スロットの情報を取得する
+    #	@retval	(読み込み済み,調べるブロックのCRC32,スロット全体のCRC32,読み込んだ時刻)
+    def __slotInfo(self, motionNum):
+        return struct.unpack_from(Rcb4MotionRom.SlotFormat, self.__map, self.__slotInfoOffset(motionNum - 1))
+
+
+    #/////////////////////////////////////////////////////////////////////////////////////////
+    #//	キャッシュの参照
+    #/////////////////////////////////////////////////////////////////////////////////////////
+
+    ##	@brief	モーションデータを取得する
+    #	@param	motionNum	モーション番号
+    #	@retval	memoryview	MotionSingleDataCount byteのデータ(キャッシュファイルをそのまま参照しています)
+    #	@retval	None	まだ読み込んでいないか、番号が不正
+    #	@warning	close()の後は使えません
+    def slot(self, motionNum):
+        if self.__map is None or not (0 < motionNum <= self.__slotCount) or not self.__slotInfo(motionNum)[0]:
+            return None
+        offset = Rcb4MotionRom.DataOffset + (motionNum - 1) * self.__slotSize
+        return memoryview(self.__map)[offset:offset + self.__slotSize]
+
+
+    ##	@brief	モーションデータのCRC32を取得する
+    #	@retval	CRC32	(読み込んでいないときはNone)
+    #	@note	モーションを比べるときは、データを読まずにこの値で比べられます
+    def checksum(self, motionNum):
+        if self.__map is None or not (0 < motionNum <= self.__slotCount):
+            return None
+        valid, probeCrc, crc, readTime = self.__slotInfo(motionNum)
+        return crc if valid else None
+
+
+    ##	@brief	モーションデータを読み込んだ時刻を取得する
+    #	@retval	time.time()の値(読み込んでいないときはNone)
+    def readTime(self, motionNum):
+        if self.__map is None or not (0 < motionNum <= self.__slotCount):
+            return None
+        valid, probeCrc, crc, readTime = self.__slotInfo(motionNum)
+        return readTime if valid else None
+
+
+#/////////////////////////////////////////////////////////////////////////////
+#//	ここまで[EOF]
+#/////////////////////////////////////////////////////////////////////////////
@@ -0,0 +1,237 @@
+# coding: UTF-8
+"""
+フレーム処理のマイクロベンチマーク
+
+UDPで受け取った姿勢からサーボフレームを送るまでの各段階を1回ずつ測り、
+1回あたりの時間(ns/op)と一時メモリのピーク(peak B/op)を表示する。
+peak B/opは1回の実行中に増えたメモリの最大値で、確保した回数や合計ではない。
+記録した基準値(benchmark_baseline.json)より閾値以上遅くなった項目があれば終了コード1で終わる。
+
+使い方:
+    python benchmark.py                 # 測定して基準値と比較
+    python benchmark.py --save          # 測定結果を基準値として保存
+    python benchmark.py -k servo        # 名前に"servo"を含む項目だけ測定
+    python benchmark.py --threshold 1.5 # 基準値の1.5倍を超えたら遅くなったと判定
+
+基準値は測定したマシンに依存するので、比較は同じマシンで保存したものと行うこと。
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+import tracemalloc
+
+sys.path.append("./RCB4Lib_for_Python_V100B/Rcb4Lib")
+
+import numpy as np
+
+from Rcb4BaseLib import Rcb4BaseLib
+from servo_controller import ARM_JOINTS, RcbServoController, UnityHumanoidJson
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+DEFAULT_THRESHOLD = 1.25  # 基準値の何倍を超えたら遅くなったとみなすか
+
+
+class NullCom:
+    """送信したコマンドにすぐACKを返すSerialポートの代わり (通信時間0)"""
+
+    def __init__(self):
+        self.timeout = 0.1
+        self.buf = bytearray()
+
+    @property
+    def in_waiting(self):
+        return len(self.buf)
+
+    def write(self, data):
+        reply = bytearray([4, data[1], Rcb4BaseLib.AckType.Ack.value, 0])
+        reply[3] = sum(reply[:3]) & 0xff
+        self.buf += reply
+        return len(data)
+
+    def readinto(self, b):
+        n = min(len(b), len(self.buf))
+        b[:n] = self.buf[:n]
+        del self.buf[:n]
+        return n
+
+    def flushInput(self):
+        self.buf.clear()
+
+    def close(self):
+        pass
+
+
+class NullRcbServoController(RcbServoController):
+    """NullComにつないだRcbServoController"""
+
+    def connect(self, com_port="COM1"):
+        self.rcb4.com = NullCom()
+        self.is_connected = True
+        return True
+
+
+def make_pose_packet():
+    """Unityから届く典型的な姿勢パケット(UTF-8のJSON)を作る"""
+    rng = np.random.default_rng(0)
+    command = {
+        joint.value: {axis: float(v) for axis, v in zip("xyz", rng.uniform(-1.0, 1.0, 3))}
+        for joint in UnityHumanoidJson
+    }
+    return json.dumps(command).encode("utf-8")
+
+
+def make_benchmarks():
+    """測定項目の{名前: 引数なしの関数}を作る"""
+    # 開始時のTポーズの表示を抑える
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        controller = NullRcbServoController("null")
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    rcb4 = controller.rcb4
+    servo_datas = [Rcb4BaseLib.ServoData(servo_id, sio, 7500 + servo_id * 100)
+                   for sio in (1, 2) for servo_id in range(1, 9)]
+    servo_frame = Rcb4BaseLib.ServoFrame((sd.Id, sd.Sio, sd.Data) for sd in servo_datas)
+    _, const_frame = Rcb4BaseLib.runConstFrameServoCmd(servo_datas, 50)
+    const_frame_bytes = bytes(const_frame)
+    _, ack_cmd = Rcb4BaseLib.acknowledgeCmd()
+
+    packet = make_pose_packet()
+    command = json.loads(packet)
+    joints = controller.convert_command2np(command)
+    upper = joints[UnityHumanoidJson.RIGHT_UPPER_ARM.value]
+    lower = joints[UnityHumanoidJson.RIGHT_LOWER_ARM.value]
+    hand = joints[UnityHumanoidJson.RIGHT_HAND.value]
+    arms = controller.arm_points(command)
+    upper_body_angles = [
+        (1, 1, -30.0, -180, 180),
+        (2, 1, 45.0, 0, 180),
+        (3, 1, -60.0, -135, 135),
+        (1, 2, 30.0, -180, 180),
+        (2, 2, 45.0, 0, 180),
+        (3, 2, -60.0, -135, 135),
+    ]
+
+    def parse_and_arm_ik():
+        # 受信したパケットから両腕の関節角度を求めるまで (apply_servo_commandと同じ流れ)
+        return controller.calc_both_arm_angles(controller.arm_points(json.loads(packet)))
+
+    def parse_and_arm_ik_scalar():
+        # 関節ごとにnumpy配列を作り、片腕ずつ計算する場合
+        joints = controller.convert_command2np(json.loads(packet))
+        return [controller.calc_arm_angles(*(joints[joint.value] for joint in arm)) for arm in ARM_JOINTS]
+
+    return {
+        "json.loads": lambda: json.loads(packet),
+        "convert_command2np": lambda: controller.convert_command2np(command),
+        "calc_arm_angles": lambda: controller.calc_arm_angles(upper, lower, hand),
+        "arm_points": lambda: controller.arm_points(command),
+        "calc_both_arm_angles": lambda: controller.calc_both_arm_angles(arms),
+        "parse+arm IK": parse_and_arm_ik,
+        "parse+arm IK(scalar)": parse_and_arm_ik_scalar,
+        "angle_to_position": lambda: controller.angle_to_position(45.0, -135, 135),
+        "runConstFrameServoCmd(16)": lambda: Rcb4BaseLib.runConstFrameServoCmd(servo_datas, 50),
+        "runConstFrameServoCmd(Frame16)": lambda: Rcb4BaseLib.runConstFrameServoCmd(servo_frame, 50),
+        "CheckSum(ConstFrame16)": lambda: Rcb4BaseLib.CheckSum(const_frame),
+        "synchronize(list ACK)": lambda: rcb4.synchronize(ack_cmd, 4),
+        "synchronize(list ConstFrame16)": lambda: rcb4.synchronize(const_frame, 4),
+        "synchronize(bytes ConstFrame16)": lambda: rcb4.synchronize(const_frame_bytes, 4),
+        "move_multiple_servos(6)": lambda: controller.move_multiple_servos(upper_body_angles, frame_time=50),
+    }
+
+
+def measure(func, repeat=7):
+    """1回あたりの時間(ns)と、1回の実行中の一時メモリのピーク(byte)を測る
+
+    tracemallocのピークは実行前からの増加分の最大値なので、すぐに解放される確保が
+    何回あっても同時に使っていた分しか数えない。
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number))
+    ns_per_op = best / number * 1e9
+
+    # tracemallocは遅いので時間とは別に測る (1回目の初期化分を除くため2回目を使う)
+    func()
+    tracemalloc.start()
+    try:
+        func()
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return ns_per_op, max(peak - before, 0)
+
+
+def load_baseline(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(path, results):
+    baseline = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": {name: {"ns_per_op": round(ns, 1), "peak_bytes_per_op": peak}
+                    for name, (ns, peak) in results.items()},
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="フレーム処理のマイクロベンチマーク")
+    parser.add_argument("-k", dest="keyword", default="", help="名前にこの文字列を含む項目だけ測定")
+    parser.add_argument("--save", action="store_true", help="測定結果を基準値として保存")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="基準値のファイル")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"基準値の何倍を超えたら遅くなったとみなすか (既定{DEFAULT_THRESHOLD})")
+    args = parser.parse_args()
+
+    benchmarks = {name: func for name, func in make_benchmarks().items() if args.keyword in name}
+    baseline = None if args.save else load_baseline(args.baseline)
+    base_results = baseline["results"] if baseline else {}
+
+    print(f"{'benchmark':<32}{'ns/op':>12}{'peak B/op':>12}{'baseline':>12}{'ratio':>8}")
+    results = {}
+    regressions = []
+    for name, func in benchmarks.items():
+        ns, peak = measure(func)
+        results[name] = (ns, peak)
+        line = f"{name:<32}{ns:>12.0f}{peak:>12d}"
+        base = base_results.get(name)
+        if base:
+            ratio = ns / base["ns_per_op"]
+            mark = ""
+            if ratio > args.threshold:
+                regressions.append(name)
+                mark = "  遅くなった"
+            line += f"{base['ns_per_op']:>12.0f}{ratio:>8.2f}{mark}"
+        print(line)
+
+    if args.save:
+        save_baseline(args.baseline, results)
+        print(f"基準値を保存しました: {args.baseline}")
+        return 0
+    if baseline is None:
+        print("基準値がありません (--saveで保存できます)")
+    if regressions:
+        print(f"基準値の{args.threshold}倍を超えた項目: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
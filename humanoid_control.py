@@ -10,9 +10,83 @@ sys.path.append("./RCB4Lib_for_Python_V100B/Rcb4Lib")
 
 from json import JSONDecodeError
 
-def udp_listener(sock, command_queue, stop_event):
-    """UDPでコマンドを受信しキューへ投入"""
+ALIGNMENT_REPORT_INTERVAL = 5.0  # ロボット間の姿勢番号のずれを表示する間隔(秒)
+ALIGNMENT_TOLERANCE = 10  # このパケット数以上遅れているロボットを表示する
+TRANSMIT_PERIOD = 0.03  # サーボへ姿勢を送る周期(秒)
+RECONNECT_INTERVAL = 2.0  # 送信に失敗して切断したロボットへ接続し直す間隔(秒)
+WALK_BACKEND = "motion"  # 歩行の方法 ("motion": モーション再生, "krr": KRRの疑似ボタン) 引数の--walk=krrで切り替える
+WALK_BACKENDS = ("motion", "krr")
 
+
+class CadenceStats:
+    """
+    送信ループの周期の記録
+
+    予定の時刻から実際に送り始めるまでの遅れ(ジッタ)と、
+    送信が次の予定の時刻に間に合わなかった回数(オーバーラン)を数える。
+    """
+
+    def __init__(self, period):
+        self.period = period
+        self.ticks = 0  # 予定の時刻が来た回数
+        self.sent = 0  # 姿勢を送った回数
+        self.overruns = 0  # 送信が次の予定の時刻を過ぎた回数
+        self.skipped_ticks = 0  # オーバーランで飛ばした予定の時刻の数
+        self.jitter_total = 0.0
+        self.jitter_max = 0.0
+
+    def record_tick(self, lateness):
+        """予定の時刻からの遅れ(秒)を記録"""
+        self.ticks += 1
+        self.jitter_total += lateness
+        self.jitter_max = max(self.jitter_max, lateness)
+
+    def record_overrun(self, skipped):
+        """オーバーランで飛ばした予定の時刻の数を記録"""
+        self.overruns += 1
+        self.skipped_ticks += skipped
+
+    def summary(self):
+        """表示用の文字列"""
+        jitter_mean = self.jitter_total / self.ticks if self.ticks else 0.0
+        return (f"送信{self.sent}回/{self.ticks}周期, "
+                f"ジッタ平均{jitter_mean * 1000:.2f}ms 最大{self.jitter_max * 1000:.2f}ms, "
+                f"オーバーラン{self.overruns}回 ({self.skipped_ticks}周期飛ばし)")
+
+
+def put_latest(command_queue, item):
+    """
+    キューへ投入 (満杯なら古いものを捨てて最新を入れる)
+
+    空きを待たないので、遅いロボットのキューが受信スレッドを止めることはない。
+    """
+    try:
+        command_queue.put_nowait(item)
+    except queue.Full:
+        # 最新コマンドで上書きするため古いものを破棄
+        try:
+            command_queue.get_nowait()
+            command_queue.task_done()
+        except queue.Empty:
+            pass
+        try:
+            command_queue.put_nowait(item)
+        except queue.Full:
+            # それでも投入できなければスキップ
+            pass
+
+
+def udp_listener(sock, command_queues, stop_event, received=None):
+    """
+    UDPでコマンドを受信し、全ロボットのキューへ投入
+
+    パケットのデコードは1回だけ行い、受信順の姿勢番号を付けて (姿勢番号, コマンド) を
+    ロボットごとのキューに入れる。キューは最新のものだけを残すので、
+    遅いロボットがあってもほかのロボットへの投入は待たされない。
+
+    received (dict): 最後に受信した姿勢番号を"sequence"に書き込む (ロボットの遅れを調べる基準)
+    """
+    sequence = 0
     while not stop_event.is_set():
         try:
             data, _ = sock.recvfrom(2048)
@@ -29,34 +103,180 @@ def udp_listener(sock, command_queue, stop_event):
             print(f"受信データ解析エラー: {exc}")
             continue
 
+        sequence += 1
+        if received is not None:
+            received["sequence"] = sequence
+        for command_queue in command_queues:
+            put_latest(command_queue, (sequence, command))
+
+
+def take_latest(command_queue):
+    """キューにたまっているコマンドのうち最新のものを取り出す (なければNone)"""
+    latest = None
+    while True:
         try:
-            command_queue.put(command, timeout=0.05)
-        except queue.Full:
-            # 最新コマンドで上書きするため古いものを破棄
-            try:
-                command_queue.get_nowait()
-                command_queue.task_done()
-            except queue.Empty:
-                pass
-            try:
-                command_queue.put_nowait(command)
-            except queue.Full:
-                # それでも投入できなければスキップ
-                pass
+            latest = command_queue.get_nowait()
+        except queue.Empty:
+            return latest
+        command_queue.task_done()
+
+
+def servo_transmit_loop(servo_controller, command_queue, stop_event, period=TRANSMIT_PERIOD, is_motion_play=True, status=None):
+    """
+    一定周期でキューの最新のコマンドをサーボへ反映
 
+    UDPの受信間隔には合わせず、単調増加の時計でperiodごとに送信する。
+    フレーム数は補間がちょうど次の送信時刻に終わるように決める。
+    新しいコマンドが届いていない周期は送らない (サーボは前の姿勢で止まっている)。
+    送信が間に合わなかったときは、過ぎた予定の時刻を飛ばして周期に合わせ直す。
 
-def servo_worker(servo_controller,command_queue, stop_event, frame_time=50, is_motion_play=True):
-    """キューからコマンドを取得してサーボへ反映"""
+    送信で例外が起きたときは、表示して切断し、RECONNECT_INTERVALごとに接続し直す。
+    切断している間に届いたコマンドは捨てる (接続し直した後は最新の姿勢から送る)。
+    ほかのロボットの送信ループと受信スレッドは止めない。
 
+    status (dict): 最後に反映した姿勢番号を"sequence"に、送信の記録(CadenceStats)を"cadence"に、
+        接続しているかを"connected"に、例外の回数を"errors"に、最後の例外を"last_error"に書き込む
+    """
+    if status is None:
+        status = {}
+    stats = CadenceStats(period)
+    status.update(cadence=stats, connected=servo_controller.is_connected, errors=0, last_error=None)
+    frame_time = servo_controller.frames_for_period(period) if servo_controller.is_connected else None
+    next_reconnect = time.monotonic()
+
+    next_time = time.monotonic()
     while not stop_event.is_set():
-        try:
-            command = command_queue.get(timeout=0.1)
-        except queue.Empty:
+        delay = next_time - time.monotonic()
+        if delay > 0 and stop_event.wait(delay):
+            break
+        stats.record_tick(time.monotonic() - next_time)
+
+        latest = take_latest(command_queue)
+        if not servo_controller.is_connected and time.monotonic() >= next_reconnect:
+            next_reconnect = time.monotonic() + RECONNECT_INTERVAL
+            if servo_controller.connect(servo_controller.com_port):
+                frame_time = servo_controller.frames_for_period(period)
+                status["connected"] = True
+        if latest is not None and servo_controller.is_connected:
+            sequence, command = latest
+            try:
+                servo_controller.apply_servo_command(command, frame_time=frame_time, is_motion_play=is_motion_play)
+            except Exception as exc:
+                status["errors"] += 1
+                status["last_error"] = exc
+                status["connected"] = False
+                print(f"{servo_controller.com_port}: 送信エラー ({exc!r}) - 切断して{RECONNECT_INTERVAL:.0f}秒後に接続し直します")
+                try:
+                    servo_controller.disconnect()
+                except Exception as disconnect_exc:
+                    print(f"{servo_controller.com_port}: 切断エラー ({disconnect_exc!r})")
+                next_reconnect = time.monotonic() + RECONNECT_INTERVAL
+            else:
+                stats.sent += 1
+                status["sequence"] = sequence
+
+        next_time += period
+        late = time.monotonic() - next_time
+        if late >= 0:
+            skipped = int(late // period) + 1
+            stats.record_overrun(skipped)
+            next_time += skipped * period
+
+
+def parse_robot_args(args):
+    """
+    コマンドライン引数からロボットの一覧を作る
+
+    引数は "COMポート" または "COMポート=キャリブレーションファイル" をロボットの数だけ並べる。
+    "--"で始まる引数(オプション)は飛ばす。
+    例: python humanoid_control.py COM4 COM5=robot_b.json
+
+    Returns:
+        list: [(COMポート, キャリブレーションファイル or None), ...]
+    """
+    robots = []
+    for arg in args:
+        if arg.startswith("--"):
             continue
-        try:
-            servo_controller.apply_servo_command(command, frame_time=frame_time,is_motion_play=True)
-        finally:
-            command_queue.task_done()
+        com, _, calibration_path = arg.partition("=")
+        robots.append((com, calibration_path or None))
+    return robots
+
+
+def parse_walk_backend(args):
+    """
+    コマンドライン引数から歩行の方法を決める
+
+    "--walk=krr" でKRRの疑似ボタンによる歩行にする (ボードにボタンとモーションの対応を登録しておく)。
+    例: python humanoid_control.py --walk=krr COM4
+
+    Returns:
+        str: walk_backend ("--walk"がないか、知らない値のときはWALK_BACKEND)
+    """
+    backend = WALK_BACKEND
+    for arg in args:
+        option, _, value = arg.partition("=")
+        if option != "--walk":
+            continue
+        if value in WALK_BACKENDS:
+            backend = value
+        else:
+            print(f"歩行の方法 {value} は使えません ({', '.join(WALK_BACKENDS)}のどれか)")
+    return backend
+
+
+def load_calibration(path):
+    """
+    キャリブレーションファイルを読み込む
+
+    ファイルはJSONで {"angle_offsets": {"servo_id,sio": 角度の補正(度), ...}} の形式。
+
+    Returns:
+        dict: {(servo_id, sio): 角度の補正(度)} (pathがNoneなら空)
+    """
+    if path is None:
+        return {}
+    with open(path, encoding="utf-8") as f:
+        calibration = json.load(f)
+    offsets = {}
+    for key, offset in calibration.get("angle_offsets", {}).items():
+        servo_id, sio = (int(v) for v in key.split(","))
+        offsets[(servo_id, sio)] = float(offset)
+    return offsets
+
+
+def check_alignment(statuses, received):
+    """
+    受信した最新の姿勢番号から各ロボットがいくつ遅れているかを調べる
+
+    キューは最新のコマンドだけを残すので、ロボットどうしが同じ姿勢番号を同時に送る保証はない
+    (受信が続いている間は、それぞれ違う途中の姿勢を飛ばしながら追いかけ、受信が止まれば同じ最新の姿勢にそろう)。
+    ここでは受信側の姿勢番号を基準にして、追いつけていないロボットを見つける。
+
+    Returns:
+        list: ロボットごとの遅れ (姿勢番号の差。切断中のロボットはNone)
+    """
+    latest = received.get("sequence", 0)
+    return [latest - status.get("sequence", 0) if status.get("connected", True) else None
+            for status in statuses]
+
+
+def report_alignment(robots, statuses, received):
+    """受信した最新の姿勢番号から遅れているロボットと、切断しているロボットを表示"""
+    latest = received.get("sequence", 0)
+    for (com, _), lag, status in zip(robots, check_alignment(statuses, received), statuses):
+        if lag is None:
+            print(f"{com}: 切断中 (送信エラー{status.get('errors', 0)}回, 最後のエラー: {status.get('last_error')!r})")
+        elif lag >= ALIGNMENT_TOLERANCE:
+            print(f"{com}: 姿勢番号{latest - lag} (最新{latest}から{lag}遅れ)")
+
+
+def report_cadence(robots, statuses):
+    """ロボットごとの送信周期の記録を表示"""
+    for (com, _), status in zip(robots, statuses):
+        stats = status.get("cadence")
+        if stats is not None:
+            print(f"{com}: {stats.summary()}")
 
 
 def main():
@@ -68,43 +288,65 @@ def main():
 
     print("UDP受信開始 - ポート9000")
     print("Ctrl+Cで停止")
-    
-    # RCB4接続
-    com = "COM4"  # 実際のCOMポートに変更
-    frame_time = 50  # サーボ移動時間（フレーム数）
+
+    # RCB4接続 (引数でロボットの数だけCOMポートを指定。エミュレータのptyも指定可)
+    robots = parse_robot_args(sys.argv[1:]) or [("COM4", None)]  # 実際のCOMポートに変更
+    period = TRANSMIT_PERIOD  # 送信周期(秒) フレーム数はこれとボードの出力周期から決まる
     is_motion_play = True  # 歩行モーションを使用するか
-    servo_controller = RcbServoController(com)  # 実際のCOMポートに変更
+    walk_backend = parse_walk_backend(sys.argv[1:])
+    servo_controllers = [RcbServoController(com, angle_offsets=load_calibration(calibration_path), walk_backend=walk_backend)
+                         for com, calibration_path in robots]
 
-    command_queue = queue.Queue(maxsize=5)
+    # ロボットごとに最新のコマンドだけを持つキューと送信ループを用意する
+    command_queues = [queue.Queue(maxsize=1) for _ in robots]
+    statuses = [{} for _ in robots]
+    received = {}
     stop_event = threading.Event()
 
     listener_thread = threading.Thread(
         target=udp_listener,
-        args=(sock, command_queue, stop_event),
+        args=(sock, command_queues, stop_event, received),
         name="UDPListener",
         daemon=True,
     )
-    worker_thread = threading.Thread(
-        target=servo_worker,
-        args=(servo_controller, command_queue, stop_event, frame_time,is_motion_play),
-        name="ServoWorker",
-        daemon=True,
-    )
+    worker_threads = [
+        threading.Thread(
+            target=servo_transmit_loop,
+            args=(servo_controller, command_queue, stop_event, period, is_motion_play, status),
+            name=f"ServoTransmit-{com}",
+            daemon=True,
+        )
+        for (com, _), servo_controller, command_queue, status in zip(robots, servo_controllers, command_queues, statuses)
+    ]
 
     listener_thread.start()
-    worker_thread.start()
+    for worker_thread in worker_threads:
+        worker_thread.start()
 
     try:
-        while listener_thread.is_alive() and worker_thread.is_alive():
+        last_report = time.monotonic()
+        stopped_workers = set()
+        # 送信ループが1つ止まっても、ほかのロボットの送信は続ける
+        while listener_thread.is_alive() and any(worker_thread.is_alive() for worker_thread in worker_threads):
             time.sleep(0.5)
+            for worker_thread in worker_threads:
+                if not worker_thread.is_alive() and worker_thread.name not in stopped_workers:
+                    stopped_workers.add(worker_thread.name)
+                    print(f"{worker_thread.name}が停止しました (ほかのロボットは続けます)")
+            if time.monotonic() - last_report >= ALIGNMENT_REPORT_INTERVAL:
+                report_alignment(robots, statuses, received)
+                report_cadence(robots, statuses)
+                last_report = time.monotonic()
     except KeyboardInterrupt:
         print("\n停止要求を受信しました")
     finally:
         stop_event.set()
         sock.close()
         listener_thread.join(timeout=1.0)
-        worker_thread.join(timeout=1.0)
-        servo_controller.disconnect()
+        for worker_thread in worker_threads:
+            worker_thread.join(timeout=1.0)
+        for servo_controller in servo_controllers:
+            servo_controller.disconnect()
 
     print("終了しました")
 
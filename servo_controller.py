@@ -11,6 +11,8 @@ from Rcb4BaseLib import Rcb4BaseLib
 import time
 import math
 import numpy as np
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 from enum import Enum
 
@@ -56,40 +58,151 @@ class ServoJson(Enum):
     LEFT_FOOT0 = "LeftFoot0"
     LEFT_FOOT1 = "LeftFoot1"
 
+# 各サーボの(servo_id, sio)
+SERVO_IDS = {
+    ServoJson.RIGHT_SHOULDER_PITCH: (1, 1),
+    ServoJson.RIGHT_SHOULDER_YAW: (2, 1),
+    ServoJson.RIGHT_ELBOW: (3, 1),
+    ServoJson.LEFT_SHOULDER_PITCH: (1, 2),
+    ServoJson.LEFT_SHOULDER_YAW: (2, 2),
+    ServoJson.LEFT_ELBOW: (3, 2),
+    ServoJson.RIGHT_UPPER_LEG0: (4, 1),
+    ServoJson.RIGHT_UPPER_LEG1: (5, 1),
+    ServoJson.RIGHT_LOWER_LEG: (6, 1),
+    ServoJson.RIGHT_FOOT0: (7, 1),
+    ServoJson.RIGHT_FOOT1: (8, 1),
+    ServoJson.LEFT_UPPER_LEG0: (4, 2),
+    ServoJson.LEFT_UPPER_LEG1: (5, 2),
+    ServoJson.LEFT_LOWER_LEG: (6, 2),
+    ServoJson.LEFT_FOOT0: (7, 2),
+    ServoJson.LEFT_FOOT1: (8, 2),
+}
+
+# 指令速度に応じたサーボのスピード・ストレッチ (1-127)
+GAIN_SCHEDULE_REST = (96, 40)        # 静止時の(スピード, ストレッチ) 保持力を下げてハンチングを抑える
+GAIN_SCHEDULE_FAST = (127, 112)      # 速い動作時の(スピード, ストレッチ) 追従を速くする
+GAIN_SCHEDULE_FAST_VELOCITY = 4000.0 # 速い動作とみなす指令速度 (ポジション/秒)
+GAIN_SCHEDULE_STEP = 8               # 値をこの刻みに丸めて、細かな変化では送らない
+GAIN_SCHEDULE_SMOOTHING = 0.3        # 指令速度の指数移動平均の係数
+
+# モーションの終了を待つ時間 (再生時間の推定値 * SCALE + MARGIN 秒)
+MOTION_TIMEOUT_SCALE = 2.0
+MOTION_TIMEOUT_MARGIN = 1.0
+MOTION_TIMEOUT_DEFAULT = 10.0  # 再生時間の推定値がないときに待つ秒数
+
+# calc_both_arm_anglesに渡す両腕の関節 [右腕, 左腕] × [上腕, 前腕, 手]
+ARM_JOINTS = (
+    (UnityHumanoidJson.RIGHT_UPPER_ARM, UnityHumanoidJson.RIGHT_LOWER_ARM, UnityHumanoidJson.RIGHT_HAND),
+    (UnityHumanoidJson.LEFT_UPPER_ARM, UnityHumanoidJson.LEFT_LOWER_ARM, UnityHumanoidJson.LEFT_HAND),
+)
+ARM_JOINT_NAMES = tuple(tuple(joint.value for joint in arm) for arm in ARM_JOINTS)  # コマンドのキー (Enumの.valueを毎回引かない)
+ARM_IK_EPSILON = 1e-12  # 長さ0の腕でも割り算できるように足す値 (そのときのひじの角度は0度)
+
+# walk_backend="krr"で歩行の方向ごとに押すKRRのボタン
+# (ボードのボタンとモーションの対応表に、同じボタンで歩行モーションを登録しておく)
+KRR_WALK_BUTTONS = {
+    "forward": Rcb4BaseLib.KRR_BUTTON.UP.value,
+    "back": Rcb4BaseLib.KRR_BUTTON.DOWN.value,
+    "right": Rcb4BaseLib.KRR_BUTTON.RIGHT.value,
+    "left": Rcb4BaseLib.KRR_BUTTON.LEFT.value,
+}
+
 class RcbServoController:
-    def __init__(self, com_port="COM3"):
+    def __init__(self, com_port="COM3", pipeline_window=0, use_scheduler=False, probe_baudrate=False,
+                 delta_deadband=None, full_refresh_interval=25, gain_schedule_interval=None, angle_offsets=None,
+                 walk_backend="motion"):
         """
         RCB4サーボコントローラーを初期化
 
         Args:
             com_port (str): COMポート名 (例: 'COM1', 'COM3')
+            pipeline_window (int): ACKを待たずに送るサーボフレーム数 (0で毎回ACKを待つ)
+            use_scheduler (bool): 優先度付きスケジューラを通して送受信するか
+                (別スレッドから状態を読み出すときに角度指令を遅らせない)
+            probe_baudrate (bool): 接続時にRCB4が対応する一番速い通信速度を探して切り替えるか
+                (見つけた速度は記録し、次回はその速度から試す)
+            delta_deadband (int): 前回送ったポジションとの差がこの値以下のサーボは送らない
+                (Noneで毎回全サーボを送る。変わったサーボが1つだけならSingleServoで送る)
+            full_refresh_interval (int): delta_deadband使用時に、このフレーム数ごとに全サーボを送り直す
+            gain_schedule_interval (float): 指令速度から決めたスピード・ストレッチを送る間隔(秒)
+                (Noneで送らない。値が変わったサーボだけを1回の書き込みでまとめて送る)
+            angle_offsets (dict): ロボットごとのキャリブレーション {(servo_id, sio): 角度の補正(度)}
+                (move_multiple_servosで指令角度に足してからポジションに変換する)
+            walk_backend (str): walk_motionで歩行させる方法
+                "motion": 方向ごとのモーションを再生して終わるまで待つ
+                "krr": KRRの疑似ボタンを押し続け、ボード側のボタンとモーションの対応で歩行させる
+                (ボタンが変わったときだけ1回書き込み、返信以外は待たない)
         """
         self.rcb4 = Rcb4BaseLib()
+        self.frame_templates = {}  # (servo_id, sio)の組み合わせ -> ConstFrameTemplate
+        self.pipeline_window = pipeline_window
+        self.use_scheduler = use_scheduler
+        self.probe_baudrate = probe_baudrate
+        self.frame_error_count = 0
+        self.position_poller = None
+        # ICS番号ごとの最後に指令したポジション (未指令は-1)
+        self.commanded_positions = np.full(Rcb4BaseLib.IcsDeviceSize, -1, dtype=np.int32)
+        self.delta_deadband = delta_deadband
+        self.full_refresh_interval = full_refresh_interval
+        self.frames_since_full_refresh = 0
+        self.delta_frame = Rcb4BaseLib.ServoFrame()  # 変わったサーボだけを送るときに使いまわす
+        self.gain_schedule_interval = gain_schedule_interval
+        self.last_targets = np.full(Rcb4BaseLib.IcsDeviceSize, -1.0)  # 速度計算用の前回の目標ポジション
+        self.last_target_time = None
+        self.joint_velocities = np.zeros(Rcb4BaseLib.IcsDeviceSize)  # ICS番号ごとの指令速度 (ポジション/秒)
+        self.sent_speeds = np.zeros(Rcb4BaseLib.IcsDeviceSize, dtype=np.int32)  # 最後に送ったスピード (未送信は0)
+        self.sent_stretches = np.zeros(Rcb4BaseLib.IcsDeviceSize, dtype=np.int32)
+        self.last_gain_time = 0.0
+        self.angle_offsets = dict(angle_offsets) if angle_offsets else {}
+        self.walk_backend = walk_backend
+        self.krr_buttons = None  # 最後に書き込んだKRRのボタンデータ (未書き込みはNone)
+        self.device_table = None  # ミキシングの切り替え用に写しておくICSデバイスのデータ (切り替えのたびに範囲を読み込み直す)
+        self.is_connected = False  # 接続できなかったボードも、ほかのロボットを止めずに扱えるようにする
         self.connect(com_port)
         self.move_t_pose(frame_time=100)
 
     def connect(self, com_port="COM1"):
-        """RCB4に接続"""
+        """RCB4に接続 (接続できなかったときはポートを閉じるので、同じポートで接続し直せる)"""
+        self.com_port = com_port
         try:
-            result = self.rcb4.open(com_port, 115200, 1.3)
+            result = self.rcb4.open(com_port, 115200, 1.3, probe=self.probe_baudrate)
             if result and self.rcb4.checkAcknowledge():
                 self.is_connected = True
-                print(f"RCB4に正常に接続しました (ポート: {com_port})")
+                if self.pipeline_window > 0:
+                    self.rcb4.startPipeline(self.pipeline_window)
+                if self.use_scheduler:
+                    self.rcb4.startScheduler()
+                print(f"RCB4に正常に接続しました (ポート: {com_port}, {self.rcb4.com.baudrate}bps)")
                 print(f"バージョン: {self.rcb4.Version}")
                 return True
             else:
                 print(f"RCB4への接続に失敗しました (ポート: {com_port})")
+                self.rcb4.close()
                 return False
         except Exception as e:
             print(f"接続エラー: {e}")
+            self.rcb4.close()
             return False
 
     def disconnect(self):
-        """RCB4から切断"""
+        """
+        RCB4から切断
+
+        途中の書き込みで例外が起きても、ポートは閉じて未接続にする。
+        ボードの状態はわからなくなるので、最後に送ったポジションとKRRのボタンデータも忘れる
+        (接続し直した後は全サーボとボタンデータを送り直す)。
+        """
         if self.is_connected:
-            self.rcb4.close()
-            self.is_connected = False
-            print("RCB4から切断しました")
+            try:
+                if self.krr_buttons:
+                    self.release_walk()
+                self.stop_position_poller()
+            finally:
+                self.rcb4.close()
+                self.is_connected = False
+                self.commanded_positions[:] = -1
+                self.krr_buttons = None
+                print("RCB4から切断しました")
     
     def move_t_pose(self, frame_time=100):
         """Tポーズに移動"""
@@ -152,21 +265,25 @@ class RcbServoController:
 
         position = (11500 - 3500) / (135 + 135) * (angle_degrees) + 7500
         return int(position)
-    
+
+    def frames_for_period(self, period):
+        """
+        一定周期で姿勢を送るときのフレーム数を計算
+
+        補間がちょうど次の姿勢が届くときに終わるように、送信周期をボードの1フレームの時間で割る。
+
+        Args:
+            period (float): 送信周期(秒)
+
+        Returns:
+            int: フレーム数 (1以上)
+        """
+        return max(1, round(period / self.rcb4.getFramePeriod()))
+
     def apply_servo_command(self, command, frame_time=50, is_motion_play=True):
         """受信コマンドをRCB4へ反映"""
-        command = self.convert_command2np(command)
-        right_shoulder_position = command[UnityHumanoidJson.RIGHT_SHOULDER.value]
-        right_upper_arm_position = command[UnityHumanoidJson.RIGHT_UPPER_ARM.value]
-        right_lower_arm_position = command[UnityHumanoidJson.RIGHT_LOWER_ARM.value]
-        right_hand_position = command[UnityHumanoidJson.RIGHT_HAND.value]
-        left_shoulder_position = command[UnityHumanoidJson.LEFT_SHOULDER.value]
-        left_upper_arm_position = command[UnityHumanoidJson.LEFT_UPPER_ARM.value]
-        left_lower_arm_position = command[UnityHumanoidJson.LEFT_LOWER_ARM.value]
-        left_hand_position = command[UnityHumanoidJson.LEFT_HAND.value]
-        
-        rsp,rsy,re = self.calc_arm_angles(right_upper_arm_position, right_lower_arm_position, right_hand_position)
-        lsp,lsy,le = self.calc_arm_angles(left_upper_arm_position, left_lower_arm_position, left_hand_position)
+        # 両腕は1つの配列にしてまとめて計算する (関節ごとのnumpy配列は作らない)
+        (rsp, rsy, re), (lsp, lsy, le) = self.calc_both_arm_angles(self.arm_points(command))
         # print("右肩ピッチの角度は:", rsp,"右肩ヨーの角度は:", rsy,"右肘の角度は:", re)
         # print("左肩ピッチの角度は:", lsp,"左肩ヨーの角度は:", lsy,"左肘の角度は:", le)
 
@@ -181,10 +298,10 @@ class RcbServoController:
         self.move_multiple_servos(upper_body_angles, frame_time=frame_time)
 
         # 別で腰らへんの位置とつま先の距離で後進か前進か横移動のモーションを実行する
-        right_upper_leg = command[UnityHumanoidJson.RIGHT_UPPER_LEG.value]
-        right_foot = command[UnityHumanoidJson.RIGHT_FOOT.value]
-        left_upper_leg = command[UnityHumanoidJson.LEFT_UPPER_LEG.value]
-        left_foot = command[UnityHumanoidJson.LEFT_FOOT.value]
+        right_upper_leg = self.joint_point(command, UnityHumanoidJson.RIGHT_UPPER_LEG)
+        right_foot = self.joint_point(command, UnityHumanoidJson.RIGHT_FOOT)
+        left_upper_leg = self.joint_point(command, UnityHumanoidJson.LEFT_UPPER_LEG)
+        left_foot = self.joint_point(command, UnityHumanoidJson.LEFT_FOOT)
 
         if is_motion_play:
             self.walk_motion(right_upper_leg, right_foot, left_upper_leg, left_foot)
@@ -195,59 +312,121 @@ class RcbServoController:
         dif_left_x = left_upper_leg[0] - left_foot[0]
         dif_left_y = left_upper_leg[1] - left_foot[1]
 
+        if self.walk_backend == "krr":
+            directions = []
+            if dif_right_x < -0.3 or dif_left_x < -0.3:
+                directions.append("forward")
+            if dif_right_x > 0.2 or dif_left_x > 0.2:
+                directions.append("back")
+            if dif_right_y > 0.3 or dif_left_y > 0.3:
+                directions.append("right")
+            if dif_right_y < -0.3 or dif_left_y < -0.3:
+                directions.append("left")
+            return self.hold_walk(directions)
+
         if(dif_right_x < -0.3 or dif_left_x < -0.3):
             print("前進")
-            self.rcb4.motionPlay(5)  # モーション番号1を再生
-            while True:  # モーションの再生が終わるまで繰り返し
-                motionNum = self.rcb4.getMotionPlayNum()  # 現在再生されているモーション番号を取得
-                if motionNum < 0:  # モーション番号が0より小さい場合はエラー
-                    print("motion get error", motionNum)
-                    break
-                if motionNum == 0:  # モーション番号が0のときは再生されていない状態
-                    print("stop motion or idle")
-                    break
-                print("play motion -> ", motionNum)
-                time.sleep(0.1)
+            self.wait_motion(self.play_motion_async(5), 5)
 
         if(dif_right_x > 0.2 or dif_left_x > 0.2):
             print("後進")
-            self.rcb4.motionPlay(6)
-            while True:  # モーションの再生が終わるまで繰り返し
-                motionNum = self.rcb4.getMotionPlayNum()  # 現在再生されているモーション番号を取得
-                if motionNum < 0:  # モーション番号が0より小さい場合はエラー
-                    print("motion get error", motionNum)
-                    break
-                if motionNum == 0:  # モーション番号が0のときは再生されていない状態
-                    print("stop motion or idle")
-                    break
-                print("play motion -> ", motionNum)
-                time.sleep(0.1)
+            self.wait_motion(self.play_motion_async(6), 6)
         if(dif_right_y > 0.3 or dif_left_y > 0.3):
             print("右に移動")
-            self.rcb4.motionPlay(8)
-            while True:  # モーションの再生が終わるまで繰り返し
-                motionNum = self.rcb4.getMotionPlayNum()  # 現在再生されているモーション番号を取得
-                if motionNum < 0:  # モーション番号が0より小さい場合はエラー
-                    print("motion get error", motionNum)
-                    break
-                if motionNum == 0:  # モーション番号が0のときは再生されていない状態
-                    print("stop motion or idle")
-                    break
-                print("play motion -> ", motionNum)
-                time.sleep(0.1)
+            self.wait_motion(self.play_motion_async(8), 8)
         if(dif_right_y < -0.3 or dif_left_y < -0.3):
             print("左に移動")
-            self.rcb4.motionPlay(7)
-            while True:  # モーションの再生が終わるまで繰り返し
-                motionNum = self.rcb4.getMotionPlayNum()  # 現在再生されているモーション番号を取得
-                if motionNum < 0:  # モーション番号が0より小さい場合はエラー
-                    print("motion get error", motionNum)
-                    break
-                if motionNum == 0:  # モーション番号が0のときは再生されていない状態
-                    print("stop motion or idle")
-                    break
-                print("play motion -> ", motionNum)
-                time.sleep(0.1)
+            self.wait_motion(self.play_motion_async(7), 7)
+
+    def hold_walk(self, directions):
+        """
+        歩行の方向に対応するKRRのボタンを押し続ける
+
+        方向のボタンをまとめて1つのボタンデータにし、前回書き込んだものと違うときだけ書き込む。
+        前後・左右の逆向きが同時に来たときは、どちらも押さない。
+        ボタンを押している間の歩行の繰り返しや切り替えはボード側で行う。
+
+        Args:
+            directions (list): "forward", "back", "right", "left"の配列 (空ならボタンを離す)
+
+        Returns:
+            bool: 書き込みに成功したか (変わっていないときもTrue)
+        """
+        buttons = 0
+        for direction in directions:
+            buttons |= KRR_WALK_BUTTONS[direction]
+        for first, second in (("forward", "back"), ("right", "left")):
+            pair = KRR_WALK_BUTTONS[first] | KRR_WALK_BUTTONS[second]
+            if buttons & pair == pair:
+                buttons &= ~pair
+        return self._set_krr_buttons(buttons)
+
+    def release_walk(self):
+        """KRRのボタンを離して歩行を止める"""
+        return self._set_krr_buttons(Rcb4BaseLib.KRR_BUTTON.NONE.value)
+
+    def _set_krr_buttons(self, buttons):
+        """KRRのボタンデータが変わったときだけ書き込む"""
+        if buttons == self.krr_buttons:
+            return True
+        if not self.is_connected:
+            print("RCB4が接続されていません")
+            return False
+        if not self.rcb4.setKrrButtonData(buttons):
+            # 書き込めたかわからないので、次は必ず書き込む
+            self.krr_buttons = None
+            print("KRRのボタンデータの書き込みに失敗しました")
+            return False
+        names = [direction for direction, button in KRR_WALK_BUTTONS.items() if buttons & button]
+        print(f"歩行: {', '.join(names) if names else '停止'}")
+        self.krr_buttons = buttons
+        return True
+
+    def play_motion_async(self, motion_num):
+        """
+        モーションを再生し、再生が終わったら結果が入るFutureを返す
+
+        Args:
+            motion_num (int): モーション番号
+
+        Returns:
+            concurrent.futures.Future: 結果は正常に再生し終わったらTrue (再生できなかったときはすぐにFalse)
+        """
+        if not self.is_connected:
+            print("RCB4が接続されていません")
+            future = Future()
+            future.set_result(False)
+            return future
+        return self.rcb4.motionPlayAsync(motion_num)
+
+    def wait_motion(self, future, motion_num=None, timeout=None):
+        """
+        play_motion_asyncのFutureの結果を待つ
+
+        Args:
+            future (Future): play_motion_asyncの結果
+            motion_num (int): 再生したモーション番号 (待ち時間の計算に使う)
+            timeout (float): 待つ最大の時間(秒) Noneのときは再生時間の推定値から決める
+                (推定値 * MOTION_TIMEOUT_SCALE + MOTION_TIMEOUT_MARGIN、推定値がなければMOTION_TIMEOUT_DEFAULT)
+
+        Returns:
+            bool: 時間内に正常に再生し終わったらTrue
+        """
+        if timeout is None:
+            duration = self.rcb4.motionDuration(motion_num) if motion_num is not None else None
+            if duration is None:
+                timeout = MOTION_TIMEOUT_DEFAULT
+            else:
+                timeout = duration * MOTION_TIMEOUT_SCALE + MOTION_TIMEOUT_MARGIN
+        try:
+            result = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            print(f"モーションの再生が{timeout:.1f}秒で終わりませんでした")
+            return False
+        if not result:
+            print("モーションの再生に失敗しました")
+            return False
+        return True
 
     def convert_command2np(self, command):
         """コマンドをnumpy配列に変換"""
@@ -257,6 +436,50 @@ class RcbServoController:
             joint_angles[joint.value] = np.array([each_joint["x"], each_joint["y"], each_joint["z"]])
         return joint_angles
 
+    def joint_point(self, command, joint):
+        """コマンドから関節の位置を(x, y, z)で取り出す (ないときは原点)"""
+        each_joint = command.get(joint.value, {"x": 0, "y": 0, "z": 0})
+        return (each_joint["x"], each_joint["y"], each_joint["z"])
+
+    def arm_points(self, command):
+        """コマンドから両腕の関節の位置を[右腕, 左腕] × [上腕, 前腕, 手] × (x, y, z)のタプルにする (ないときは原点)"""
+        origin = {"x": 0, "y": 0, "z": 0}
+        points = []
+        for names in ARM_JOINT_NAMES:
+            for name in names:
+                each_joint = command.get(name, origin)
+                points.append((each_joint["x"], each_joint["y"], each_joint["z"]))
+        return (points[0], points[1], points[2]), (points[3], points[4], points[5])
+
+    def calc_both_arm_angles(self, arms):
+        """
+        両腕の関節角度をまとめて計算
+
+        calc_arm_anglesと同じ角度を、関節の座標のタプルからmathだけで求める
+        (要素が3つのベクトルでは、numpyの配列を作って演算を呼ぶほうが時間がかかる)。
+        ひじの角度は上腕と前腕のなす角 (180度 - 余弦定理で求めた内角) で、
+        acosの引数を-1から1に収めるので、腕が伸びきっていてもエラーにならない。
+
+        Args:
+            arms: [右腕, 左腕] × [上腕, 前腕, 手] × (x, y, z) (arm_pointsの結果か、(2, 3, 3)の配列)
+
+        Returns:
+            list: [右腕, 左腕] × (肩ピッチ, 肩ヨー, ひじ) (度)
+        """
+        angles = []
+        for (ux, uy, uz), (lx, ly, lz), (hx, hy, hz) in arms:
+            # 肩→ひじ、ひじ→手
+            ex, ey, ez = lx - ux, ly - uy, lz - uz
+            fx, fy, fz = hx - lx, hy - ly, hz - lz
+            cos = (ex * fx + ey * fy + ez * fz + ARM_IK_EPSILON) / (
+                math.sqrt((ex * ex + ey * ey + ez * ez) * (fx * fx + fy * fy + fz * fz)) + ARM_IK_EPSILON)
+            angles.append((
+                math.degrees(math.atan2(ez, ex)),  # 肩ピッチ(上腕をx,z平面に投影)
+                math.degrees(math.atan2(ey, math.hypot(ex, ez))),  # 肩ヨー
+                math.degrees(math.acos(max(-1.0, min(1.0, cos)))),  # ひじ
+            ))
+        return angles
+
     def calc_arm_angles(self, upper_arm_pos, lower_arm_pos, hand_pos):
         """腕の各関節の角度を計算"""
         # ひじの角度を計算
@@ -274,7 +497,9 @@ class RcbServoController:
         s_to_e_xz_len = math.sqrt(s_to_e[0]**2 + s_to_e[2]**2)
         shoulder_yaw_angle = math.atan2(s_to_e[1], s_to_e_xz_len) * (180.0 / math.pi)
         # ひじの角度を計算(余弦定理)
-        elbow_angle = (math.pi - math.acos((l1**2 + l2**2 - d**2) / (2 * l1 * l2))) * (180.0 / math.pi)
+        # 腕が伸びきっていると誤差で範囲外になるので、acosの引数を-1から1に収める
+        elbow_cos = max(-1.0, min(1.0, (l1**2 + l2**2 - d**2) / (2 * l1 * l2)))
+        elbow_angle = (math.pi - math.acos(elbow_cos)) * (180.0 / math.pi)
         return shoulder_pitch_angle, shoulder_yaw_angle, elbow_angle
 
     def move_multiple_servos(self, servo_angles, frame_time=100):
@@ -293,29 +518,302 @@ class RcbServoController:
             return False
 
         try:
-            servo_data_list = []
+            servo_keys = []
+            positions = []
 
             # 各サーボのデータを準備
             for servo_id, sio, angle_degrees, min_angle, max_angle in servo_angles:
+                if self.angle_offsets:
+                    angle_degrees += self.angle_offsets.get((servo_id, sio), 0.0)
                 position = self.angle_to_position(angle_degrees, min_angle, max_angle)
-                servo_data = self.rcb4.ServoData(servo_id, sio, position)
-                servo_data_list.append(servo_data)
+                servo_keys.append((servo_id, sio))
+                positions.append(position)
                 # print(f"サーボ{servo_id} (SIO{sio}): {angle_degrees:.1f}度 → ポジション{position}")
 
-            # 複数サーボを同時移動
-            result = self.rcb4.setServoPos(servo_data_list, frame_time)
+            if self.gain_schedule_interval is not None:
+                self._update_gain_schedule(servo_keys, positions)
 
+            if self.delta_deadband is not None:
+                return self._send_delta_frame(servo_keys, positions, frame_time)
 
-            if result:
-                return True
-            else:
-                print("複数サーボの移動に失敗しました")
-                return False
+            for (servo_id, sio), position in zip(servo_keys, positions):
+                self.commanded_positions[Rcb4BaseLib.icsNum2id(servo_id, sio)] = position
+            return self._send_frame(servo_keys, positions, frame_time)
 
         except Exception as e:
             print(f"複数サーボ移動エラー: {e}")
             return False
 
+    def _send_frame(self, servo_keys, positions, frame_time):
+        """指定したサーボだけのConstFrameServoを送る"""
+        # サーボの組み合わせごとにコマンドのひな形を使いまわす
+        template = self.get_frame_template(tuple(servo_keys))
+        if template is None:
+            print("サーボの指定が不正です")
+            return False
+
+        # 複数サーボを同時移動
+        if self.pipeline_window > 0:
+            # ACKは受信スレッドで確認し、失敗はコールバックで数える
+            self.rcb4.setServoPosTemplatePipelined(template, positions, frame_time, self._on_frame_ack)
+            return True
+        result = self.rcb4.setServoPosTemplate(template, positions, frame_time)
+
+        if result:
+            return True
+        else:
+            print("複数サーボの移動に失敗しました")
+            return False
+
+    def _send_servo_frame(self, servo_frame, frame_time, ics_nums=None):
+        """
+        ServoFrameに入っているサーボだけのConstFrameServoを送る
+
+        ics_numsを渡すと、パイプライン送信のACKが失敗したときにそのサーボのcommanded_positionsを未指令(-1)に戻す
+        """
+        _, txbuf = Rcb4BaseLib.runConstFrameServoCmd(servo_frame, frame_time)
+        if self.pipeline_window > 0:
+            self.rcb4.synchronizeAckPipelined(txbuf, lambda future: self._on_frame_ack(future, ics_nums))
+            return True
+        if self.rcb4.synchronizeAck(txbuf):
+            return True
+        print("複数サーボの移動に失敗しました")
+        return False
+
+    def _send_single_servo(self, servo_id, sio, position, frame_time, ics_nums=None):
+        """
+        1つのサーボだけをSingleServoで送る
+
+        ics_numsは_send_servo_frameと同じ
+        """
+        if self.pipeline_window > 0:
+            _, txbuf = Rcb4BaseLib.runSingleServoCmd(servo_id, sio, position, frame_time)
+            self.rcb4.synchronizeAckPipelined(txbuf, lambda future: self._on_frame_ack(future, ics_nums))
+            return True
+        if self.rcb4.setSingleServo(servo_id, sio, position, frame_time):
+            return True
+        print("サーボの移動に失敗しました")
+        return False
+
+    def _send_delta_frame(self, servo_keys, positions, frame_time):
+        """
+        前回送ったポジションからdelta_deadbandを超えて変わったサーボだけを送る
+
+        変わったサーボが1つならSingleServo、複数ならそのサーボだけのConstFrameServoを
+        (組み合わせごとのひな形は作らず、delta_frameに詰めて)送る。
+        full_refresh_interval フレームごとに、変わっていないサーボも含めて全部送り直す
+        (ACKの取りこぼしなどで指令がずれたままにならないようにする)。
+        commanded_positionsはACKが返ってきたときだけ更新し、失敗したサーボは未指令(-1)に戻して次のフレームで送り直す。
+        パイプライン送信では、ACKを待つ間の次のフレームで同じ指令を重ねて送らないよう送った時点で更新し、
+        ACKが失敗したら_on_frame_ackで未指令に戻す。
+
+        Returns:
+            bool: 成功時True (送るサーボがなかったときもTrue)
+        """
+        ics_nums = np.array([Rcb4BaseLib.icsNum2id(servo_id, sio) for servo_id, sio in servo_keys])
+        positions = np.array(positions, dtype=np.int32)
+
+        self.frames_since_full_refresh += 1
+        if self.frames_since_full_refresh >= self.full_refresh_interval:
+            changed = np.arange(len(positions))
+        else:
+            last = self.commanded_positions[ics_nums]
+            changed = np.flatnonzero((last < 0) | (np.abs(positions - last) > self.delta_deadband))
+        if len(changed) == len(positions):
+            self.frames_since_full_refresh = 0
+
+        if len(changed) == 0:
+            return True
+        sent_ics = ics_nums[changed]
+        if len(changed) == 1:
+            i = changed[0]
+            servo_id, sio = servo_keys[i]
+            result = self._send_single_servo(servo_id, sio, int(positions[i]), frame_time, sent_ics)
+        else:
+            self.delta_frame.clear()
+            for i in changed:
+                self.delta_frame.setIcs(int(ics_nums[i]), int(positions[i]))
+            result = self._send_servo_frame(self.delta_frame, frame_time, sent_ics)
+
+        if result:
+            self.commanded_positions[sent_ics] = positions[changed]
+        else:
+            self.commanded_positions[sent_ics] = -1
+        return result
+
+    def _update_gain_schedule(self, servo_keys, positions):
+        """
+        指令速度からサーボごとのスピードとストレッチを決め、変わったものだけ送る
+
+        指令速度は目標ポジションの変化量の指数移動平均。GAIN_SCHEDULE_RESTから
+        GAIN_SCHEDULE_FASTまでを指令速度に比例して決め、GAIN_SCHEDULE_STEP刻みに丸める。
+        gain_schedule_interval秒に1回だけ、スピードとストレッチのServoParamを
+        ACKを待たずに送る (変わったサーボがなければ送らない)。
+        送った値はACKが返ってきたときに_on_gain_ackで記録するので、失敗した値は次の周期に送り直す。
+        """
+        now = time.monotonic()
+        ics_nums = np.array([Rcb4BaseLib.icsNum2id(servo_id, sio) for servo_id, sio in servo_keys])
+        targets = np.array(positions, dtype=float)
+
+        last = self.last_targets[ics_nums]
+        if self.last_target_time is not None and now > self.last_target_time:
+            velocity = np.where(last >= 0, np.abs(targets - last) / (now - self.last_target_time), 0.0)
+            self.joint_velocities[ics_nums] += GAIN_SCHEDULE_SMOOTHING * (velocity - self.joint_velocities[ics_nums])
+        self.last_targets[ics_nums] = targets
+        self.last_target_time = now
+
+        if now - self.last_gain_time < self.gain_schedule_interval:
+            return True
+        self.last_gain_time = now
+
+        ratio = np.clip(self.joint_velocities[ics_nums] / GAIN_SCHEDULE_FAST_VELOCITY, 0.0, 1.0)
+        for index, (build_cmd, sent) in enumerate(((Rcb4BaseLib.setSpeedCmd, self.sent_speeds),
+                                                   (Rcb4BaseLib.setStretchCmd, self.sent_stretches))):
+            rest, fast = GAIN_SCHEDULE_REST[index], GAIN_SCHEDULE_FAST[index]
+            values = np.round((rest + (fast - rest) * ratio) / GAIN_SCHEDULE_STEP) * GAIN_SCHEDULE_STEP
+            values = np.clip(values, 1, 127).astype(np.int32)
+            changed = np.flatnonzero(values != sent[ics_nums])
+            if len(changed) == 0:
+                continue
+            servo_frame = Rcb4BaseLib.ServoFrame()
+            for i in changed:
+                servo_frame.setIcs(int(ics_nums[i]), int(values[i]))
+            _, txbuf = build_cmd(servo_frame)
+            nums, sent_values = ics_nums[changed], values[changed]
+            self.rcb4.synchronizeAckPipelined(
+                txbuf, lambda future, sent=sent, nums=nums, sent_values=sent_values: self._on_gain_ack(future, sent, nums, sent_values))
+        return True
+
+    def _on_gain_ack(self, future, sent, ics_nums, values):
+        """
+        送ったスピード・ストレッチのACK結果を受け取り、成功したときだけ送った値を記録する
+
+        Args:
+            future (Future): synchronizeAckPipelinedの結果
+            sent (np.ndarray): 記録先 (sent_speedsかsent_stretches)
+            ics_nums (np.ndarray): 送ったICS番号
+            values (np.ndarray): 送った値
+        """
+        if future.result():
+            sent[ics_nums] = values
+        else:
+            print("サーボのスピード・ストレッチの設定に失敗しました")  # 記録しないので、次の周期に送り直す
+
+    def start_position_poller(self, rate=50.0, servos=None, start_scheduler=True):
+        """
+        サーボの現在位置の読み込みをバックグラウンドで開始
+
+        Args:
+            rate (float): 1秒あたりの読み込み回数 (ICS番号の近いサーボはまとめて1回で読む)
+            servos (list): 読み込むServoJsonのリスト (Noneで全サーボ)
+            start_scheduler (bool): 読み込みが角度指令を遅らせないよう、RCB4の優先度付きスケジューラを開始するか
+                (すでに動いていればそのまま使う。開始したスケジューラはstop_position_pollerでは止めず、
+                以後の送受信はすべてスケジューラを通る。Falseのときは角度指令と読み込みが先着順になる)
+
+        Returns:
+            bool: 開始できたらTrue
+        """
+        if not self.is_connected or self.position_poller is not None:
+            return False
+        if start_scheduler and not self.use_scheduler:
+            self.use_scheduler = self.rcb4.startScheduler()
+        if servos is None:
+            servos = list(SERVO_IDS)
+        ics_nums = [Rcb4BaseLib.icsNum2id(*SERVO_IDS[servo]) for servo in servos]
+        self.position_poller = Rcb4BaseLib.PositionPoller(self.rcb4, ics_nums, rate)
+        self.position_poller.start()
+        return True
+
+    def stop_position_poller(self):
+        """サーボの現在位置の読み込みを停止"""
+        if self.position_poller is not None:
+            self.position_poller.stop()
+            self.position_poller = None
+
+    def get_measured_positions(self):
+        """
+        最新のサーボの現在位置を取得 (ロックなし)
+
+        Returns:
+            numpy.ndarray: ICS番号を添字とした現在位置 (未取得は-1)
+        """
+        if self.position_poller is None:
+            return np.full(Rcb4BaseLib.IcsDeviceSize, -1, dtype=np.int32)
+        return self.position_poller.Positions
+
+    def get_tracking_error(self):
+        """
+        指令ポジションと現在位置の差を取得
+
+        Returns:
+            dict: {ServoJson: 現在位置 - 指令ポジション} (どちらかが未取得のサーボは含まない)
+        """
+        measured = self.get_measured_positions()
+        errors = {}
+        for servo, (servo_id, sio) in SERVO_IDS.items():
+            ics = Rcb4BaseLib.icsNum2id(servo_id, sio)
+            if measured[ics] >= 0 and self.commanded_positions[ics] >= 0:
+                errors[servo] = int(measured[ics] - self.commanded_positions[ics])
+        return errors
+
+    def _on_frame_ack(self, future, ics_nums=None):
+        """
+        パイプライン送信したサーボフレームのACK結果を受け取る
+
+        Args:
+            future (Future): synchronizeAckPipelinedの結果
+            ics_nums (np.ndarray): 失敗したときにcommanded_positionsを未指令(-1)に戻すICS番号 (Noneで戻さない)
+        """
+        if not future.result():
+            if ics_nums is not None:
+                self.commanded_positions[ics_nums] = -1
+            self.frame_error_count += 1
+            print(f"複数サーボの移動に失敗しました (累計{self.frame_error_count}回)")
+
+    def get_frame_template(self, servo_keys):
+        """
+        サーボの組み合わせに対応するConstFrameServoのひな形を取得
+
+        Args:
+            servo_keys (tuple): ((servo_id, sio), ...) のタプル
+
+        Returns:
+            Rcb4BaseLib.ConstFrameTemplate: ひな形 (指定が不正な場合はNone)
+        """
+        template = self.frame_templates.get(servo_keys)
+        if template is None:
+            servo_data_list = [self.rcb4.ServoData(servo_id, sio, 0) for servo_id, sio in servo_keys]
+            template = self.rcb4.compileConstFrameTemplate(servo_data_list)
+            if template is not None:
+                self.frame_templates[servo_keys] = template
+        return template
+
+    def apply_mixing_profile(self, profile):
+        """
+        ミキシングの設定(Rcb4BaseLib.MixingProfile)をまとめて切り替える
+
+        設定するサーボの範囲をボードから読み込み直し、今の値と違うbyteだけを書き込んでから読み込み直して確かめる。
+        失敗したときは切り替える前の設定に戻す。
+
+        Returns:
+            bool: 切り替えに成功したか
+        """
+        if not self.is_connected:
+            print("RCB4が接続されていません")
+            return False
+        if self.device_table is None:
+            self.device_table = Rcb4BaseLib.IcsDeviceTable()
+        if self.rcb4.applyMixingProfile(profile, self.device_table):
+            return True
+        rollback = self.rcb4.LastRollbackOk
+        if rollback is None:
+            print("ミキシングの切り替えに失敗しました (設定は変えていません)")
+        elif rollback:
+            print("ミキシングの切り替えに失敗したので、元の設定に戻しました")
+        else:
+            print("ミキシングの切り替えに失敗し、元の設定に戻せたか確かめられませんでした")
+        return False
+
     def set_servo_free(self, servo_id, sio):
         """サーボをフリー状態にする"""
         if not self.is_connected:
@@ -0,0 +1,63 @@
+# coding: UTF-8
+"""
+テスト共通のfixture
+
+Rcb4Emulator(ptyの疑似RCB4)にRcb4BaseLibをつないで、実機なしで送受信を確かめる。
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "RCB4Lib_for_Python_V100B", "Rcb4Lib"))
+
+serial = pytest.importorskip("serial")
+pytest.importorskip("pty")  # エミュレータはPOSIX専用
+
+from Rcb4BaseLib import Rcb4BaseLib
+from Rcb4Emulator import Rcb4Emulator
+
+
+@pytest.fixture
+def pty_serial(monkeypatch):
+    """ptyはパリティを設定できないので、Serialポートを開くときだけパリティなしにする"""
+    base = serial.Serial
+
+    class PtySerial(base):
+        def __init__(self, *args, **kwargs):
+            kwargs["parity"] = serial.PARITY_NONE
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(serial, "Serial", PtySerial)
+
+
+@pytest.fixture
+def emulator(pty_serial):
+    """起動したRcb4Emulator (emulator.Portにポート名)"""
+    emu = Rcb4Emulator()
+    emu.Port = emu.start()
+    yield emu
+    emu.stop()
+
+
+@pytest.fixture
+def rcb4(emulator):
+    """エミュレータにつないだRcb4BaseLib"""
+    rcb4 = Rcb4BaseLib()
+    assert rcb4.open(emulator.Port, 115200, 0.5)
+    yield rcb4
+    rcb4.close()
+
+
+def drop_replies(emulator, should_drop):
+    """should_drop(cmd)がTrueになったコマンドには返信しないようにする"""
+    handle = emulator.handleCommand
+
+    def handle_command(cmd):
+        if should_drop(cmd):
+            return None
+        return handle(cmd)
+
+    emulator.handleCommand = handle_command
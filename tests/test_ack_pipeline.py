@@ -0,0 +1,71 @@
+# coding: UTF-8
+"""AckPipelineの送受信のテスト"""
+import threading
+
+from Rcb4BaseLib import Rcb4BaseLib
+
+from conftest import drop_replies
+
+RAM_TEST_ADDR = 0x0400  # テストで書き換えるRAMのアドレス (ボードの動作に使われていない場所)
+
+
+def read_cmd(addr, size):
+    """RAM=>COMの(送信データ, 受信データ数)"""
+    rx_len, tx_buf = Rcb4BaseLib.moveRamToComCmd(addr, size)
+    return tx_buf, rx_len
+
+
+def test_pipelined_replies_resolve_in_send_order(rcb4, emulator):
+    emulator.Ram[RAM_TEST_ADDR:RAM_TEST_ADDR + 16] = bytes(range(16))
+    rcb4.startPipeline(4)
+
+    futures = [rcb4.synchronizePipelined(*read_cmd(RAM_TEST_ADDR + i, 1)) for i in range(16)]
+
+    assert [future.result(timeout=2)[2] for future in futures] == list(range(16))
+
+
+def test_pipeline_write_failure_fails_pending_once_and_recovers(rcb4, monkeypatch):
+    errors = []
+    monkeypatch.setattr(threading, "excepthook", lambda args: errors.append(args.exc_value))
+    rcb4.startPipeline(4)
+    _, ack = Rcb4BaseLib.acknowledgeCmd()
+    write = rcb4.com.write
+    calls = []
+
+    def unplug_third_write(data):
+        calls.append(data)
+        if len(calls) == 3:
+            raise OSError("unplugged")
+        return write(data)
+
+    monkeypatch.setattr(rcb4.com, "write", unplug_third_write)
+    results = [rcb4.synchronizeAckPipelined(ack) for _ in range(5)]
+    results = [future.result(timeout=2) for future in results]
+
+    assert results[2] is False  # 書き込みに失敗したコマンド
+    assert results[3:] == [True, True]  # 後から送ったものは返信を受け取れる
+    again = [rcb4.synchronizeAckPipelined(ack) for _ in range(8)]
+    assert [future.result(timeout=2) for future in again] == [True] * 8
+    assert errors == []
+
+
+def test_pipeline_lost_reply_fails_pending_and_recovers(rcb4, emulator):
+    emulator.Ram[RAM_TEST_ADDR:RAM_TEST_ADDR + 4] = bytes(range(4))
+    lost = bytes(read_cmd(RAM_TEST_ADDR + 3, 1)[0])  # 同じ長さの返信は区別できないので最後のものを落とす
+    drops = []
+
+    def drop_once(cmd):
+        if bytes(cmd) == lost and not drops:
+            drops.append(cmd)
+            return True
+        return False
+
+    drop_replies(emulator, drop_once)
+    rcb4.startPipeline(4)
+    futures = [rcb4.synchronizePipelined(*read_cmd(RAM_TEST_ADDR + i, 1)) for i in range(4)]
+    results = [future.result(timeout=2) for future in futures]
+
+    assert [rxbuf[2] for rxbuf in results[:3]] == [0, 1, 2]
+    assert len(results[3]) == 0  # 返信がなかったコマンド
+    again = [rcb4.synchronizePipelined(*read_cmd(RAM_TEST_ADDR + i, 1)) for i in range(4)]
+    assert [future.result(timeout=2)[2] for future in again] == [0, 1, 2, 3]
@@ -0,0 +1,48 @@
+# coding: UTF-8
+"""両腕の関節角度の計算(calc_both_arm_angles)のテスト"""
+import math
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from servo_controller import RcbServoController
+
+
+@pytest.fixture
+def controller(emulator):
+    controller = RcbServoController(emulator.Port)
+    yield controller
+    controller.disconnect()
+
+
+def test_matches_the_single_arm_calculation(controller):
+    rng = np.random.default_rng(1)
+    arms = rng.uniform(-1.0, 1.0, (2, 3, 3))
+
+    angles = controller.calc_both_arm_angles(arms.tolist())
+
+    for arm, arm_angles in zip(arms, angles):
+        assert arm_angles == pytest.approx(controller.calc_arm_angles(*arm))
+
+
+@pytest.mark.parametrize("arm, elbow", [
+    (((0, 0, 0), (0, 0, 0), (0, 0, 0)), 0.0),  # 関節がない(全部原点)
+    (((0, 0, 0), (0, 0, 0), (0.3, 0, 0)), 0.0),  # 上腕の長さが0
+    (((0, 0, 0), (0.1, 0.2, 0.3), (0.2, 0.4, 0.6)), 0.0),  # 伸びきっている(acosの引数が1を超えることがある)
+    (((0, 0, 0), (0.1, 0.2, 0.3), (0.0, 0.0, 0.0)), 180.0),  # 折りたたんでいる
+    (((0, 0, 0), (0.3, 0, 0), (0.3, 0.3, 0)), 90.0),
+])
+def test_degenerate_arms_give_finite_clipped_angles(controller, arm, elbow):
+    angles = controller.calc_both_arm_angles([arm, arm])
+
+    for pitch, yaw, elbow_angle in angles:
+        assert all(math.isfinite(a) for a in (pitch, yaw, elbow_angle))
+        assert -180.0 <= pitch <= 180.0 and -90.0 <= yaw <= 90.0
+        assert elbow_angle == pytest.approx(elbow, abs=1e-3)  # ARM_IK_EPSILON分のずれは残る
+
+
+def test_single_arm_calculation_clips_an_extended_arm(controller):
+    upper, lower = np.array([0.0, 0.0, 0.0]), np.array([0.1, 0.2, 0.3])
+    for scale in (2.0, 3.0, 7.0):  # 誤差でacosの引数が範囲外になっても例外にしない
+        assert controller.calc_arm_angles(upper, lower, lower * scale / (scale - 1.0))[2] == pytest.approx(0.0, abs=1e-5)
@@ -0,0 +1,63 @@
+# coding: UTF-8
+"""AsyncRcb4(asyncio版の送受信)のテスト"""
+import asyncio
+
+from Rcb4AsyncLib import AsyncRcb4
+from Rcb4BaseLib import Rcb4BaseLib
+
+from conftest import drop_replies
+
+RAM_TEST_ADDR = 0x0400  # テストで書き換えるRAMのアドレス (ボードの動作に使われていない場所)
+
+
+def run_with_board(emulator, body):
+    """AsyncRcb4をエミュレータにつないでbody(rcb4)を実行する"""
+    async def main():
+        rcb4 = AsyncRcb4()
+        assert await rcb4.open(emulator.Port, 115200, 0.5)
+        try:
+            return await body(rcb4)
+        finally:
+            rcb4.close()
+
+    return asyncio.run(main())
+
+
+def test_concurrent_reads_are_serialized(emulator):
+    emulator.Ram[RAM_TEST_ADDR:RAM_TEST_ADDR + 8] = bytes(range(10, 18))
+
+    async def body(rcb4):
+        return await asyncio.gather(*(rcb4.moveRamToComCmdSynchronize(RAM_TEST_ADDR + i, 1) for i in range(8)))
+
+    results = run_with_board(emulator, body)
+
+    assert [(retf, data[0]) for retf, data in results] == [(True, 10 + i) for i in range(8)]
+
+
+def test_batch_write_and_missing_reply(emulator):
+    unplugged = []
+    drop_replies(emulator, lambda cmd: len(unplugged) > 0)
+
+    async def body(rcb4):
+        writes = [Rcb4BaseLib.moveComToRamCmd(RAM_TEST_ADDR + i, [i + 1])[1] for i in range(3)]
+        ok = await rcb4.synchronizeAckBatch(writes)
+        unplugged.append(True)
+        lost = await rcb4.checkAcknowledge()
+        unplugged.clear()
+        return ok, lost, await rcb4.checkAcknowledge()
+
+    assert run_with_board(emulator, body) == (True, False, True)
+    assert emulator.Ram[RAM_TEST_ADDR:RAM_TEST_ADDR + 3] == b"\x01\x02\x03"
+
+
+def test_motion_play_and_play_num(emulator):
+    emulator.motionDuration = {2: 0.1}
+
+    async def body(rcb4):
+        played = await rcb4.motionPlay(2)
+        playing = await rcb4.getMotionPlayNum()
+        await asyncio.sleep(0.15)
+        return played, playing, await rcb4.getMotionPlayNum()
+
+    assert run_with_board(emulator, body) == (True, 2, 0)
+
@@ -0,0 +1,47 @@
+# coding: UTF-8
+"""通信速度の切り替えと探索のテスト"""
+import json
+
+from Rcb4BaseLib import Rcb4BaseLib
+
+ACK = Rcb4BaseLib.CommandTypes.AckCheck.value
+
+
+def test_probe_switches_to_the_fastest_rate_and_records_it(emulator, tmp_path):
+    cache = tmp_path / "baudrate.json"
+    rcb4 = Rcb4BaseLib()
+    try:
+        assert rcb4.open(emulator.Port, 115200, 0.5, probe=True, cacheFile=str(cache))
+        fastest = Rcb4BaseLib.ComBaudrates[0][0]
+        assert rcb4.com.baudrate == fastest
+        assert emulator.boardBaudrate() == fastest
+        assert rcb4.checkAcknowledge()
+    finally:
+        rcb4.close()
+    assert json.loads(cache.read_text()) == {emulator.Port: fastest}
+
+    # 次は記録した速度から試すので、1回目のACKで見つかる
+    emulator.CommandCounts.clear()
+    rcb4 = Rcb4BaseLib()
+    try:
+        assert rcb4.open(emulator.Port, 115200, 0.5, probe=True, cacheFile=str(cache))
+        assert rcb4.com.baudrate == fastest
+    finally:
+        rcb4.close()
+    assert emulator.CommandCounts[ACK] == 1
+
+
+def test_open_without_probe_fails_at_the_wrong_rate(emulator, rcb4):
+    assert rcb4.setBaudrate(625000)
+    assert emulator.boardBaudrate() == 625000
+    rcb4.close()
+
+    other = Rcb4BaseLib()
+    assert not other.open(emulator.Port, 115200, 0.1)
+    other.close()
+
+
+def test_set_baudrate_rejects_unsupported_rates(rcb4, emulator):
+    assert not rcb4.setBaudrate(57600)
+    assert rcb4.com.baudrate == 115200
+    assert emulator.boardBaudrate() == 115200
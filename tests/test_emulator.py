@@ -0,0 +1,51 @@
+# coding: UTF-8
+"""Rcb4Emulator自体のテスト"""
+import struct
+import time
+
+from Rcb4BaseLib import Rcb4BaseLib
+from Rcb4Emulator import Rcb4Emulator
+
+
+def test_handle_command_acks_and_drops_bad_checksum():
+    emulator = Rcb4Emulator()
+    _, ack = Rcb4BaseLib.acknowledgeCmd()
+
+    reply = emulator.handleCommand(bytes(ack))
+    assert reply[2] == Rcb4BaseLib.AckType.Ack.value
+    assert reply[3] == Rcb4BaseLib.CheckSum(reply)
+
+    broken = bytearray(ack)
+    broken[-1] ^= 0xFF
+    assert emulator.handleCommand(bytes(broken)) is None
+    assert emulator.DroppedBytes == len(broken)
+
+
+def test_ram_round_trip_over_pty(rcb4, emulator):
+    assert rcb4.moveComToRamCmdSynchronize(0x0400, [1, 2, 3, 4])
+    assert emulator.Ram[0x0400:0x0404] == b"\x01\x02\x03\x04"
+
+    retf, data = rcb4.moveRamToComCmdSynchronize(0x0400, 4)
+    assert retf
+    assert list(data) == [1, 2, 3, 4]
+
+
+def test_servo_moves_over_frames(rcb4, emulator):
+    addr = Rcb4BaseLib.icsDeviceAddr(2) + Rcb4BaseLib.DeviceAddrOffset.MotorPositionAddressOffset.value
+    emulator.framePeriod = 0.02
+    assert rcb4.setSingleServo(1, 1, 9500, 10)  # ICS番号2 (0.2秒かけて動く)
+
+    time.sleep(0.05)
+    assert rcb4.getSinglePos(1, 1)[0]
+    assert 7500 < struct.unpack_from("<h", emulator.Ram, addr)[0] < 9500
+    time.sleep(0.25)
+    assert rcb4.getSinglePos(1, 1)[1] == 9500
+
+
+def test_motion_stops_after_duration(rcb4, emulator):
+    emulator.motionDuration = {3: 0.1}
+    assert rcb4.motionPlay(3)
+    assert rcb4.getMotionPlayNum() == 3
+
+    time.sleep(0.15)
+    assert rcb4.getMotionPlayNum() == 0
@@ -0,0 +1,77 @@
+# coding: UTF-8
+"""指令速度から決めるスピード・ストレッチの送信のテスト"""
+import time
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from Rcb4BaseLib import Rcb4BaseLib
+import servo_controller
+from servo_controller import RcbServoController
+
+from conftest import drop_replies
+
+PARAM = Rcb4BaseLib.CommandTypes.ServoParam.value
+SPEED, STRETCH = 2, 1  # ServoParamのパラメータ番号
+ARM = [(1, 1, -90, -180, 180), (2, 1, 90, 0, 180)]
+ICS = [Rcb4BaseLib.icsNum2id(servo_id, sio) for servo_id, sio, *_ in ARM]
+
+
+def swung(offset):
+    return [(servo_id, sio, angle + offset, low, high) for servo_id, sio, angle, low, high in ARM]
+
+
+def params(emulator, param):
+    return [emulator.ServoParams.get(ics, {}).get(param) for ics in ICS]
+
+
+@pytest.fixture
+def controller(emulator):
+    controller = RcbServoController(emulator.Port, gain_schedule_interval=0.0)
+    # 接続時のTポーズで送った分は忘れて、未送信の状態から始める
+    controller.sent_speeds[:] = 0
+    controller.sent_stretches[:] = 0
+    controller.joint_velocities[:] = 0.0
+    controller.last_targets[:] = -1.0
+    emulator.ServoParams.clear()
+    yield controller
+    controller.disconnect()
+
+
+def test_rest_gains_are_sent_once(controller, emulator):
+    emulator.CommandCounts.clear()
+    assert controller.move_multiple_servos(ARM, 5)
+    assert controller.move_multiple_servos(ARM, 5)
+
+    assert emulator.CommandCounts[PARAM] == 2  # スピードとストレッチを1回ずつ
+    assert params(emulator, SPEED) == [servo_controller.GAIN_SCHEDULE_REST[0]] * 2
+    assert params(emulator, STRETCH) == [servo_controller.GAIN_SCHEDULE_REST[1]] * 2
+
+
+def test_fast_motion_raises_gains(controller, emulator):
+    for i in range(10):
+        assert controller.move_multiple_servos(swung(30 if i % 2 else -30), 5)
+        time.sleep(0.005)
+
+    assert all(speed > servo_controller.GAIN_SCHEDULE_REST[0] for speed in params(emulator, SPEED))
+    assert all(stretch > servo_controller.GAIN_SCHEDULE_REST[1] for stretch in params(emulator, STRETCH))
+
+
+def test_lost_gain_ack_is_resent(controller, emulator):
+    lost = []
+
+    def lose_first_param(cmd):
+        if cmd[1] == PARAM and not lost:
+            lost.append(cmd)
+            return True
+        return False
+
+    drop_replies(emulator, lose_first_param)
+    assert controller.move_multiple_servos(ARM, 5)
+    assert (controller.sent_speeds[ICS] == 0).all()  # 記録しないので次の周期に送り直す
+
+    emulator.CommandCounts.clear()
+    assert controller.move_multiple_servos(ARM, 5)
+    assert emulator.CommandCounts[PARAM] == 1
+    assert controller.sent_speeds[ICS].tolist() == [servo_controller.GAIN_SCHEDULE_REST[0]] * 2
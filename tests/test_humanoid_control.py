@@ -0,0 +1,136 @@
+# coding: UTF-8
+"""humanoid_control(複数ロボットへの一定周期の送信)のテスト"""
+import queue
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import humanoid_control
+from servo_controller import RcbServoController
+
+
+def wait_until(condition, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def controller(emulator):
+    controller = RcbServoController(emulator.Port)
+    assert controller.is_connected
+    yield controller
+    controller.disconnect()
+
+
+def start_loop(controller, command_queue, status, period=0.01):
+    stop_event = threading.Event()
+    thread = threading.Thread(target=humanoid_control.servo_transmit_loop,
+                              args=(controller, command_queue, stop_event, period, True, status))
+    thread.start()
+    return stop_event, thread
+
+
+def test_send_error_disconnects_and_reconnects_the_robot(controller, monkeypatch):
+    monkeypatch.setattr(humanoid_control, "RECONNECT_INTERVAL", 0.05)
+    applied = []
+
+    def apply_servo_command(command, frame_time, is_motion_play):
+        if command == "unplugged":
+            raise OSError("unplugged")
+        applied.append(command)
+
+    controller.apply_servo_command = apply_servo_command
+    command_queue = queue.Queue(maxsize=1)
+    status = {}
+    stop_event, thread = start_loop(controller, command_queue, status)
+    try:
+        humanoid_control.put_latest(command_queue, (1, "unplugged"))
+        wait_until(lambda: status["errors"] == 1)
+        assert isinstance(status["last_error"], OSError)
+
+        wait_until(lambda: status["connected"] and controller.is_connected)
+        humanoid_control.put_latest(command_queue, (2, "pose"))
+        wait_until(lambda: status.get("sequence") == 2)
+        assert applied == ["pose"]
+        assert thread.is_alive()
+    finally:
+        stop_event.set()
+        thread.join(timeout=1.0)
+
+
+class SlowRobot:
+    """送信にsend_time秒かかるロボット (周期の記録だけを確かめる)"""
+
+    is_connected = True
+    com_port = "slow"
+
+    def __init__(self, send_time=0.0):
+        self.send_time = send_time
+        self.frame_times = []
+
+    def frames_for_period(self, period):
+        return 3
+
+    def apply_servo_command(self, command, frame_time, is_motion_play):
+        self.frame_times.append(frame_time)
+        time.sleep(self.send_time)
+
+
+def test_queue_keeps_only_the_latest_command():
+    command_queue = queue.Queue(maxsize=1)
+    for sequence in range(1, 4):
+        humanoid_control.put_latest(command_queue, (sequence, {}))
+
+    assert humanoid_control.take_latest(command_queue) == (3, {})
+    assert humanoid_control.take_latest(command_queue) is None
+
+
+def test_loop_sends_on_a_fixed_period_only_when_a_command_arrived():
+    robot = SlowRobot()
+    command_queue = queue.Queue(maxsize=1)
+    status = {}
+    stop_event, thread = start_loop(robot, command_queue, status, period=0.02)
+    try:
+        humanoid_control.put_latest(command_queue, (1, {}))
+        time.sleep(0.2)
+    finally:
+        stop_event.set()
+        thread.join(timeout=1.0)
+
+    stats = status["cadence"]
+    assert 7 <= stats.ticks <= 12
+    assert stats.sent == 1 and robot.frame_times == [3]
+    assert status["sequence"] == 1
+    assert stats.jitter_max < 0.02
+
+
+def test_overrun_skips_the_missed_ticks():
+    robot = SlowRobot(send_time=0.05)
+    command_queue = queue.Queue(maxsize=1)
+    status = {}
+    stop_event, thread = start_loop(robot, command_queue, status, period=0.02)
+    try:
+        for sequence in range(1, 4):
+            humanoid_control.put_latest(command_queue, (sequence, {}))
+            time.sleep(0.06)
+    finally:
+        stop_event.set()
+        thread.join(timeout=1.0)
+
+    stats = status["cadence"]
+    assert stats.overruns >= 2
+    assert stats.skipped_ticks >= 2 * stats.overruns  # 0.05秒の送信で予定の時刻を2つ以上過ぎる
+    assert stats.jitter_max < 0.02  # 飛ばした後は次の予定の時刻に合わせ直す
+
+
+def test_alignment_is_checked_against_the_received_sequence():
+    received = {"sequence": 40}
+    statuses = [{"sequence": 40, "connected": True}, {"sequence": 25, "connected": True},
+                {"sequence": 39, "connected": False}]
+
+    assert humanoid_control.check_alignment(statuses, received) == [0, 15, None]
@@ -0,0 +1,56 @@
+# coding: UTF-8
+"""IcsDeviceTable(ICSデバイスのデータの写し)のテスト"""
+import struct
+
+from Rcb4BaseLib import Rcb4BaseLib
+
+ICS_BASE = Rcb4BaseLib.RamAddr.IcsDeviceRamAddress.value
+ICS_SIZE = Rcb4BaseLib.IcsDeviceDataSize
+
+
+def ics_record(emulator, ics_num):
+    """エミュレータのRAM上のICSデバイスのデータ"""
+    start = ICS_BASE + ics_num * ICS_SIZE
+    return bytes(emulator.Ram[start:start + ICS_SIZE])
+
+
+def test_plan_merges_small_gaps_and_skips_unchanged_bytes():
+    table = Rcb4BaseLib.IcsDeviceTable(maxGap=4)
+    table.setTrim(3, -20)
+    table.setMixGain(3, 1, 10)
+    table.resetMixing(3, 2)  # ミキシング1の倍率のすぐ後ろなので一緒に書き込む
+    table.setTrim(5, 0)  # 今の値と同じなので書き込まない
+
+    assert table.plan() == [
+        (3, 0x02, struct.pack("<h", -20)),
+        (3, 0x10, bytes([10, 0xFF, 0xFF])),
+    ]
+
+
+def test_apply_writes_only_changes_and_marks_clean(rcb4, emulator):
+    table = Rcb4BaseLib.IcsDeviceTable()
+    assert rcb4.loadIcsDeviceTable(table)
+    for ics_num in range(4):
+        table.setTrim(ics_num, ics_num * 3 - 5)
+    before = emulator.CommandCounts.get(Rcb4BaseLib.CommandTypes.Move.value, 0)
+
+    assert rcb4.applyIcsDeviceTable(table)
+
+    assert emulator.CommandCounts[Rcb4BaseLib.CommandTypes.Move.value] - before == 4
+    assert not table.isDirty()
+    assert [ics_record(emulator, n) for n in range(4)] == [bytes(table.record(n)) for n in range(4)]
+    assert rcb4.applyIcsDeviceTable(table)  # 変更がなければ何も送らない
+    assert emulator.CommandCounts[Rcb4BaseLib.CommandTypes.Move.value] - before == 4
+
+
+def test_load_reads_the_whole_table_in_blocks(rcb4, emulator):
+    emulator.Ram[ICS_BASE:ICS_BASE + 35 * ICS_SIZE] = bytes(i & 0xFF for i in range(35 * ICS_SIZE))
+    table = Rcb4BaseLib.IcsDeviceTable()
+    move = Rcb4BaseLib.CommandTypes.Move.value
+    before = emulator.CommandCounts.get(move, 0)
+
+    assert rcb4.loadIcsDeviceTable(table)
+
+    assert emulator.CommandCounts[move] - before == 3  # 700byteをRamSnapshot.MaxBlockSizeずつ
+    assert [bytes(table.record(n)) for n in (0, 17, 34)] == [ics_record(emulator, n) for n in (0, 17, 34)]
+    assert not table.isDirty()
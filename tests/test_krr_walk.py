@@ -0,0 +1,78 @@
+# coding: UTF-8
+"""KRRの疑似ボタンによる歩行(walk_backend="krr")のテスト"""
+import pytest
+
+pytest.importorskip("numpy")
+
+from Rcb4BaseLib import Rcb4BaseLib
+from servo_controller import RcbServoController
+
+from conftest import drop_replies
+
+MOVE = Rcb4BaseLib.CommandTypes.Move.value
+KRR_ADDR = Rcb4BaseLib.RamAddr.KrrButtonDataAddress.value
+BUTTON = Rcb4BaseLib.KRR_BUTTON
+
+
+@pytest.fixture
+def controller(emulator):
+    controller = RcbServoController(emulator.Port, walk_backend="krr")
+    assert controller.is_connected
+    yield controller
+    controller.disconnect()
+
+
+def board_buttons(emulator):
+    return (emulator.Ram[KRR_ADDR] << 8) | emulator.Ram[KRR_ADDR + 1]
+
+
+def writes(emulator, before):
+    return emulator.CommandCounts.get(MOVE, 0) - before
+
+
+def test_buttons_are_written_only_when_they_change(controller, emulator):
+    before = emulator.CommandCounts.get(MOVE, 0)
+
+    for _ in range(5):
+        assert controller.hold_walk(["forward"])
+    assert writes(emulator, before) == 1
+    assert board_buttons(emulator) == BUTTON.UP.value
+
+    assert controller.hold_walk(["forward", "right"])
+    assert controller.hold_walk(["right", "forward"])
+    assert writes(emulator, before) == 2
+    assert board_buttons(emulator) == BUTTON.UP.value | BUTTON.RIGHT.value
+
+    assert controller.hold_walk(["forward", "back", "left"])  # 逆向きの組は押さない
+    assert board_buttons(emulator) == BUTTON.LEFT.value
+
+    assert controller.release_walk()
+    assert controller.release_walk()
+    assert writes(emulator, before) == 4
+    assert board_buttons(emulator) == BUTTON.NONE.value
+
+
+def test_failed_write_is_retried_on_the_next_call(controller, emulator):
+    drop_replies(emulator, lambda cmd: cmd[1] == MOVE)
+    assert not controller.hold_walk(["back"])
+    assert controller.krr_buttons is None
+
+    del emulator.handleCommand  # 返信を落とすのをやめる
+    before = emulator.CommandCounts.get(MOVE, 0)
+    assert controller.hold_walk(["back"])
+    assert writes(emulator, before) == 1
+    assert board_buttons(emulator) == BUTTON.DOWN.value
+
+
+def test_walk_motion_holds_the_direction_buttons(controller, emulator):
+    hip, foot = (0.0, 0.0, 0.0), (0.5, 0.0, 0.0)  # 足が前に出ている
+    before = emulator.CommandCounts.get(MOVE, 0)
+
+    assert controller.walk_motion(hip, foot, hip, foot)
+    assert controller.walk_motion(hip, foot, hip, foot)
+
+    assert writes(emulator, before) == 1
+    assert board_buttons(emulator) == BUTTON.UP.value
+
+    controller.disconnect()  # 切断するときはボタンを離す
+    assert board_buttons(emulator) == BUTTON.NONE.value
@@ -0,0 +1,108 @@
+# coding: UTF-8
+"""MixingProfile(ミキシングの設定のまとめての切り替え)のテスト"""
+import os
+
+import pytest
+
+from Rcb4BaseLib import Rcb4BaseLib
+
+from conftest import drop_replies
+
+ICS_BASE = Rcb4BaseLib.RamAddr.IcsDeviceRamAddress.value
+ICS_SIZE = Rcb4BaseLib.IcsDeviceDataSize
+
+
+def ics_record(emulator, ics_num):
+    """エミュレータのRAM上のICSデバイスのデータ"""
+    start = ICS_BASE + ics_num * ICS_SIZE
+    return bytes(emulator.Ram[start:start + ICS_SIZE])
+
+
+def is_device_write(cmd):
+    return cmd[1] == Rcb4BaseLib.CommandTypes.Move.value and cmd[2] == Rcb4BaseLib.SubMoveCmd.ComToDevice.value
+
+
+def walk_profile():
+    profile = Rcb4BaseLib.MixingProfile()
+    for servo_id in range(4, 9):
+        profile.ramAddr(servo_id, 1, 1, 0x0462, 20 + servo_id)
+        profile.off(servo_id, 1, 2)
+    return profile
+
+
+def test_apply_mixing_profile_rereads_board_before_diffing(rcb4, emulator):
+    profile = Rcb4BaseLib.MixingProfile()
+    profile.ramAddr(4, 1, 1, 0x0462, 20)
+    table = Rcb4BaseLib.IcsDeviceTable()
+    assert rcb4.applyMixingProfile(profile, table) is True
+    assert rcb4.LastRollbackOk is None
+
+    # ほかのところでミキシングが切られても、読み込み直して書き直す
+    assert rcb4.resetServoMixing(4, 1, 1)
+    assert rcb4.applyMixingProfile(profile, table) is True
+    assert profile.mismatches(table) == []
+
+
+def test_apply_mixing_profile_rolls_back_when_a_write_is_lost(rcb4, emulator):
+    emulator.Ram[ICS_BASE:ICS_BASE + 20 * ICS_SIZE] = os.urandom(20 * ICS_SIZE)
+    profile = walk_profile()
+    ics_nums = profile.icsNums()
+    before = [ics_record(emulator, n) for n in ics_nums]
+    writes = []
+
+    def ignore_second_write(cmd):
+        if is_device_write(cmd):
+            writes.append(cmd)
+            return len(writes) == 2
+        return False
+
+    drop_replies(emulator, ignore_second_write)
+
+    assert rcb4.applyMixingProfile(profile, Rcb4BaseLib.IcsDeviceTable()) is False
+    assert rcb4.LastRollbackOk is True
+    assert [ics_record(emulator, n) for n in ics_nums] == before
+
+
+def drop_writes_after_the_first(emulator):
+    """最初の書き込みだけ通し、後は(元に戻す書き込みも)失敗させる"""
+    writes = []
+
+    def should_drop(cmd):
+        if is_device_write(cmd):
+            writes.append(cmd)
+            return len(writes) >= 2
+        return False
+
+    drop_replies(emulator, should_drop)
+
+
+def test_apply_mixing_profile_reports_an_unverified_rollback(rcb4, emulator):
+    emulator.Ram[ICS_BASE:ICS_BASE + 20 * ICS_SIZE] = os.urandom(20 * ICS_SIZE)
+    drop_writes_after_the_first(emulator)
+
+    assert rcb4.applyMixingProfile(walk_profile()) is False
+    assert rcb4.LastRollbackOk is False
+
+    # 何も書き込む前に失敗したときは戻す必要がない
+    del emulator.handleCommand
+    drop_replies(emulator, lambda cmd: True)
+    assert rcb4.applyMixingProfile(walk_profile()) is False
+    assert rcb4.LastRollbackOk is None
+
+
+def test_controller_reports_the_rollback(emulator, capsys):
+    pytest.importorskip("numpy")
+    from servo_controller import RcbServoController
+
+    controller = RcbServoController(emulator.Port)
+    try:
+        profile = walk_profile()
+        assert controller.apply_mixing_profile(profile)
+
+        emulator.Ram[ICS_BASE:ICS_BASE + 20 * ICS_SIZE] = os.urandom(20 * ICS_SIZE)
+        drop_writes_after_the_first(emulator)
+        assert not controller.apply_mixing_profile(profile)
+        assert "確かめられませんでした" in capsys.readouterr().out
+    finally:
+        del emulator.handleCommand
+        controller.disconnect()
@@ -0,0 +1,84 @@
+# coding: UTF-8
+"""Rcb4MotionRom(モーションROMのキャッシュ)のテスト"""
+import os
+
+import pytest
+
+from Rcb4BaseLib import Rcb4BaseLib
+from Rcb4MotionRom import Rcb4MotionRom
+
+SLOT_SIZE = Rcb4BaseLib.MotionSingleDataCount
+SLOTS = [1, 2, 3]
+
+
+def slot_addr(motion_num):
+    return Rcb4BaseLib.RomAddr.MotionRomAddress.value + (motion_num - 1) * SLOT_SIZE
+
+
+@pytest.fixture
+def rcb4(rcb4):
+    """ROMを何度も読むので一番速い通信速度にしておく"""
+    assert rcb4.setBaudrate(Rcb4BaseLib.ComBaudrates[0][0])
+    return rcb4
+
+
+def fill_slots(emulator):
+    for num in SLOTS:
+        emulator.Rom[slot_addr(num):slot_addr(num) + SLOT_SIZE] = os.urandom(SLOT_SIZE)
+
+
+def open_rom(rcb4, tmp_path, board_id="emulator"):
+    """board_id=Noneのときは設定データを読んでボードを識別する"""
+    rom = Rcb4MotionRom(rcb4, cacheDir=str(tmp_path), boardId=board_id)
+    assert rom.open()
+    return rom
+
+
+def test_second_refresh_reads_only_changed_slots(rcb4, emulator, tmp_path):
+    fill_slots(emulator)
+    rom = open_rom(rcb4, tmp_path)
+    assert rom.refresh(SLOTS) == SLOTS
+    assert rom.refresh(SLOTS) == []
+
+    emulator.Rom[slot_addr(2) + Rcb4MotionRom.ProbeStride] ^= 0xFF  # 調べるブロックの中
+    assert rom.refresh(SLOTS) == [2]
+    assert bytes(rom.slot(2)) == bytes(emulator.Rom[slot_addr(2):slot_addr(2) + SLOT_SIZE])
+    rom.close()
+
+    # 開き直してもキャッシュが使える
+    rom = open_rom(rcb4, tmp_path)
+    assert rom.refresh(SLOTS) == []
+    rom.close()
+
+
+def test_playing_slot_is_always_reread(rcb4, emulator, tmp_path):
+    fill_slots(emulator)
+    rom = open_rom(rcb4, tmp_path)
+    assert rom.refresh(SLOTS) == SLOTS
+    gap = slot_addr(3) + Rcb4MotionRom.ProbeSize + 10  # 調べるブロックの間
+
+    emulator.Rom[gap] ^= 0xFF
+    assert rom.refresh(SLOTS) == []  # 簡易的な判定なので、ブロックの間の変化は見落とす
+
+    emulator.motionDuration = {3: 5.0}
+    assert rcb4.motionPlay(3)
+    assert rom.refresh(SLOTS) == [3]
+    assert rom.slot(3)[gap - slot_addr(3)] == emulator.Rom[gap]
+    assert rom.refresh(SLOTS, full=True) == SLOTS
+    rom.close()
+
+
+def test_corrupted_cache_and_new_settings_are_detected(rcb4, emulator, tmp_path):
+    fill_slots(emulator)
+    rom = open_rom(rcb4, tmp_path, None)
+    assert rom.refresh(SLOTS) == SLOTS
+    path = rom.Path
+    rom.slot(1)[100] ^= 0xFF  # キャッシュファイル側の破損
+    assert rom.refresh(SLOTS) == [1]
+    rom.close()
+
+    emulator.Rom[0] ^= 0xFF  # 設定データが変わると別のボードとして扱う
+    rom = open_rom(rcb4, tmp_path, None)
+    assert rom.Path != path
+    assert rom.slot(1) is None
+    rom.close()
@@ -0,0 +1,75 @@
+# coding: UTF-8
+"""MotionWatcher(モーションの終了をFutureで受け取る)のテスト"""
+import time
+
+import pytest
+
+from Rcb4BaseLib import Rcb4BaseLib
+
+
+def test_future_resolves_when_the_motion_ends(rcb4, emulator):
+    emulator.motionDuration = {4: 0.2}
+    start = time.monotonic()
+
+    future = rcb4.motionPlayAsync(4)
+
+    assert future.result(timeout=2) is True
+    assert 0.2 <= time.monotonic() - start < 0.5
+    assert rcb4.motionDuration(4) == pytest.approx(0.2, abs=0.1)
+
+
+def test_other_reads_of_the_program_counter_feed_the_watch(rcb4, emulator, monkeypatch):
+    monkeypatch.setattr(Rcb4BaseLib.MotionWatcher, "SlowInterval", 10.0)
+    emulator.motionDuration = {4: 0.1}
+    future = rcb4.motionPlayAsync(4, duration=10.0)  # 推定が長いので見張りはまだ読み込まない
+    time.sleep(0.15)
+    assert not future.done()
+
+    assert rcb4.getMotionPlayNum() == 0
+    assert future.result(timeout=0.05) is True
+
+
+def test_end_on_other_resolves_when_another_motion_starts(rcb4, emulator):
+    emulator.motionDuration = {4: 5.0, 6: 5.0}
+    waiting = rcb4.motionPlayAsync(4)
+    switching = rcb4.watchMotion(4, endOnOther=True)
+    assert switching is waiting  # 同じモーションには同じFuture
+
+    assert rcb4.motionPlay(6)
+    assert waiting.result(timeout=1) is True
+
+
+def test_read_exception_fails_pending_watches(rcb4, emulator, monkeypatch):
+    emulator.motionDuration = {4: 5.0}
+    assert rcb4.motionPlay(4)
+
+    def unplugged():
+        raise OSError("unplugged")
+
+    monkeypatch.setattr(rcb4, "getMotionPlayNum", unplugged)
+    future = rcb4.watchMotion(4)
+
+    assert future.result(timeout=1) is False
+    monkeypatch.undo()
+    emulator.motionDuration = {5: 0.05}
+    assert rcb4.motionPlayAsync(5).result(timeout=1) is True  # 見張りのスレッドは動き続けている
+
+
+def test_controller_wait_motion_times_out_from_the_duration_estimate(emulator, monkeypatch):
+    pytest.importorskip("numpy")
+    import servo_controller
+    from servo_controller import RcbServoController
+
+    controller = RcbServoController(emulator.Port)
+    try:
+        emulator.motionDuration = {5: 0.1}
+        assert controller.wait_motion(controller.play_motion_async(5), 5)
+
+        # 推定の0.1秒から決めた待ち時間を過ぎても終わらなければFalse
+        monkeypatch.setattr(servo_controller, "MOTION_TIMEOUT_MARGIN", 0.1)
+        emulator.motionDuration = {5: 5.0}
+        start = time.monotonic()
+        assert not controller.wait_motion(controller.play_motion_async(5), 5)
+        assert time.monotonic() - start < 1.0
+    finally:
+        controller.disconnect()
@@ -0,0 +1,61 @@
+# coding: UTF-8
+"""まとめた現在位置の読み込みとPositionPollerのテスト"""
+import struct
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from Rcb4BaseLib import Rcb4BaseLib
+
+POS_OFFSET = Rcb4BaseLib.DeviceAddrOffset.MotorPositionAddressOffset.value
+
+
+def set_position(emulator, ics_num, pos):
+    struct.pack_into("<h", emulator.Ram, Rcb4BaseLib.icsDeviceAddr(ics_num) + POS_OFFSET, pos)
+
+
+def wait_until(condition, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end
+        time.sleep(0.01)
+
+
+def test_multi_pos_reads_nearby_servos_in_one_block(rcb4, emulator):
+    for ics_num in (2, 3, 5, 30):
+        set_position(emulator, ics_num, 7000 + ics_num)
+    move = Rcb4BaseLib.CommandTypes.Move.value
+    before = emulator.CommandCounts.get(move, 0)
+
+    retf, positions = rcb4.getMultiPos([2, 3, 5, 30])
+
+    assert retf
+    assert [positions[n] for n in (2, 3, 5, 30)] == [7002, 7003, 7005, 7030]
+    assert positions[4] == -1  # 読み込んでいないICS番号
+    assert emulator.CommandCounts[move] - before == 2
+
+
+def test_poller_keeps_running_after_a_read_error(rcb4, emulator, monkeypatch):
+    set_position(emulator, 4, 8100)
+    read = rcb4.readIcsPosBlock
+    calls = []
+
+    def unplugged_twice(first, last):
+        calls.append(first)
+        if len(calls) <= 2:
+            raise OSError("unplugged")
+        return read(first, last)
+
+    monkeypatch.setattr(rcb4, "readIcsPosBlock", unplugged_twice)
+    poller = Rcb4BaseLib.PositionPoller(rcb4, [4], rate=100.0)
+    poller.start()
+    try:
+        wait_until(lambda: poller.Positions[4] == 8100)
+    finally:
+        poller.stop()
+
+    assert poller.ErrorCount == 2
+    assert isinstance(poller.LastError, OSError)
+    assert poller.Timestamps[4] > 0
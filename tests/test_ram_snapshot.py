@@ -0,0 +1,46 @@
+# coding: UTF-8
+"""RamSnapshotのテスト"""
+import struct
+
+from Rcb4BaseLib import Rcb4BaseLib
+
+ADDR_COUNTER = Rcb4BaseLib.RamSnapshot.Fields["counter"][0]
+ADDR_PARAMETER = Rcb4BaseLib.RamSnapshot.Fields["userParameter"][0]
+
+
+def test_fields_are_merged_into_as_few_blocks_as_possible():
+    snapshot = Rcb4BaseLib.RamSnapshot(["pio", "config", "adc", "programCounter", "counter", "userParameter"])
+
+    # 0x0000-0x003Bは隙間が小さいので1回、ユーザカウンタとユーザ変数も1回
+    assert snapshot.Blocks == [(0x0000, 0x003C, 0), (ADDR_COUNTER, ADDR_PARAMETER + 40 - ADDR_COUNTER, 0x003C)]
+
+
+def test_read_decodes_typed_values(rcb4, emulator):
+    emulator.Ram[ADDR_COUNTER:ADDR_COUNTER + 10] = bytes(range(1, 11))
+    struct.pack_into("<20h", emulator.Ram, ADDR_PARAMETER, *range(-10, 10))
+    snapshot = Rcb4BaseLib.RamSnapshot(["config", "programCounter", "adc", "counter", "userParameter"])
+    move = Rcb4BaseLib.CommandTypes.Move.value
+    before = emulator.CommandCounts.get(move, 0)
+
+    assert rcb4.readRamSnapshot(snapshot)
+
+    assert emulator.CommandCounts[move] - before == len(snapshot.Blocks)
+    assert snapshot["counter"] == tuple(range(1, 11))
+    assert snapshot["userParameter"] == tuple(range(-10, 10))
+    assert snapshot.motionPlayNum() == 0
+    assert abs(snapshot.voltage() - 7.4) < 0.1
+    assert snapshot.age() < 1.0
+
+
+def test_failed_read_keeps_the_previous_values(rcb4, emulator):
+    emulator.Ram[ADDR_COUNTER] = 7
+    snapshot = Rcb4BaseLib.RamSnapshot(["counter"])
+    assert rcb4.readRamSnapshot(snapshot)
+    timestamp = snapshot.Timestamp
+
+    emulator.Ram[ADDR_COUNTER] = 8
+    emulator.handleCommand = lambda cmd: None
+    assert not rcb4.readRamSnapshot(snapshot)
+
+    assert snapshot["counter"][0] == 7
+    assert snapshot.Timestamp == timestamp
@@ -0,0 +1,80 @@
+# coding: UTF-8
+"""RxParser(返信の区切り)と受信バッファから直接変換する読み込みのテスト"""
+from Rcb4BaseLib import Rcb4BaseLib
+
+RAM_TEST_ADDR = 0x0400  # テストで書き換えるRAMのアドレス (ボードの動作に使われていない場所)
+
+
+class ChunkedCom:
+    """受信データを決まった大きさずつ返すSerialポートの代わり"""
+
+    def __init__(self, data, chunk=3):
+        self.data = bytearray(data)
+        self.chunk = chunk
+
+    @property
+    def in_waiting(self):
+        return len(self.data)
+
+    def readinto(self, view):
+        n = min(len(view), len(self.data), self.chunk)
+        view[:n] = self.data[:n]
+        del self.data[:n]
+        return n
+
+
+def reply(payload):
+    """データ付きの返信コマンド"""
+    frame = bytearray([len(payload) + 3, Rcb4BaseLib.CommandTypes.Move.value]) + bytes(payload) + b"\x00"
+    frame[-1] = Rcb4BaseLib.CheckSum(frame)
+    return bytes(frame)
+
+
+def test_skips_noise_before_the_frame():
+    parser = Rcb4BaseLib.RxParser()
+    com = ChunkedCom(b"\xff\x00\x13" + reply(b"\x01\x02"))
+
+    assert bytes(parser.readFrame(com, 5, 0.1)) == reply(b"\x01\x02")
+    assert parser.SkipCount == 3
+
+
+def test_resyncs_after_a_bad_checksum():
+    parser = Rcb4BaseLib.RxParser()
+    broken = bytearray(reply(b"\x05\x06"))
+    broken[-1] ^= 0xFF
+    com = ChunkedCom(bytes(broken) + reply(b"\x07\x08"))
+
+    assert bytes(parser.readFrame(com, 5, 0.1)) == reply(b"\x07\x08")
+    assert parser.ChecksumErrorCount >= 1
+
+
+def test_frames_split_across_reads_and_back_to_back():
+    parser = Rcb4BaseLib.RxParser(size=300)
+    frames = [reply(bytes([i, i + 1])) for i in range(100)]
+    com = ChunkedCom(b"".join(frames), chunk=7)
+
+    assert [bytes(parser.readFrame(com, 5, 0.1)) for i in range(100)] == frames
+    assert parser.SkipCount == 0
+
+
+def test_returns_none_on_timeout():
+    parser = Rcb4BaseLib.RxParser()
+    com = ChunkedCom(reply(b"\x01\x02")[:3])
+
+    assert parser.readFrame(com, 5, 0.02) is None
+
+
+def test_read_parses_straight_from_the_receive_buffer(rcb4, emulator):
+    emulator.Ram[RAM_TEST_ADDR:RAM_TEST_ADDR + 4] = b"\x0a\x0b\x0c\x0d"
+    rx_len, tx_buf = Rcb4BaseLib.moveRamToComCmd(RAM_TEST_ADDR, 4)
+    seen = []
+
+    def parse(frame):
+        seen.append(type(frame))
+        return bytes(frame[2:6])
+
+    assert rcb4.synchronizeRead(tx_buf, rx_len, parse) == b"\x0a\x0b\x0c\x0d"
+    assert seen == [memoryview]  # 同期の送受信ではコピーせずに渡す
+    assert rcb4.moveRamToComCmdSynchronize(RAM_TEST_ADDR, 4) == (True, b"\x0a\x0b\x0c\x0d")
+    retf, positions = rcb4.readIcsPosBlock(0, 3)
+    assert retf and list(positions) == [7500] * 4
@@ -0,0 +1,123 @@
+# coding: UTF-8
+"""CommandSchedulerのテスト"""
+import threading
+import time
+from concurrent.futures import Future
+
+from Rcb4BaseLib import Rcb4BaseLib
+
+Priority = Rcb4BaseLib.CommandPriority
+
+
+class BlockingTransfer:
+    """最初の送受信をrelease()まで止めておき、送った順に記録する送受信関数"""
+
+    def __init__(self, fail_on=None):
+        self.sent = []
+        self.started = threading.Event()
+        self.__release = threading.Event()
+        self.__fail_on = fail_on
+
+    def release(self):
+        self.__release.set()
+
+    def __call__(self, tx_buf, rx_len):
+        self.started.set()
+        self.__release.wait(2)
+        if bytes(tx_buf) == self.__fail_on:
+            raise OSError("unplugged")
+        self.sent.append(bytes(tx_buf))
+        future = Future()
+        future.set_result(b"ok" + bytes(tx_buf))
+        return future
+
+
+def blocked_scheduler(transfer, deadlines=None):
+    """1つ目のコマンドを送信中にしたスケジューラ"""
+    scheduler = Rcb4BaseLib.CommandScheduler(transfer, deadlines)
+    first = scheduler.submit(b"first", 4, Priority.Motion)
+    assert transfer.started.wait(2)
+    return scheduler, first
+
+
+def test_sends_highest_priority_first():
+    transfer = BlockingTransfer()
+    scheduler, first = blocked_scheduler(transfer)
+    futures = [
+        scheduler.submit(b"telemetry", 4, Priority.Telemetry),
+        scheduler.submit(b"motion", 4, Priority.Motion),
+        scheduler.submit(b"servo", 4, Priority.Servo),
+        scheduler.submit(b"safety", 4, Priority.Safety),
+    ]
+
+    transfer.release()
+    for future in futures:
+        future.result(timeout=2)
+    scheduler.close()
+
+    assert transfer.sent == [b"first", b"safety", b"motion", b"telemetry"]  # Safetyが来たのでServoは捨てる
+    assert futures[2].result() == []
+
+
+def test_coalesced_commands_are_sent_once_with_the_newest_data():
+    transfer = BlockingTransfer()
+    scheduler, first = blocked_scheduler(transfer)
+    old = scheduler.submit(b"pose-1", 4, Priority.Servo, coalesceKey="legs")
+    new = scheduler.submit(b"pose-2", 4, Priority.Servo, coalesceKey="legs")
+
+    transfer.release()
+    assert old.result(timeout=2) == new.result(timeout=2) == b"okpose-2"
+    scheduler.close()
+    assert transfer.sent == [b"first", b"pose-2"]
+
+
+def test_expired_commands_are_failed_without_sending():
+    transfer = BlockingTransfer()
+    scheduler, first = blocked_scheduler(transfer)
+    late = scheduler.submit(b"late", 4, Priority.Servo, deadline=0.01)
+    time.sleep(0.05)
+
+    transfer.release()
+    assert late.result(timeout=2) == []
+    scheduler.close()
+    assert transfer.sent == [b"first"]
+
+
+def test_transfer_error_fails_in_flight_and_queued_then_recovers():
+    transfer = BlockingTransfer(fail_on=b"first")
+    scheduler, first = blocked_scheduler(transfer)
+    queued = [scheduler.submit(b"queued", 4, Priority.Telemetry), scheduler.submit(b"servo", 4, Priority.Servo, coalesceKey="legs")]
+
+    transfer.release()
+    assert first.result(timeout=2) == []
+    assert [future.result(timeout=2) for future in queued] == [[], []]
+    assert scheduler.submit(b"again", 4, Priority.Motion).result(timeout=2) == b"okagain"
+    scheduler.close()
+
+
+def test_synchronize_gives_up_when_the_scheduler_is_stuck(rcb4, monkeypatch):
+    assert rcb4.startScheduler()
+    rcb4.SchedulerWaitTimeout = 0.1
+    write = rcb4.com.write
+    stuck = threading.Event()
+    release = threading.Event()
+
+    def stuck_write(data):
+        stuck.set()
+        release.wait(2)
+        return write(data)
+
+    monkeypatch.setattr(rcb4.com, "write", stuck_write)
+    busy = threading.Thread(target=rcb4.checkAcknowledge)
+    busy.start()
+    assert stuck.wait(2)
+
+    start = time.monotonic()
+    assert not rcb4.checkAcknowledge()
+    assert time.monotonic() - start < 0.5
+
+    release.set()
+    busy.join()
+    monkeypatch.setattr(rcb4.com, "write", write)
+    assert rcb4.checkAcknowledge()
+    rcb4.stopScheduler()
@@ -0,0 +1,95 @@
+# coding: UTF-8
+"""RcbServoControllerの差分送信のテスト"""
+import pytest
+
+pytest.importorskip("numpy")
+
+from Rcb4BaseLib import Rcb4BaseLib
+from servo_controller import RcbServoController
+
+from conftest import drop_replies
+
+ARM = [(1, 1, -90, -180, 180), (2, 1, 90, 0, 180), (3, 1, 0, -135, 135)]
+ARM_MOVED = [(1, 1, -90, -180, 180), (2, 1, 120, 0, 180), (3, 1, 20, -135, 135)]
+SERVO_CMDS = (Rcb4BaseLib.CommandTypes.SingleServo.value, Rcb4BaseLib.CommandTypes.ConstFrameServo.value)
+
+
+def make_controller(emulator, pipeline_window):
+    controller = RcbServoController(emulator.Port, pipeline_window=pipeline_window, delta_deadband=8)
+    assert controller.is_connected
+    return controller
+
+
+def wait_acks(controller):
+    """パイプライン送信のACKが全部返ってくるまで待つ"""
+    if controller.pipeline_window > 0:
+        controller.rcb4.stopPipeline()
+        controller.rcb4.startPipeline(controller.pipeline_window)
+
+
+def commanded(controller, servos):
+    return [int(controller.commanded_positions[Rcb4BaseLib.icsNum2id(servo_id, sio)]) for servo_id, sio, *_ in servos]
+
+
+def test_delta_frame_sends_only_changed_servos(emulator):
+    controller = make_controller(emulator, 0)
+    try:
+        assert controller.move_multiple_servos(ARM, 5)
+        emulator.CommandCounts.clear()
+
+        assert controller.move_multiple_servos(ARM, 5)
+        assert controller.move_multiple_servos(ARM_MOVED, 5)
+
+        assert emulator.CommandCounts == {Rcb4BaseLib.CommandTypes.ConstFrameServo.value: 1}
+    finally:
+        controller.disconnect()
+
+
+@pytest.mark.parametrize("pipeline_window", [0, 2])
+def test_delta_frame_resends_after_a_lost_ack(emulator, pipeline_window):
+    controller = make_controller(emulator, pipeline_window)
+    try:
+        assert controller.move_multiple_servos(ARM, 5)
+        wait_acks(controller)
+        lost = []
+
+        def lose_first_servo_ack(cmd):
+            if cmd[1] in SERVO_CMDS and not lost:
+                lost.append(cmd)
+                return True
+            return False
+
+        drop_replies(emulator, lose_first_servo_ack)
+
+        controller.move_multiple_servos(ARM_MOVED, 5)
+        wait_acks(controller)
+        assert commanded(controller, ARM_MOVED)[1:] == [-1, -1]  # 届いたかわからないので未指令に戻す
+
+        emulator.CommandCounts.clear()
+        assert controller.move_multiple_servos(ARM_MOVED, 5)
+        wait_acks(controller)
+        assert emulator.CommandCounts == {Rcb4BaseLib.CommandTypes.ConstFrameServo.value: 1}
+        assert -1 not in commanded(controller, ARM_MOVED)
+    finally:
+        controller.disconnect()
+
+
+def test_single_change_uses_single_servo_and_full_refresh_resends_all(emulator):
+    controller = make_controller(emulator, 0)
+    controller.full_refresh_interval = 3
+    try:
+        assert controller.move_multiple_servos(ARM, 5)
+        controller.frames_since_full_refresh = 0
+        emulator.CommandCounts.clear()
+
+        one_moved = [ARM[0], ARM[1], ARM_MOVED[2]]
+        assert controller.move_multiple_servos(one_moved, 5)
+        assert emulator.CommandCounts == {Rcb4BaseLib.CommandTypes.SingleServo.value: 1}
+
+        emulator.CommandCounts.clear()
+        assert controller.move_multiple_servos(one_moved, 5)  # 変化なし
+        assert emulator.CommandCounts == {}
+        assert controller.move_multiple_servos(one_moved, 5)  # 3フレーム目は全部送り直す
+        assert emulator.CommandCounts == {Rcb4BaseLib.CommandTypes.ConstFrameServo.value: 1}
+    finally:
+        controller.disconnect()
@@ -0,0 +1,54 @@
+# coding: UTF-8
+"""ServoFrameとServoDataの配列から作るコマンドが同じになるかのテスト"""
+import time
+
+import pytest
+
+from Rcb4BaseLib import Rcb4BaseLib
+
+SERVOS = [(servo_id, sio, 7500 + servo_id * 100 * (1 if sio == 1 else -1)) for sio in (2, 1) for servo_id in range(8, 0, -1)]
+
+
+def servo_datas(servos):
+    return [Rcb4BaseLib.ServoData(servo_id, sio, data) for servo_id, sio, data in servos]
+
+
+@pytest.mark.parametrize("servos", [SERVOS, SERVOS[:1], SERVOS[3:9]])
+def test_const_frame_servo_bytes_match(servos):
+    _, from_datas = Rcb4BaseLib.runConstFrameServoCmd(servo_datas(servos), 50)
+    _, from_frame = Rcb4BaseLib.runConstFrameServoCmd(Rcb4BaseLib.ServoFrame(servos), 50)
+
+    assert bytes(from_frame) == bytes(from_datas)
+
+
+@pytest.mark.parametrize("build", [Rcb4BaseLib.setSpeedCmd, Rcb4BaseLib.setStretchCmd])
+def test_servo_param_bytes_match(build):
+    servos = [(servo_id, sio, servo_id * 10 + sio) for servo_id, sio, _ in SERVOS]
+
+    _, from_datas = build(servo_datas(servos))
+    _, from_frame = build(Rcb4BaseLib.ServoFrame(servos))
+
+    assert bytes(from_frame) == bytes(from_datas)
+
+
+def test_frame_tracks_servos_in_ics_order():
+    frame = Rcb4BaseLib.ServoFrame([(3, 1, 7000), (1, 2, 8000)])
+    frame.set(2, 1, 7100)
+    frame.set(3, 1, 7200)  # 同じサーボは値だけ上書き
+    frame.remove(1, 2)
+
+    assert frame.icsNums() == (4, 6)
+    assert frame.datas() == [7100, 7200]
+    assert len(frame) == 2
+    with pytest.raises(IndexError):
+        frame.setIcs(Rcb4BaseLib.IcsDeviceSize, 7500)
+
+
+def test_frame_moves_servos_on_the_board(rcb4, emulator):
+    frame = Rcb4BaseLib.ServoFrame([(1, 1, 8000), (2, 2, 7000)])
+
+    assert rcb4.setServoPos(frame, 1)
+
+    time.sleep(0.03)
+    assert rcb4.getSinglePos(1, 1) == (True, 8000)
+    assert rcb4.getSinglePos(2, 2) == (True, 7000)
@@ -0,0 +1,59 @@
+# coding: UTF-8
+"""synchronizeBatchと往復数を減らしたmotionPlayのテスト"""
+from Rcb4BaseLib import Rcb4BaseLib
+
+from conftest import drop_replies
+
+RAM_TEST_ADDR = 0x0400  # テストで書き換えるRAMのアドレス (ボードの動作に使われていない場所)
+
+
+def read_cmd(addr, size):
+    """RAM=>COMの(送信データ, 受信データ数)"""
+    rx_len, tx_buf = Rcb4BaseLib.moveRamToComCmd(addr, size)
+    return tx_buf, rx_len
+
+
+def count_writes(rcb4, monkeypatch):
+    """Serialポートへの書き込み回数を数える"""
+    writes = []
+    write = rcb4.com.write
+
+    def counted(data):
+        writes.append(bytes(data))
+        return write(data)
+
+    monkeypatch.setattr(rcb4.com, "write", counted)
+    return writes
+
+
+def test_synchronize_batch_returns_replies_in_order(rcb4, emulator, monkeypatch):
+    emulator.Ram[RAM_TEST_ADDR:RAM_TEST_ADDR + 4] = b"\x11\x22\x33\x44"
+    before = dict(emulator.CommandCounts)
+    writes = count_writes(rcb4, monkeypatch)
+
+    rxbufs = rcb4.synchronizeBatch([read_cmd(RAM_TEST_ADDR + i, 1) for i in range(4)])
+
+    assert [rxbuf[2] for rxbuf in rxbufs] == [0x11, 0x22, 0x33, 0x44]
+    move = Rcb4BaseLib.CommandTypes.Move.value
+    assert emulator.CommandCounts[move] - before.get(move, 0) == 4
+    assert len(writes) == 1  # 1回の書き込みでまとめて送る
+
+
+def test_synchronize_batch_fails_a_missing_reply(rcb4, emulator):
+    emulator.Ram[RAM_TEST_ADDR:RAM_TEST_ADDR + 3] = b"\x01\x02\x03"
+    last = bytes(read_cmd(RAM_TEST_ADDR + 2, 1)[0])  # 同じ長さの返信は区別できないので最後のものを落とす
+    drop_replies(emulator, lambda cmd: bytes(cmd) == last)
+
+    rxbufs = rcb4.synchronizeBatch([read_cmd(RAM_TEST_ADDR + i, 1) for i in range(3)])
+
+    assert [rxbuf[2] for rxbuf in rxbufs[:2]] == [0x01, 0x02]
+    assert len(rxbufs[2]) == 0
+
+
+def test_motion_play_takes_two_round_trips(rcb4, emulator, monkeypatch):
+    writes = count_writes(rcb4, monkeypatch)
+
+    assert rcb4.motionPlay(5)
+
+    assert len(writes) == 2  # 一時停止とプログラムカウンタのリセット / Callと再開
+    assert rcb4.getMotionPlayNum() == 5
@@ -0,0 +1,111 @@
+# coding: UTF-8
+"""コマンドごとの返信の待ち時間と、読み込みコマンドの送り直しのテスト"""
+import time
+
+import pytest
+
+from Rcb4BaseLib import Rcb4BaseLib
+
+from conftest import drop_replies
+
+RAM_TEST_ADDR = 0x0400  # テストで書き換えるRAMのアドレス (ボードの動作に使われていない場所)
+MOVE = Rcb4BaseLib.CommandTypes.Move.value
+
+
+def read_cmd(addr, size):
+    """RAM=>COMの(送信データ, 受信データ数)"""
+    rx_len, tx_buf = Rcb4BaseLib.moveRamToComCmd(addr, size)
+    return tx_buf, rx_len
+
+
+def drop_first(emulator, cmd_type):
+    """cmd_typeのコマンドの返信を1回だけ落とす"""
+    drops = []
+
+    def should_drop(cmd):
+        if cmd[1] == cmd_type and not drops:
+            drops.append(bytes(cmd))
+            return True
+        return False
+
+    drop_replies(emulator, should_drop)
+    return drops
+
+
+def test_timeout_follows_the_baudrate_and_slack(rcb4):
+    tx_buf, rx_len = read_cmd(RAM_TEST_ADDR, 4)
+    wire = (len(tx_buf) + rx_len) * 11 / 115200
+    assert rcb4.transactionTimeout(tx_buf, rx_len) == pytest.approx(wire + Rcb4BaseLib.TimeoutSlack)
+
+    rx_len, rom_buf = Rcb4BaseLib.moveRomToComCmd(Rcb4BaseLib.RomAddr.MotionRomAddress.value, 64)
+    rom_wire = (len(rom_buf) + rx_len) * 11 / 115200
+    assert rcb4.transactionTimeout(rom_buf, rx_len) == pytest.approx(rom_wire + Rcb4BaseLib.RomTimeoutSlack)
+
+    assert rcb4.setBaudrate(Rcb4BaseLib.ComBaudrates[0][0])
+    assert rcb4.transactionTimeout(tx_buf, 8) < wire + Rcb4BaseLib.TimeoutSlack
+
+
+def test_open_sets_slack_and_caps_the_timeout(emulator):
+    tx_buf, rx_len = read_cmd(RAM_TEST_ADDR, 4)
+    rcb4 = Rcb4BaseLib()
+    try:
+        assert rcb4.open(emulator.Port, 115200, 0.02, slack=0.5, romSlack=0.6)
+        assert rcb4.transactionTimeout(tx_buf, rx_len) == 0.02  # open()の待ち時間を超えない
+    finally:
+        rcb4.close()
+
+    rcb4 = Rcb4BaseLib()
+    try:
+        assert rcb4.open(emulator.Port, 115200, None, slack=0.5)
+        assert rcb4.transactionTimeout(tx_buf, rx_len) == pytest.approx((len(tx_buf) + rx_len) * 11 / 115200 + 0.5)
+    finally:
+        rcb4.close()
+
+
+def test_missing_reply_fails_after_the_command_timeout(rcb4, emulator):
+    sent = []
+
+    def drop_single_servo(cmd):
+        sent.append(cmd[1])
+        return cmd[1] == Rcb4BaseLib.CommandTypes.SingleServo.value
+
+    drop_replies(emulator, drop_single_servo)
+    start = time.monotonic()
+
+    assert not rcb4.setSingleServo(1, 1, 7500, 1)
+
+    assert time.monotonic() - start < 0.3  # open()の0.5秒までは待たない
+    assert sent == [Rcb4BaseLib.CommandTypes.SingleServo.value]  # 書き込みは送り直さない
+
+
+def test_read_is_resent_after_a_missing_reply(rcb4, emulator):
+    emulator.Ram[RAM_TEST_ADDR:RAM_TEST_ADDR + 2] = b"\x12\x34"
+    before = emulator.CommandCounts.get(MOVE, 0)
+    drops = drop_first(emulator, MOVE)
+
+    retf, data = rcb4.moveRamToComCmdSynchronize(RAM_TEST_ADDR, 2)
+
+    assert retf and bytes(data) == b"\x12\x34"
+    assert len(drops) == 1
+    assert emulator.CommandCounts[MOVE] - before == 1  # 落とした分は数えない
+
+
+def test_read_batch_resends_only_the_failed_reads(rcb4, emulator):
+    emulator.Ram[RAM_TEST_ADDR:RAM_TEST_ADDR + 3] = b"\x01\x02\x03"
+    last = bytes(read_cmd(RAM_TEST_ADDR + 2, 1)[0])  # 同じ長さの返信は区別できないので最後のものを落とす
+    drops = []
+
+    def drop_last_once(cmd):
+        if bytes(cmd) == last and not drops:
+            drops.append(cmd)
+            return True
+        return False
+
+    drop_replies(emulator, drop_last_once)
+    before = emulator.CommandCounts.get(MOVE, 0)
+
+    rxbufs = rcb4.synchronizeReadBatch([read_cmd(RAM_TEST_ADDR + i, 1) for i in range(3)])
+
+    assert [rxbuf[2] for rxbuf in rxbufs] == [0x01, 0x02, 0x03]
+    assert len(drops) == 1
+    assert emulator.CommandCounts[MOVE] - before == 3  # 落とした分は数えないので、送り直したのは1つだけ
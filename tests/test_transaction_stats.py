@@ -0,0 +1,67 @@
+# coding: UTF-8
+"""TransactionStats(送受信の記録)のテスト"""
+from Rcb4BaseLib import Rcb4BaseLib
+
+ACK = Rcb4BaseLib.CommandTypes.AckCheck.value
+
+
+def reply_ack_with(emulator, change):
+    """ACK確認の返信だけchange(reply)で作り変える"""
+    handle = emulator.handleCommand
+
+    def handle_command(cmd):
+        reply = handle(cmd)
+        return change(reply) if cmd[1] == ACK else reply
+
+    emulator.handleCommand = handle_command
+
+
+def ack_stats(rcb4):
+    return rcb4.getStats(reset=True)["commands"]["AckCheck"]
+
+
+def test_stats_are_off_until_started(rcb4):
+    assert rcb4.getStats() is None
+    assert rcb4.checkAcknowledge()
+    stats = rcb4.startStats()
+    assert rcb4.startStats() is stats
+    assert rcb4.getStats()["commands"] == {}
+
+
+def test_each_outcome_is_counted(rcb4, emulator):
+    rcb4.startStats()
+    assert rcb4.checkAcknowledge()
+    stat = ack_stats(rcb4)
+    assert (stat["count"], stat["ok"]) == (1, 1)
+    assert (stat["txBytes"], stat["rxBytes"]) == (4, 4)
+    assert sum(stat["latency"]) == 1
+    assert Rcb4BaseLib.TransactionStats.percentile(stat["latency"], 50) > 0
+
+    handle = emulator.handleCommand
+    outcomes = {
+        "nack": lambda reply: bytes([4, ACK, Rcb4BaseLib.AckType.Nack.value, (4 + ACK + Rcb4BaseLib.AckType.Nack.value) & 0xFF]),
+        "badChecksum": lambda reply: reply[:-1] + bytes([reply[-1] ^ 0xFF]),
+        "shortRead": lambda reply: reply[:-1],
+        "timeout": lambda reply: None,
+    }
+    for outcome, change in outcomes.items():
+        emulator.handleCommand = handle
+        reply_ack_with(emulator, change)
+        assert not rcb4.synchronizeAck(rcb4.acknowledgeCmd()[1])  # checkAcknowledge()はNACKでもTrue
+        stat = ack_stats(rcb4)
+        assert stat[outcome] == stat["count"] >= 1, outcome
+        assert stat["ok"] == 0
+
+    emulator.handleCommand = handle
+    assert rcb4.checkAcknowledge()  # 失敗した返信の残りは次の受信に影響しない
+
+
+def test_move_commands_are_counted_by_sub_command(rcb4):
+    rcb4.startStats()
+    assert rcb4.getMotionPlayNum() == 0
+
+    commands = rcb4.getStats()["commands"]
+
+    assert commands["Move.RamToCom"]["ok"] == 1
+    rcb4.stopStats()
+    assert rcb4.getStats() is None
@@ -0,0 +1,90 @@
+# coding: UTF-8
+"""ユーザカウンタとユーザ変数のまとめての読み書きのテスト"""
+import struct
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from Rcb4BaseLib import Rcb4BaseLib
+
+
+def transfer_count(emulator):
+    return sum(emulator.CommandCounts.values())
+
+
+def test_user_parameters_block_round_trip(rcb4, emulator):
+    values = np.arange(-10, 10) * 1000
+    before = transfer_count(emulator)
+
+    assert rcb4.setUserParmeters(values)
+    retf, read = rcb4.getUserParmeters()
+
+    assert transfer_count(emulator) - before == 2  # 書き込みと読み込みが1回ずつ
+    assert retf and read.dtype == np.int32 and (read == values).all()
+    addr = Rcb4BaseLib.RamAddr.UserParmeterRamAddress.value
+    assert struct.unpack_from("<20h", emulator.Ram, addr) == tuple(values)
+
+
+def test_user_parameters_sparse_write_keeps_the_gap(rcb4, emulator):
+    addr = Rcb4BaseLib.RamAddr.UserParmeterRamAddress.value
+    struct.pack_into("<20h", emulator.Ram, addr, *range(100, 120))
+    rcb4.startStats()
+
+    assert rcb4.setUserParmeters([7, 8, 6, -5], [3, 9, 4, 10])
+
+    # 連続した番号ごとに1つずつ書き込み、間の値は読み込まない
+    commands = rcb4.getStats()["commands"]
+    assert commands["Move.ComToRam"]["ok"] == 2
+    assert "Move.RamToCom" not in commands
+    retf, read = rcb4.getUserParmeters([3, 4, 5, 8, 9, 10])
+    assert retf and read.tolist() == [7, 6, 104, 107, 8, -5]
+
+
+def test_user_values_runs_are_sent_in_one_write(rcb4, emulator, monkeypatch):
+    writes = []
+    write = rcb4.com.write
+
+    def counted(data):
+        writes.append(bytes(data))
+        return write(data)
+
+    monkeypatch.setattr(rcb4.com, "write", counted)
+    before = transfer_count(emulator)
+
+    assert rcb4.setUserCounters([1, 2, 3, 4, 9], [1, 3, 5, 7, 3])  # 同じ番号は後の値
+
+    assert len(writes) == 1
+    assert transfer_count(emulator) - before == 4
+    addr = Rcb4BaseLib.RamAddr.CounterRamAddress.value
+    assert list(emulator.Ram[addr:addr + 7]) == [1, 0, 9, 0, 3, 0, 4]
+
+
+def test_user_values_out_of_range_are_not_sent(rcb4, emulator):
+    before = transfer_count(emulator)
+
+    assert not rcb4.setUserParmeters([40000], [1])
+    assert not rcb4.setUserParmeters([1], [21])
+    assert not rcb4.setUserCounters([256])
+    assert transfer_count(emulator) == before
+
+
+def test_user_counters_block_round_trip(rcb4, emulator):
+    assert rcb4.setUserCounters(range(10))
+    retf, read = rcb4.getUserCounters()
+    assert retf and read.tolist() == list(range(10))
+
+    assert rcb4.setUserCounters([255, 1], [10, 2])
+    retf, read = rcb4.getUserCounters([2, 10, 1])
+    assert retf and read.tolist() == [1, 255, 0]
+    assert rcb4.getUserCounter(10) == (True, 255)
+
+
+def test_user_values_without_numpy_fail_clearly(rcb4, monkeypatch):
+    import Rcb4BaseLib as module
+    monkeypatch.setattr(module, "np", None)
+
+    with pytest.raises(ImportError, match="numpy"):
+        rcb4.setUserCounters([1], [1])
+    with pytest.raises(ImportError, match="numpy"):
+        rcb4.getUserParmeters()